@@ -10,8 +10,16 @@ computer work dir
 dir is for pc list as same as it in cmd
 ls is for device simple support ls with no arg
 cp or copy [dir1] [dir2]
+cp -b [dir1] [dir2]  bulk copy of a folder of many small files as one tar stream
+cp -a [dir1] [dir2]  copy to or from every attached device at once, from a device
+                     into a folder per device
+sync [dir1] [dir2]  copy only new or changed files, by size and time
+sync -d [dir1] [dir2]  the same, and delete files in dir2 that are not in dir1
 cd [dir]
-link  means reconnect to device
+link  means reconnect to device, and go on with copies cut by a lost device
+devices  list the attached devices
+device [serial]  use that device, when more than one is attached
+                 (or start with: adb-command-line.py -s [serial])
 [dir n] means 2 args:the first 'c' means computer ,'d' means device
 next arg is the path ,eg: c c:\windows d /sdcard
 ''')
@@ -55,10 +63,119 @@ def adb_out(str):
     chcp 65001
     '''
     
-    
+
+serial=None
+def adb_bin():
+    return 'adb -s '+serial if serial else 'adb'
+def use_device(s):
+    global serial,adb_fs
+    if adb_fs is not None:
+        adb_fs.close()
+        adb_fs=None
+    serial=s
+
+adb_fs=None
+def device_fs():
+    global adb_fs
+    if adb_fs is None:
+        from adbfs import ADBFS
+        adb_fs=ADBFS(dircacheall=False,serial=serial)
+    return adb_fs
+def bulk_progress(files,size):
+    sys.stdout.write('\r%d files %.1f MB' % (files,size/1048576.0))
+    sys.stdout.flush()
+def bulk_cp(li):
+    fs=device_fs()
+    try:
+        if li[1]=='c' and li[3]=='d':
+            st=fs.push_dir(li[2],li[4],progress=bulk_progress,bulk=True)
+        elif li[1]=='d' and li[3]=='c':
+            st=fs.pull_dir(li[2],li[4],progress=bulk_progress,bulk=True)
+        elif li[1]=='d' and li[3]=='d':
+            fs.copydir(li[2],li[4],overwrite=True,bulk=True)
+            return ''
+        else:
+            return 'bulk copy needs the device on one side'
+    except Exception as e:
+        return str(e)
+    return '\n%d files %.1f MB in %.1fs, %.1f MB/s' % (st['files'],st['bytes']/1048576.0,st['seconds'],st['throughput']/1048576.0)
+
+def cp_all(li):
+    from adbfs import MultiADBFS
+    multi=MultiADBFS(dircacheall=False)
+    try:
+        if li[1]=='c' and li[3]=='d':
+            if os.path.isdir(li[2]):
+                res=multi.push_dir(li[2],li[4])
+            else:
+                dst=li[4]
+                first=next(iter(multi.devices.values()),None)
+                if first is not None and first.isdir(dst):
+                    dst=dst.rstrip('/')+'/'+os.path.basename(li[2])
+                res=multi.push_file(li[2],dst)
+        elif li[1]=='d' and li[3]=='c':
+            first=next(iter(multi.devices.values()),None)
+            if first is not None and first.isdir(li[2]):
+                res=multi.pull_dir(li[2],li[4])
+            else:
+                res=multi.pull_file(li[2],li[4])
+        else:
+            return 'copy to all devices needs the computer on one side'
+    except Exception as e:
+        return str(e)
+    finally:
+        multi.close()
+    lines=[]
+    for s,st in res.items():
+        if isinstance(st,Exception):
+            lines.append('%s error: %s' % (s,st))
+        else:
+            lines.append('%s %.1f MB in %.1fs, %.1f MB/s' % (s,st['bytes']/1048576.0,st['seconds'],st['throughput']/1048576.0))
+    return '\n'.join(lines) or 'no device'
+
+def file_progress(done,size):
+    sys.stdout.write('\r%.1f/%.1f MB' % (done/1048576.0,size/1048576.0))
+    sys.stdout.flush()
+def cp_file(li):
+    #single files go in checked chunks, a copy cut by a lost device goes on after link
+    fs=device_fs()
+    try:
+        if li[1]=='d':
+            if not fs.isfile(li[2]):
+                return adb_out(adb_bin()+' pull '+li[2]+' '+li[4])
+            dst=li[4]
+            if os.path.isdir(dst):
+                dst=os.path.join(dst,li[2].rsplit('/',1)[-1])
+            st=fs.pull_file(li[2],dst,progress=file_progress)
+        else:
+            if not os.path.isfile(li[2]):
+                return adb_out(adb_bin()+' push '+li[2]+' '+li[4])
+            dst=li[4]
+            if fs.isdir(dst):
+                dst=dst.rstrip('/')+'/'+os.path.basename(li[2])
+            st=fs.push_file(li[2],dst,progress=file_progress)
+    except Exception as e:
+        return 'error: %s\ntype link to go on with the copy' % e
+    return '\n%.1f MB in %.1fs, %.1f MB/s' % (st['bytes']/1048576.0,st['seconds'],st['throughput']/1048576.0)
+def sync(li,delete):
+    fs=device_fs()
+    try:
+        st=fs.sync_dir(li[2],li[4],to_device=li[3]=='d',delete=delete,progress=bulk_progress)
+    except Exception as e:
+        return 'error: %s' % e
+    return '\n%d of %d files sent, %.1f MB, %d deleted, %.1fs' % (st['files'],st['checked'],st['bytes']/1048576.0,st['deleted'],st['elapsed'])
+def resume_cp():
+    try:
+        for local,remote,st in device_fs().resume_transfers(progress=file_progress):
+            print('\n%s <-> %s resumed at %.1f MB' % (local,remote,st['resumed_from']/1048576.0))
+    except Exception as e:
+        print(e)
+
 def main():
+    if len(sys.argv)>2 and sys.argv[1]=='-s':
+        use_device(sys.argv[2])
     print('寻找设备')
-    backstr=adb_out('adb wait-for-device')
+    backstr=adb_out(adb_bin()+' wait-for-device')
     print('找到设备')
     dd='/'
     #input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding=None)
@@ -80,13 +197,13 @@ def main():
         li=command.split()
         if li[0]=='ls':
             if len(li)==1:
-                backstr=adb_out('adb shell ls '+dd)
+                backstr=adb_out(adb_bin()+' shell ls '+dd)
             elif len(li)==2:
                 li[1]=path_get(li[1],dd)
-                backstr=adb_out('adb shell ls '+li[1])
+                backstr=adb_out(adb_bin()+' shell ls '+li[1])
             else:
                 li[1]=path_get(li[1],dd)
-                backstr=adb_out('adb shell ls '+li[1:])
+                backstr=adb_out(adb_bin()+' shell ls '+li[1:])
             '''
             if len(li)==1:
                 back=os.popen('adb shell ls '+dd)
@@ -111,6 +228,12 @@ def main():
             back=subprocess.Popen(command,shell=True,stdout=subprocess.PIPE)
             backstr=back.stdout.read().decode('cp936')
         elif li[0]=='cp' or li[0]=='copy':
+            bulk=len(li)>1 and li[1]=='-b'
+            if bulk:
+                del li[1]
+            every=len(li)>1 and li[1]=='-a'
+            if every:
+                del li[1]
             if len(li)!=5:
                 print('not enough args,see help for more info')
                 continue
@@ -121,21 +244,38 @@ def main():
                 li[2]=path_get(li[2],dd)
             if li[3]=='d':
                 li[4]=path_get(li[4],dd)
-            if li[1]=='c' and li[3]=='d':
-                backstr=adb_out('adb push '+li[2]+' '+li[4])
-            elif li[1]=='d' and li[3]=='c':
-                backstr=adb_out('adb pull '+li[2]+' '+li[4])
+            if every:
+                backstr=cp_all(li)
+            elif bulk:
+                backstr=bulk_cp(li)
+            elif (li[1]=='c' and li[3]=='d') or (li[1]=='d' and li[3]=='c'):
+                backstr=cp_file(li)
             elif li[1]=='d' and li[3]=='d':
-                backstr=adb_out('adb shell cp -r '+li[2]+' '+li[4])
+                backstr=adb_out(adb_bin()+' shell cp -r '+li[2]+' '+li[4])
             elif li[1]=='c' and li[3]=='c':
                 backstr=adb_out('copy '+li[2]+' '+li[4])
+        elif li[0]=='sync':
+            delete=len(li)>1 and li[1]=='-d'
+            if delete:
+                del li[1]
+            if len(li)!=5:
+                print('not enough args,see help for more info')
+                continue
+            if li[1] not in ('c','d') or li[3] not in ('c','d') or li[1]==li[3]:
+                print('error args,see help for more info')
+                continue
+            if li[1]=='d':
+                li[2]=path_get(li[2],dd)
+            if li[3]=='d':
+                li[4]=path_get(li[4],dd)
+            backstr=sync(li,delete)
         elif li[0]=='cd':
             if len(li)!=3:
                print('not enough args,see help for more info')
                continue
             if li[1]=='d':
                 li[2]=path_get(li[2],dd)
-                backstr=adb_out('adb shell cd '+li[2])
+                backstr=adb_out(adb_bin()+' shell cd '+li[2])
                 if not re.search('No.*',backstr):
                     dd=li[2]
                 
@@ -156,7 +296,16 @@ def main():
                 continue
         elif li[0]=='link':
             print('重新连接')
-            backstr=adb_out('adb wait-for-device')
+            backstr=adb_out(adb_bin()+' wait-for-device')
+            resume_cp()
+        elif li[0]=='devices':
+            backstr=adb_out('adb devices')
+        elif li[0]=='device':
+            if len(li)!=2:
+                print('not enough args,see help for more info')
+                continue
+            use_device(li[1])
+            backstr=adb_out(adb_bin()+' wait-for-device')
         elif li[0]=='help':
             he()
             continue
@@ -169,7 +318,8 @@ def main():
             print('unknown command')
         if re.search('error: device .* not found',backstr):
             print('断开了，重新连接')
-            backstr=adb_out('adb wait-for-device')
+            backstr=adb_out(adb_bin()+' wait-for-device')
+            resume_cp()
         print(backstr)
 
     
@@ -0,0 +1,586 @@
+"""
+adbclient
+=========
+
+A pure python client for the adb server's TCP protocol (port 5037), so the
+device can be used without spawning an ``adb`` process per call, and a
+`FakeADBServer` that speaks enough of the same protocol to run adbfs against
+a local directory instead of a phone.
+
+"""
+
+__all__ = ['ADBClient', 'ADBError', 'FakeADBServer']
+
+import asyncio
+import os
+import socket
+import stat
+import struct
+import subprocess
+import threading
+import time
+
+import six
+from six.moves import socketserver
+
+
+ADB_PORT = 5037
+SYNC_DATA_MAX = 64 * 1024
+
+
+class ADBError(Exception):
+    """ The adb server or the device answered ``FAIL``. """
+
+
+def _recv_into(sock, view):
+    got, size = 0, len(view)
+    while got < size:
+        n = sock.recv_into(view[got:], size - got)
+        if not n:
+            raise EOFError('adb connection closed')
+        got += n
+
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    _recv_into(sock, memoryview(buf))
+    return bytes(buf)
+
+
+def _encode(s):
+    if isinstance(s, six.text_type):
+        return s.encode('utf-8')
+    return s
+
+
+def _request(sock, payload):
+    payload = _encode(payload)
+    sock.sendall(('%04x' % len(payload)).encode('ascii') + payload)
+
+
+def _read_status(sock):
+    status = _recv_exact(sock, 4)
+    if status == b'OKAY':
+        return
+    if status == b'FAIL':
+        size = int(_recv_exact(sock, 4), 16)
+        raise ADBError(_recv_exact(sock, size).decode('utf-8', 'replace'))
+    raise ADBError('unexpected adb reply %r' % status)
+
+
+class _SyncConnection(object):
+
+    """ One ``sync:`` service connection, reused for many requests. """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def _send(self, ident, data=b''):
+        data = _encode(data)
+        self.sock.sendall(ident + struct.pack('<I', len(data)) + data)
+
+    def _fail(self, size):
+        raise ADBError(_recv_exact(self.sock, size).decode('utf-8', 'replace'))
+
+    def stat(self, path):
+        """Return ``(mode, size, mtime)``, mode is 0 when path is missing."""
+        self._send(b'STAT', path)
+        reply = _recv_exact(self.sock, 16)
+        if reply[:4] != b'STAT':
+            raise ADBError('bad STAT reply %r' % reply[:4])
+        return struct.unpack('<III', reply[4:])
+
+    def listdir(self, path):
+        """Return a list of ``(name, mode, size, mtime)``."""
+        self._send(b'LIST', path)
+        entries = []
+        while True:
+            head = _recv_exact(self.sock, 20)
+            ident = head[:4]
+            if ident == b'DONE':
+                return entries
+            if ident != b'DENT':
+                raise ADBError('bad LIST reply %r' % ident)
+            mode, size, mtime, namelen = struct.unpack('<IIII', head[4:])
+            name = _recv_exact(self.sock, namelen).decode('utf-8', 'replace')
+            if name not in ('.', '..'):
+                entries.append((name, mode, size, mtime))
+
+    def recv(self, path):
+        """Yield the content of ``path`` as it arrives, in chunks of bytes."""
+        self._send(b'RECV', path)
+        while True:
+            head = _recv_exact(self.sock, 8)
+            ident, size = head[:4], struct.unpack('<I', head[4:])[0]
+            if ident == b'DATA':
+                yield _recv_exact(self.sock, size)
+            elif ident == b'DONE':
+                return
+            elif ident == b'FAIL':
+                self._fail(size)
+            else:
+                raise ADBError('bad RECV reply %r' % ident)
+
+    def recv_into(self, path, buf):
+        """Receive the content of ``path`` straight into the bytearray
+        ``buf``, growing it if the file is larger; return the byte count."""
+        self._send(b'RECV', path)
+        pos = 0
+        while True:
+            head = _recv_exact(self.sock, 8)
+            ident, size = head[:4], struct.unpack('<I', head[4:])[0]
+            if ident == b'DATA':
+                if pos + size > len(buf):
+                    buf.extend(bytes(max(size, len(buf))))
+                _recv_into(self.sock, memoryview(buf)[pos:pos + size])
+                pos += size
+            elif ident == b'DONE':
+                return pos
+            elif ident == b'FAIL':
+                self._fail(size)
+            else:
+                raise ADBError('bad RECV reply %r' % ident)
+
+    def read(self, path):
+        """Return the content of ``path`` as a bytearray, sized from a STAT
+        first so the data lands in place."""
+        mode, size, mtime = self.stat(path)
+        if not mode:
+            raise ADBError('No such file or directory: %s' % path)
+        buf = bytearray(size)
+        del buf[self.recv_into(path, buf):]
+        return buf
+
+    def send(self, path, chunks, mode=0o644, mtime=None):
+        """Write the byte ``chunks`` to ``path`` on the device."""
+        self._send(b'SEND', '%s,%d' % (path, stat.S_IFREG | mode))
+        for chunk in chunks:
+            view = memoryview(chunk)
+            for i in range(0, len(view), SYNC_DATA_MAX):
+                piece = view[i:i + SYNC_DATA_MAX]
+                self.sock.sendall(b'DATA' + struct.pack('<I', len(piece)))
+                self.sock.sendall(piece)
+        if mtime is None:
+            mtime = time.time()
+        self.sock.sendall(b'DONE' + struct.pack('<I', int(mtime)))
+        head = _recv_exact(self.sock, 8)
+        ident, size = head[:4], struct.unpack('<I', head[4:])[0]
+        if ident == b'FAIL':
+            self._fail(size)
+        if ident != b'OKAY':
+            raise ADBError('bad SEND reply %r' % ident)
+
+    def close(self):
+        try:
+            self._send(b'QUIT')
+        except (socket.error, EOFError):
+            pass
+        self.sock.close()
+
+
+class ADBClient(object):
+
+    """ Talks to the adb server directly instead of through the ``adb``
+    binary.
+
+    Each shell command opens a short lived socket to the local adb server,
+    which is far cheaper than a process.  Sync connections are kept open and
+    reused until `close` is called.
+    """
+
+    def __init__(self, host='127.0.0.1', port=ADB_PORT, serial=None, timeout=None):
+        self.host = host
+        self.port = port
+        self.serial = serial
+        self.timeout = timeout
+        self._sync = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def host_command(self, command):
+        """Run a ``host:`` service and return its length prefixed reply."""
+        sock = self._connect()
+        try:
+            _request(sock, command)
+            _read_status(sock)
+            size = int(_recv_exact(sock, 4), 16)
+            return _recv_exact(sock, size)
+        finally:
+            sock.close()
+
+    def version(self):
+        return int(self.host_command('host:version'), 16)
+
+    def devices(self):
+        lines = self.host_command('host:devices').decode('utf-8').splitlines()
+        return [tuple(l.split('\t', 1)) for l in lines if l.strip()]
+
+    def open_service(self, service):
+        """Connect to the device and start ``service``, return the socket."""
+        sock = self._connect()
+        try:
+            if self.serial:
+                _request(sock, 'host:transport:' + self.serial)
+            else:
+                _request(sock, 'host:transport-any')
+            _read_status(sock)
+            _request(sock, service)
+            _read_status(sock)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    async def open_stream(self, service, limit=2**16):
+        """`open_service` for asyncio, return a ``(reader, writer)`` pair."""
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=limit)
+        try:
+            for request in ('host:transport:' + self.serial if self.serial else 'host:transport-any',
+                            service):
+                request = _encode(request)
+                writer.write(('%04x' % len(request)).encode('ascii') + request)
+                status = await reader.readexactly(4)
+                if status == b'FAIL':
+                    size = int(await reader.readexactly(4), 16)
+                    raise ADBError((await reader.readexactly(size)).decode('utf-8', 'replace'))
+                if status != b'OKAY':
+                    raise ADBError('unexpected adb reply %r' % status)
+        except:
+            writer.close()
+            raise
+        return reader, writer
+
+    def exec_out(self, command):
+        """Yield the raw stdout of ``command`` in chunks of bytes."""
+        sock = self.open_service('exec:' + command)
+        try:
+            while True:
+                data = sock.recv(SYNC_DATA_MAX)
+                if not data:
+                    return
+                yield data
+        finally:
+            sock.close()
+
+    def shell(self, command):
+        """Run ``command`` on the device and return its output as bytes."""
+        return b''.join(self.exec_out(command))
+
+    def exec_in(self, command, chunks):
+        """Feed the byte ``chunks`` to the stdin of ``command`` and return
+        its output as bytes."""
+        sock = self.open_service('exec:' + command)
+        out = []
+        try:
+            try:
+                for chunk in chunks:
+                    sock.sendall(chunk)
+                sock.shutdown(socket.SHUT_WR)
+            except socket.error:
+                # the command quit before reading all of its input; what it
+                # printed says why
+                pass
+            try:
+                while True:
+                    data = sock.recv(SYNC_DATA_MAX)
+                    if not data:
+                        break
+                    out.append(data)
+            except socket.error:
+                pass
+        finally:
+            sock.close()
+        return b''.join(out)
+
+    def _sync_call(self, method, *args, **kwargs):
+        with self._lock:
+            conn = self._sync.pop() if self._sync else None
+        if conn is None:
+            conn = _SyncConnection(self.open_service('sync:'))
+        try:
+            ret = getattr(conn, method)(*args, **kwargs)
+        except:
+            # adbd ends the sync service after a FAIL, the connection is
+            # of no further use
+            conn.sock.close()
+            raise
+        with self._lock:
+            self._sync.append(conn)
+        return ret
+
+    def stat(self, path):
+        return self._sync_call('stat', path)
+
+    def listdir(self, path):
+        return self._sync_call('listdir', path)
+
+    def pull(self, path):
+        """Return the content of ``path`` as a bytearray."""
+        return self._sync_call('read', path)
+
+    def iter_pull(self, path):
+        """Yield the content of ``path`` in chunks, on a reused sync
+        connection.  The connection is only returned to the pool when the
+        generator is exhausted without a FAIL."""
+        with self._lock:
+            conn = self._sync.pop() if self._sync else None
+        if conn is None:
+            conn = _SyncConnection(self.open_service('sync:'))
+        done = False
+        try:
+            for chunk in conn.recv(path):
+                yield chunk
+            done = True
+        finally:
+            if done:
+                with self._lock:
+                    self._sync.append(conn)
+            else:
+                conn.sock.close()
+
+    def push(self, data, path, mode=0o644, mtime=None):
+        """Write ``data`` (bytes or an iterable of bytes) to ``path``."""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = [data]
+        return self._sync_call('send', path, data, mode, mtime)
+
+    def pull_file(self, path, local_path):
+        with open(local_path, 'wb') as f:
+            for chunk in self.iter_pull(path):
+                f.write(chunk)
+
+    def push_file(self, local_path, path):
+        st = os.stat(local_path)
+
+        def chunks():
+            with open(local_path, 'rb') as f:
+                while True:
+                    data = f.read(SYNC_DATA_MAX)
+                    if not data:
+                        return
+                    yield data
+        self.push(chunks(), path, stat.S_IMODE(st.st_mode), st.st_mtime)
+
+    def close(self):
+        with self._lock:
+            conns, self._sync = self._sync, []
+        for conn in conns:
+            conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Fake server
+# ---------------------------------------------------------------------------
+
+class _FakeADBHandler(socketserver.BaseRequestHandler):
+
+    def _recv_request(self):
+        size = int(_recv_exact(self.request, 4), 16)
+        return _recv_exact(self.request, size).decode('utf-8')
+
+    def _okay(self, data=None):
+        reply = b'OKAY'
+        if data is not None:
+            data = _encode(data)
+            reply += ('%04x' % len(data)).encode('ascii') + data
+        self.request.sendall(reply)
+
+    def _fail(self, msg):
+        msg = _encode(msg)
+        self.request.sendall(b'FAIL' + ('%04x' % len(msg)).encode('ascii') + msg)
+
+    def handle(self):
+        server = self.server.fake
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            service = self._recv_request()
+            if service == 'host:version':
+                return self._okay('%04x' % 41)
+            if service == 'host:devices':
+                return self._okay(''.join('%s\tdevice\n' % serial for serial in server.serials))
+            if service.startswith('host:transport'):
+                if service.startswith('host:transport:'):
+                    if service[15:] not in server.serials:
+                        return self._fail("device '%s' not found" % service[15:])
+                elif len(server.serials) > 1:
+                    return self._fail('more than one device/emulator')
+                self._okay()
+                service = self._recv_request()
+            else:
+                return self._fail('unknown host service')
+            if service == 'sync:':
+                self._okay()
+                return self._sync()
+            for prefix in ('exec:', 'shell:'):
+                if service.startswith(prefix):
+                    self._okay()
+                    return self._exec(service[len(prefix):] or 'sh', prefix == 'shell:')
+            self._fail('unknown service')
+        except (EOFError, socket.error):
+            pass
+
+    def _exec(self, command, merge_stderr):
+        sock = self.request
+        proc = subprocess.Popen(['sh', '-c', command], cwd=self.server.fake.root,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT if merge_stderr else subprocess.DEVNULL)
+
+        def feed():
+            try:
+                while True:
+                    data = sock.recv(SYNC_DATA_MAX)
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+                    proc.stdin.flush()
+            except (socket.error, IOError, OSError):
+                pass
+            try:
+                proc.stdin.close()
+            except (IOError, OSError):
+                pass
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+        try:
+            while True:
+                data = proc.stdout.read1(SYNC_DATA_MAX) if hasattr(proc.stdout, 'read1') else proc.stdout.read(4096)
+                if not data:
+                    break
+                sock.sendall(data)
+        except socket.error:
+            proc.kill()
+        proc.wait()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _sync(self):
+        sock = self.request
+        fake = self.server.fake
+        while True:
+            head = _recv_exact(sock, 8)
+            ident, size = head[:4], struct.unpack('<I', head[4:])[0]
+            if ident == b'QUIT':
+                return
+            arg = _recv_exact(sock, size).decode('utf-8')
+            if ident == b'STAT':
+                try:
+                    st = os.stat(fake.local_path(arg))
+                    reply = (st.st_mode, st.st_size & 0xffffffff, int(st.st_mtime))
+                except OSError:
+                    reply = (0, 0, 0)
+                sock.sendall(b'STAT' + struct.pack('<III', *reply))
+            elif ident == b'LIST':
+                local = fake.local_path(arg)
+                names = os.listdir(local) if os.path.isdir(local) else []
+                for name in ['.', '..'] + names:
+                    try:
+                        st = os.lstat(os.path.join(local, name))
+                    except OSError:
+                        continue
+                    bname = name.encode('utf-8')
+                    sock.sendall(b'DENT' + struct.pack('<IIII', st.st_mode, st.st_size & 0xffffffff,
+                                                       int(st.st_mtime), len(bname)) + bname)
+                sock.sendall(b'DONE' + b'\0' * 16)
+            elif ident == b'RECV':
+                try:
+                    with open(fake.local_path(arg), 'rb') as f:
+                        while True:
+                            data = f.read(SYNC_DATA_MAX)
+                            if not data:
+                                break
+                            sock.sendall(b'DATA' + struct.pack('<I', len(data)) + data)
+                    sock.sendall(b'DONE' + struct.pack('<I', 0))
+                except (IOError, OSError) as e:
+                    # like adbd, end the sync service after a FAIL
+                    msg = str(e).encode('utf-8')
+                    sock.sendall(b'FAIL' + struct.pack('<I', len(msg)) + msg)
+                    return
+            elif ident == b'SEND':
+                path, mode = arg.rsplit(',', 1)
+                local = fake.local_path(path)
+                error = None
+                try:
+                    f = open(local + '.adbfs-part', 'wb')
+                except (IOError, OSError) as e:
+                    f, error = None, e
+                while True:
+                    head = _recv_exact(sock, 8)
+                    ident, size = head[:4], struct.unpack('<I', head[4:])[0]
+                    if ident == b'DONE':
+                        mtime = size
+                        break
+                    data = _recv_exact(sock, size)
+                    if f is not None:
+                        f.write(data)
+                if f is not None:
+                    f.close()
+                    os.chmod(local + '.adbfs-part', int(mode) & 0o777)
+                    os.rename(local + '.adbfs-part', local)
+                    os.utime(local, (mtime, mtime))
+                    sock.sendall(b'OKAY' + struct.pack('<I', 0))
+                else:
+                    msg = str(error).encode('utf-8')
+                    sock.sendall(b'FAIL' + struct.pack('<I', len(msg)) + msg)
+                    return
+            else:
+                msg = b'unknown sync request'
+                sock.sendall(b'FAIL' + struct.pack('<I', len(msg)) + msg)
+                return
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeADBServer(object):
+
+    """ A stand-in adb server with a fake device, or several when ``serial``
+    is a list; they all share ``root``.
+
+    Sync requests (stat, list, pull, push) map device paths below ``root``.
+    Shell and exec services run ``sh -c`` on the host with ``root`` as the
+    working directory, so commands with absolute paths see the host
+    filesystem; use ``root='/'`` (the default) to keep both views the same.
+
+    >>> server = FakeADBServer().start()
+    >>> ADBClient(port=server.port).shell('echo hi')
+    b'hi\\n'
+    """
+
+    def __init__(self, root='/', serial='fake0001', host='127.0.0.1', port=0):
+        self.root = root
+        self.serials = [serial] if isinstance(serial, six.string_types) else list(serial)
+        self.serial = self.serials[0]
+        self._server = _ThreadingServer((host, port), _FakeADBHandler)
+        self._server.fake = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def local_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    import sys
+    server = FakeADBServer(root=sys.argv[1] if len(sys.argv) > 1 else '/',
+                           port=int(sys.argv[2]) if len(sys.argv) > 2 else ADB_PORT)
+    print('fake adb server on %s:%d' % (server.host, server.port))
+    server._server.serve_forever()
@@ -6,29 +6,59 @@ ADBFS is a filesystem for accessing an ADB
 
 """
 
-__all__ = ['ADBFS']
+__all__ = ['ADBFS', 'AsyncADBFS', 'MultiADBFS', 'list_devices']
 
 import sys
 
 import fs
 from fs.base import *
 from fs.errors import *
-from fs.path import pathsplit, abspath, dirname, recursepath, normpath, pathjoin, isbase, forcedir
+from fs.path import pathsplit, abspath, dirname, basename, recursepath, normpath, pathjoin, isbase, forcedir, splitext
 from fs import iotools
+from fs.mountfs import MountFS
 import subprocess
 import os ,tempfile
 
 
 
 import threading
+import asyncio
 import datetime
 import calendar
+import uuid
+import stat
+import signal
+import itertools
+import base64
+import tarfile
+import shutil
+import io
+import mmap
+import hashlib
+import json
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 
-from socket import error as socket_error
+from socket import error as socket_error, SHUT_RDWR
+from adbclient import ADBClient, ADBError
 from fs.local_functools import wraps
 
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 import six
 from six import PY3, b
+from six.moves import queue, shlex_quote
 
 if PY3:
     from six import BytesIO as StringIO
@@ -39,6 +69,11 @@ else:
         from io import StringIO
 
 import time
+import re
+import codecs
+import logging
+
+_log = logging.getLogger(__name__)
 
 
 # -----------------------------------------------
@@ -122,14 +157,32 @@ class ADBListData(object):
         self.id_type = ID_TYPE.UNKNOWN
         self.id = None
 
+# One entry of ``ls -l``, in both the old toolbox layout
+# (``perms owner group [size] date time name``) and the toybox one, which
+# adds a link count.  Matched against whole blocks with re.M.
+_LS_ENTRY = r'(?P<type>[-dlc])[^ \n]* +(?:[^ \n]+ +)*?(?:(?P<size>\d+) +)?(?P<date>\d{4}-\d\d-\d\d \d\d:\d\d) (?P<name>[^\n]*?)\r?$'
+_ls_entry_re = re.compile(r'^' + _LS_ENTRY, re.M)
+# ``ls -l -R`` adds a ``path:`` header line before every directory
+_ls_recursive_re = re.compile(r'^(?:' + _LS_ENTRY + r'|(?P<dir>[./][^\n]*?):\r?$)', re.M)
+
 class ADBListDataParser(object):
     """
     An ``ADBListDataParser`` object can be used to parse one or more lines
     that were retrieved by an ADB li -l command that was sent to a remote
     server.
+
+    ``parse_block`` and ``parse_recursive`` take the whole output of an
+    ``ls -l`` or ``ls -l -R`` at once and run a single regular expression
+    over it.  Dates are converted once per distinct minute.
     """
     def __init__(self):
-        pass
+        self._mtimes = {}
+
+    def _mtime(self, datestr):
+        mtime = self._mtimes.get(datestr)
+        if mtime is None:
+            mtime = self._mtimes[datestr] = time.mktime(time.strptime(datestr,'%Y-%m-%d %H:%M'))
+        return mtime
 
     def parse_line(self, adb_list_line):
         """
@@ -150,46 +203,183 @@ class ADBListDataParser(object):
     
     def _parse_unix_style(self, buf):
         result = ADBListData(buf)
-        c = buf[0]
-        tokens = buf.split()
+        m = _ls_entry_re.match(buf)
+        if m is None:
+            return result
+        c, size, datestr, name = m.group('type', 'size', 'date', 'name')
         if c == 'd':
             result.try_cwd = True
-            size=0
-            datestr=tokens[3]+' '+tokens[4]
-            #name=tokens[5]
-            result.name=buf.split(maxsplit=6)[-1]
         elif c == '-':
             result.try_retr = True
-            size=int(tokens[3])
-            datestr=tokens[4]+' '+tokens[5]
-            result.name=buf.split(maxsplit=7)[-1]
         elif c == 'l':
             result.try_retr = True
             result.try_cwd = True
-            size=0
-            datestr=tokens[3]+' '+tokens[4]
-            name=buf.split(maxsplit=5)[-1]
-            i = 0
-            while (i + 3) < len(name):
-                if name[i:i+4] == ' -> ':
-                    result.target = name[i+4:]
-                    result.name = name[:i]
-                    break
-                i += 1
+            name, arrow, target = name.partition(' -> ')
+            if arrow:
+                result.target = target
         elif c=='c':
             result.try_retr = True
-            size=0
-            datestr=tokens[5]+' '+tokens[6]
-            result.name=buf.split(maxsplit=8)[-1]
-        else:
-            return result
-        #result.name
+        result.name = name
         result.mtime_type = MTIME_TYPE.REMOTE_MINUTE
-        result.size = size
-        result.mtime=time.mktime(time.strptime(datestr,'%Y-%m-%d %H:%M'))
+        result.size = int(size) if c == '-' and size else 0
+        result.mtime = self._mtime(datestr)
 
         return result
 
+    def _entry(self, m):
+        c, size, datestr, name = m.group('type', 'size', 'date', 'name')
+        target = None
+        if c == 'l':
+            name, arrow, target = name.partition(' -> ')
+            target = target if arrow else None
+        return _DirEntry(name, c in 'dl', c != 'd',
+                         int(size) if c == '-' and size else 0,
+                         self._mtime(datestr), target)
+
+    def parse_block(self, block):
+        """
+        Parse the whole output of an ``ls -l`` of one directory.
+
+        :rtype: dict
+        :return: A mapping of names to `_DirEntry` objects, lines that are
+                 not entries (errors, ``total``) are skipped.
+        """
+        entry = self._entry
+        dirlist = {}
+        for m in _ls_entry_re.finditer(block):
+            info = entry(m)
+            if info.name not in ('.', '..'):
+                dirlist[info.name] = info
+        return dirlist
+
+    def parse_recursive_stream(self, chunks):
+        """
+        Like `parse_recursive`, but for an iterator of raw output ``chunks``.
+
+        Directories are yielded as soon as their block is complete (ls -R
+        ends every block with an empty line), so only the directory being
+        read is buffered.
+        """
+        decode = codecs.getincrementaldecoder('utf-8')('replace').decode
+        pieces = []
+        for chunk in chunks:
+            text = decode(chunk)
+            if not text:
+                continue
+            cut = text.rfind('\n\n')
+            if cut != -1:
+                block, rest = text[:cut + 1], text[cut + 2:]
+            elif text[0] == '\n' and pieces and pieces[-1].endswith('\n'):
+                block, rest = '', text[1:]
+            else:
+                pieces.append(text)
+                continue
+            pieces.append(block)
+            for item in self.parse_recursive(''.join(pieces)):
+                yield item
+            pieces = [rest] if rest else []
+        pieces.append(decode(b'', True))
+        for item in self.parse_recursive(''.join(pieces)):
+            yield item
+
+    def parse_recursive(self, text):
+        """
+        Parse the output of an ``ls -l -R`` in a single pass.
+
+        :return: An iterator of ``(path, dirlist)`` pairs, one per directory
+                 header, where ``dirlist`` is as returned by `parse_block`.
+        """
+        entry = self._entry
+        path = None
+        dirlist = {}
+        for m in _ls_recursive_re.finditer(text):
+            header = m.group('dir')
+            if header is not None:
+                if path is not None:
+                    yield path, dirlist
+                path = abspath(normpath(header.lstrip('.') or '/'))
+                dirlist = {}
+            elif path is not None:
+                info = entry(m)
+                if info.name not in ('.', '..'):
+                    dirlist[info.name] = info
+        if path is not None:
+            yield path, dirlist
+
+class _DirEntry(object):
+
+    """ The compact form of an `ADBListData` kept in the dircache.
+
+    Only the fields ADBFS uses are stored, in ``__slots__``, and the name is
+    interned.  It still reads like the ``ADBListData.__dict__`` it replaces:
+    ``entry['try_cwd']``, ``entry.get('size')``, ``'target' in entry`` and
+    ``entry.copy()`` (which returns a real dict) all work.
+    """
+
+    __slots__ = ('name', 'try_cwd', 'try_retr', 'size', 'mtime', 'target')
+
+    _keys = ('name', 'try_cwd', 'try_retr', 'size', 'mtime_type', 'mtime', 'id_type', 'id')
+
+    def __init__(self, name, try_cwd=False, try_retr=False, size=0, mtime=0, target=None):
+        self.name = sys.intern(name) if name is not None else None
+        self.try_cwd = try_cwd
+        self.try_retr = try_retr
+        self.size = size
+        self.mtime = mtime
+        self.target = target
+
+    @classmethod
+    def from_listdata(cls, data):
+        return cls(data.name, data.try_cwd, data.try_retr, data.size, data.mtime,
+                   getattr(data, 'target', None))
+
+    def keys(self):
+        if self.target is None:
+            return list(self._keys)
+        return list(self._keys) + ['target']
+
+    def __getitem__(self, key):
+        if key == 'mtime_type':
+            return MTIME_TYPE.REMOTE_MINUTE if self.mtime else MTIME_TYPE.UNKNOWN
+        if key == 'id_type':
+            return ID_TYPE.UNKNOWN
+        if key == 'id':
+            return None
+        if key in self.__slots__:
+            value = getattr(self, key)
+            if key != 'target' or value is not None:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.__slots__:
+            setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key == 'target':
+            self.target = None
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self):
+        return dict((key, self[key]) for key in self.keys())
+
+    def __repr__(self):
+        return '<_DirEntry %r>' % (self.copy(),)
+
+
+_parser = ADBListDataParser()
+
 # ---------------------------------------------------------------------------
 # Public Functions
 # ---------------------------------------------------------------------------
@@ -211,7 +401,7 @@ def parse_adb_list_line(adb_list_line):
              `ADBListData` object (e.g., one without a name).
     """
     
-    return ADBListDataParser().parse_line(adb_list_line)
+    return _parser.parse_line(adb_list_line)
 
 # ---------------------------------------------------------------------------
 # Private Functions
@@ -231,13 +421,474 @@ def fileadberrors(f):
         return ret
     return deco
 
+class _StreamReader(object):
+
+    """ Reads a device file front to back as it arrives.
+
+    A background thread pulls chunks from ``chunks`` (an iterator of bytes
+    from the transport's ``stream``) into a queue that holds at most
+    ``readahead`` chunks, so memory use does not depend on the file size.
+    """
+
+    def __init__(self, chunks, readahead=8):
+        self.pos = 0
+        self._chunks = chunks
+        self._queue = queue.Queue(max(1, readahead))
+        self._buf = bytearray()
+        self._eof = False
+        self._stop = False
+        self._thread = threading.Thread(target=self._fill)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fill(self):
+        try:
+            for chunk in self._chunks:
+                if self._stop:
+                    break
+                self._put(chunk)
+        except Exception as e:
+            self._put(e)
+        finally:
+            if hasattr(self._chunks, 'close'):
+                self._chunks.close()
+            self._put(None)
+
+    def _more(self):
+        if self._eof:
+            return False
+        chunk = self._queue.get()
+        if chunk is None:
+            self._eof = True
+            return False
+        if isinstance(chunk, Exception):
+            self._eof = True
+            raise chunk
+        self._buf += chunk
+        return True
+
+    def read(self, size=-1):
+        buf = self._buf
+        if size is None or size < 0:
+            while self._more():
+                pass
+            size = len(buf)
+        while len(buf) < size and self._more():
+            pass
+        data = bytes(buf[:size])
+        del buf[:size]
+        self.pos += len(data)
+        return data
+
+    def readline(self, size=-1):
+        buf = self._buf
+        start = 0
+        while True:
+            i = buf.find(b'\n', start)
+            if i != -1:
+                end = i + 1
+                break
+            if size is not None and 0 <= size <= len(buf):
+                end = size
+                break
+            start = len(buf)
+            if not self._more():
+                end = len(buf)
+                break
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self.read(end)
+
+    def skip(self, count):
+        while count > 0:
+            data = self.read(min(count, _ADBFile.blocksize))
+            if not data:
+                break
+            count -= len(data)
+
+    def close(self):
+        self._stop = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+class _ChunkWriter(object):
+
+    """ The writing end of a stream fed to the device.
+
+    ``write`` queues the data, at most ``backlog`` chunks of it, and
+    iterating the writer yields the chunks until `close`, so a producer
+    thread can write into a transport's ``exec_in``.
+    """
+
+    def __init__(self, backlog=8):
+        self._queue = queue.Queue(max(1, backlog))
+        self._aborted = False
+
+    def _put(self, item):
+        while not self._aborted:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise IOError('stream to the device was closed')
+
+    def write(self, data):
+        self._put(bytes(data))
+        return len(data)
+
+    def close(self, error=None):
+        """End the stream, raising ``error`` on the reading side if given."""
+        self._put(error or b'')
+
+    def abort(self):
+        self._aborted = True
+
+    def __iter__(self):
+        while True:
+            chunk = self._queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                return
+            yield chunk
+
+
+def _compressible(data, sample=64*1024, ratio=0.9):
+    """Guess from a sample of ``data`` whether compressing it pays off."""
+    head = data[:sample]
+    return len(zlib.compress(head, 1)) < len(head) * ratio
+
+# already compressed formats, not worth compressing again
+_COMPRESSED_EXTS = frozenset(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+                              '.mp4', '.mkv', '.webm', '.3gp', '.mov', '.avi',
+                              '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+                              '.zip', '.apk', '.jar', '.gz', '.tgz', '.bz2',
+                              '.xz', '.lz4', '.zst', '.7z', '.rar'))
+
+
+class _GzipCodec(object):
+
+    """ ``gzip`` on the device, zlib on the host. """
+
+    tool = 'gzip'
+    compress_cmd = 'gzip -1 -c'
+    decompress_cmd = 'gzip -d -c'
+    available = True
+    level = 1
+
+    def pack(self, data, chunk=1024*1024):
+        c = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        view = memoryview(data)
+        for i in range(0, len(data), chunk):
+            yield c.compress(view[i:i+chunk])
+        yield c.flush()
+
+    def unpack(self, chunks):
+        """Decompress ``chunks`` as they arrive; None if the stream was cut
+        short or never started."""
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = [d.decompress(chunk) for chunk in chunks]
+        out.append(d.flush())
+        return b''.join(out) if d.eof else None
+
+
+class _LZ4Codec(object):
+
+    """ ``lz4`` on the device, the optional lz4 package on the host. """
+
+    tool = 'lz4'
+    compress_cmd = 'lz4 -c'
+    decompress_cmd = 'lz4 -d -c'
+    available = lz4frame is not None
+
+    def pack(self, data, chunk=1024*1024):
+        c = lz4frame.LZ4FrameCompressor()
+        yield c.begin()
+        view = memoryview(data)
+        for i in range(0, len(data), chunk):
+            yield c.compress(view[i:i+chunk])
+        yield c.flush()
+
+    def unpack(self, chunks):
+        d = lz4frame.LZ4FrameDecompressor()
+        out = [d.decompress(chunk) for chunk in chunks]
+        return b''.join(out) if d.eof else None
+
+_CODECS = [codec() for codec in (_LZ4Codec, _GzipCodec) if codec.available]
+
+_CODEC_PROBE = 'for c in lz4 gzip; do command -v $c >/dev/null && echo $c; done'
+
+def _codecs_on_device(probe_output):
+    tools = probe_output.split()
+    return [codec for codec in _CODECS if codec.tool in tools]
+
+
+class _BlockCache(object):
+
+    """ An LRU cache of fixed size blocks of device files, keyed by
+    ``(path, version, block number)``, shared by all files of an `ADBFS`.
+
+    A file takes its ``version`` when opened: its size and listed mtime and
+    the cache's `generation`, which `bump` moves on whenever the device may
+    have changed behind our back.  Files opened before keep reading the
+    blocks of their version; the old blocks age out.
+    """
+
+    def __init__(self, maxblocks=64):
+        self.maxblocks = maxblocks
+        self.generation = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, version, index):
+        key = (path, version, index)
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self._blocks.move_to_end(key)
+            return data
+
+    def put(self, path, version, index, data):
+        key = (path, version, index)
+        with self._lock:
+            self._blocks[key] = data
+            self._blocks.move_to_end(key)
+            while len(self._blocks) > self.maxblocks:
+                self._blocks.popitem(last=False)
+
+    def bump(self):
+        with self._lock:
+            self.generation += 1
+
+    def invalidate(self, path):
+        with self._lock:
+            for key in [k for k in self._blocks if k[0] == path]:
+                del self._blocks[key]
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+class _FileCache(object):
+
+    """ Whole device files kept on the host between opens, in ``root``.
+
+    Entries are keyed by device serial, path, size and mtime, so a file that
+    changed on the device is a miss.  Least recently used files are dropped
+    past ``max_bytes``.  The index is replaced atomically and files are
+    written under a ``.part`` name first, so a crash leaves at worst an
+    orphan file, which the next start removes.
+
+    Processes may share a root, such as the CLI and a mounted `ADBFS`: the
+    index is written under a lock file, merged with what the others added,
+    and ``.part`` files younger than `part_grace` seconds are left to the
+    process writing them.
+    """
+
+    part_grace = 3600
+
+    def __init__(self, root, max_bytes, serial):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.serial = serial
+        self.size = 0
+        self._entries = OrderedDict()
+        self._dirs = {}
+        self._dropped = set()
+        self._lock = threading.Lock()
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self._load()
+
+    def _key(self, path, size, mtime):
+        key = '%s\0%s\0%d\0%d' % (self.serial, path, size, int(mtime))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.root, key)
+
+    @contextmanager
+    def _locked(self):
+        """Hold this cache's lock and, where there is ``fcntl``, the lock
+        file of the root, shared with other processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, 'lock'), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _merge(self):
+        """Take in the entries of the index on disk that other processes
+        added.  Call with `_locked`."""
+        try:
+            with open(os.path.join(self.root, 'index.json')) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            entries = []
+        for key, serial, path, size, mtime in entries:
+            if key in self._entries or key in self._dropped:
+                continue
+            names = self._dirs.get(dirname(path), {}) if serial == self.serial else {}
+            if basename(path) in names:
+                continue
+            try:
+                if os.path.getsize(self.filename(key)) != size:
+                    continue
+            except OSError:
+                continue
+            self._entries[key] = (serial, path, size, mtime)
+            self.size += size
+            if serial == self.serial:
+                self._dirs.setdefault(dirname(path), {})[basename(path)] = key
+
+    def _load(self):
+        with self._locked():
+            self._merge()
+            now = time.time()
+            for name in os.listdir(self.root):
+                if name in self._entries or name in ('index.json', 'lock'):
+                    continue
+                if name.endswith('.part'):
+                    try:
+                        if now - os.path.getmtime(self.filename(name)) < self.part_grace:
+                            continue
+                    except OSError:
+                        continue
+                self._unlink(name)
+
+    def _save(self):
+        """Write the index.  Call with `_locked`."""
+        self._merge()
+        index = os.path.join(self.root, 'index.json')
+        with open(index + '.tmp', 'w') as f:
+            json.dump([[key] + list(entry) for key, entry in self._entries.items()], f)
+        os.replace(index + '.tmp', index)
+
+    def _unlink(self, name):
+        try:
+            os.remove(os.path.join(self.root, name))
+        except OSError:
+            # still mapped by an open file on Windows, the next start cleans it
+            pass
+
+    def _drop(self, key):
+        serial, path, size, mtime = self._entries.pop(key)
+        self._dropped.add(key)
+        self.size -= size
+        names = self._dirs.get(dirname(path)) if serial == self.serial else None
+        if names and names.get(basename(path)) == key:
+            del names[basename(path)]
+        self._unlink(key)
+
+    def __contains__(self, path):
+        with self._lock:
+            return basename(path) in self._dirs.get(dirname(path), ())
+
+    def get(self, path, size, mtime):
+        """Return the local file holding ``path`` at this size and mtime, or
+        None."""
+        key = self._key(path, size, mtime)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if not os.path.exists(self.filename(key)):
+                # dropped by another process sharing the root
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+        return self.filename(key)
+
+    def new_part(self):
+        fd, name = tempfile.mkstemp(suffix='.part', dir=self.root)
+        os.close(fd)
+        return name
+
+    def add(self, path, size, mtime, part):
+        """Move the fully written file ``part`` into the cache; return its new
+        name, or None if it does not fit."""
+        if size > self.max_bytes or os.path.getsize(part) != size:
+            os.remove(part)
+            return None
+        key = self._key(path, size, mtime)
+        with self._locked():
+            old = self._dirs.get(dirname(path), {}).get(basename(path))
+            if old is not None:
+                self._drop(old)
+            os.replace(part, self.filename(key))
+            self._dropped.discard(key)
+            self._entries[key] = (self.serial, path, size, mtime)
+            self._dirs.setdefault(dirname(path), {})[basename(path)] = key
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+            self._save()
+        return self.filename(key)
+
+    def invalidate(self, path):
+        with self._locked():
+            key = self._dirs.get(dirname(path), {}).get(basename(path))
+            if key is not None:
+                self._drop(key)
+                self._save()
+
+    def refresh(self, path, dirlist):
+        """Drop the files of directory ``path`` that ``dirlist`` shows gone or
+        with another size or mtime."""
+        names = self._dirs.get(path)
+        if not names:
+            return
+        with self._locked():
+            stale = []
+            for name, key in names.items():
+                info = dirlist.get(name)
+                entry = self._entries[key]
+                # listings may only show the minute of the stat'ed mtime
+                mtime = int(entry[3])
+                if info is None or info['size'] != entry[2] or int(info['mtime']) not in (mtime, mtime - mtime % 60):
+                    stale.append(key)
+            for key in stale:
+                self._drop(key)
+            if stale:
+                self._save()
 
 
 class _ADBFile(object):
 
-    """ A file-like that provides access to a file being streamed over adb."""
+    """ A file-like that provides access to a file being streamed over adb.
+
+    Read only files are served from a memory map of the filesystem's
+    `_FileCache` when it has them.  Otherwise they are streamed from the
+    device by a `_StreamReader` when ``adbfs.stream_reads`` is set, and a
+    stream read to the end is kept in the file cache.  Once such a file is
+    seeked away from the stream, reads fetch just the blocks they need and
+    keep them in the filesystem's `_BlockCache`.  Other modes work on a
+    local copy that is pushed back on close.
+    """
 
     blocksize = 1024 * 64
+    # granularity of delta write-back, and the share of the file that may be
+    # dirty before close pushes the whole file instead
+    dirty_blocksize = 1024 * 4
+    dirty_ratio = 0.5
 
     def __init__(self, adbfs, path, mode):
         if not hasattr(self, '_lock'):
@@ -250,103 +901,2007 @@ class _ADBFile(object):
         self.file_size = None
         if 'r' in mode or 'a' in mode:
             self.file_size = adbfs.getsize(path)
-        rpath = tempfile.mktemp()
-        self._cmd_co('adb pull '+self.path+' '+rpath)
-        self.tmpop=open(rpath,mode)
         self.change=False
-    def _cmd_co(self,command):
-        back=subprocess.Popen(command,shell=True,stdout=subprocess.PIPE)
-        str=back.communicate()
-        back.kill()
-        print(str[0].decode('utf-8'))
-        return 
-    @fileadberrors
+        self._map = None
+        self._part = None
+        read_only = 'r' in mode and '+' not in mode
+        self.streaming = adbfs.stream_reads and read_only
+        cached = since = None
+        if 'r' in mode or 'a' in mode:
+            cached = adbfs._cached_copy(self.path)
+            since = adbfs._cache_since(self.path) if read_only and cached is None else None
+        if since is not None and not self.streaming:
+            cached = adbfs._cache_file(self.path, since)
+        if read_only and cached is not None:
+            self.streaming = False
+            self.tmpop = None
+            self._open_map(cached)
+            return
+        if self.streaming:
+            self.tmpop = None
+            self._reader = self._open_reader()
+            self._ranged_pos = None
+            info = adbfs._lookup(self.path) if adbfs.dircache.count else None
+            self._version = (self.file_size, info and info['mtime'], adbfs._block_cache.generation)
+            self._cache_since = since
+            if since is not None:
+                self._part = open(adbfs._file_cache().new_part(), 'wb')
+            return
+        self._dirty = []
+        rpath = tempfile.mktemp()
+        if cached is not None:
+            shutil.copyfile(cached, rpath)
+        elif 'r' in mode or 'a' in mode:
+            adbfs._adb.pull(self.path, rpath)
+        self.tmpop=open(rpath,mode.replace('t','').replace('b','')+'b')
+
+    def _open_map(self, name):
+        with open(name, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.file_size else b''
+        self._mapview = memoryview(self._map)
+
+    def _tee(self, data):
+        """Copy streamed ``data`` into the file cache; once the stream is at
+        the end, hand the copy to the cache."""
+        if self._part is None:
+            return data
+        self._part.write(data)
+        if self._reader.pos >= self.file_size:
+            part, self._part = self._part, None
+            part.close()
+            self.adbfs._cache_add(self.path, part.name, self._cache_since)
+        return data
+
+    def _drop_part(self):
+        if self._part is not None:
+            self._part.close()
+            os.remove(self._part.name)
+            self._part = None
+
+    def _open_reader(self):
+        return _StreamReader(self.adbfs._adb.stream(self.path, self.blocksize),
+                             self.adbfs.readahead)
+
+    def _read_range(self, size):
+        bs = self.blocksize
+        cache = self.adbfs._block_cache
+        pos = self._ranged_pos
+        end = self.file_size
+        if size is not None and size >= 0:
+            end = min(end, pos + size)
+        if end <= pos:
+            return b''
+        first, last = pos // bs, (end - 1) // bs
+        blocks = [cache.get(self.path, self._version, i) for i in range(first, last + 1)]
+        i = 0
+        while i < len(blocks):
+            if blocks[i] is not None:
+                i += 1
+                continue
+            j = i
+            while j < len(blocks) and blocks[j] is None:
+                j += 1
+            data = self.adbfs._adb.read_blocks(self.path, bs, first + i, j - i)
+            for k in range(i, j):
+                block = data[(k - i) * bs:(k - i + 1) * bs]
+                cache.put(self.path, self._version, first + k, block)
+                blocks[k] = block
+            i = j
+        data = b''.join(blocks)[pos - first * bs:end - first * bs]
+        self._ranged_pos += len(data)
+        return data
+
     def read(self, size=None):
-        print('read '+self.path)
+        if self._map is not None:
+            # the mapped cache copy needs neither the lock nor the device
+            pos = self.pos
+            end = len(self._map) if size is None or size < 0 else min(pos + size, len(self._map))
+            if end <= pos:
+                return b''
+            self.pos = end
+            return self._map[pos:end]
+        return self._read(size)
+
+    read1 = read
+
+    def readinto(self, b):
+        """Read into the writable buffer ``b``; from a mapped copy this is a
+        single copy out of the page cache."""
+        view = memoryview(b).cast('B')
+        if self._map is not None:
+            pos = self.pos
+            n = max(0, min(len(view), len(self._map) - pos))
+            view[:n] = self._mapview[pos:pos + n]
+            self.pos = pos + n
+            return n
+        if not self.streaming:
+            return self._readinto(view)
+        data = self._read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def readview(self, size=-1):
+        """Like `read`, but return a memoryview; zero-copy over a mapped
+        copy.  Views must be released before the file is closed."""
+        if self._map is None:
+            return memoryview(self.read(size))
+        pos = self.pos
+        end = len(self._map) if size is None or size < 0 else min(pos + size, len(self._map))
+        self.pos = max(pos, end)
+        return self._mapview[pos:max(pos, end)]
+
+    @fileadberrors
+    def _readinto(self, view):
+        return self.tmpop.readinto(view)
+
+    @fileadberrors
+    def _read(self, size=None):
+        if self.streaming:
+            if self._ranged_pos is not None:
+                return self._read_range(size)
+            return self._tee(self._reader.read(size))
         return self.tmpop.read(size)
         
     @fileadberrors
     def write(self, data):
-        print('write')
+        _log.debug('write %s', self.path)
+        if self.streaming or self._map is not None:
+            raise UnsupportedError('write', self.path)
+        if 'a' in self.mode:
+            self.tmpop.seek(0, fs.SEEK_END)
+        start = self.tmpop.tell()
         self.tmpop.write(data)
+        self._dirty.append((start, start + len(data)))
         self.change=True
+        return len(data)
     def __enter__(self):
         return self
 
-    def __exit__(self,exc_type,exc_value,traceback):
-        self.close()
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    @fileadberrors
+    def flush(self):
+        if self.streaming or self._map is not None:
+            return
+        self.adbfs._on_file_written(self.path)
+        self.tmpop.flush()
+    @fileadberrors
+    def seek(self, pos, where=fs.SEEK_SET):
+        if not self.streaming and self._map is None:
+            return self.tmpop.seek(pos, where)
+        current = self.tell()
+        if where == fs.SEEK_CUR:
+            pos += current
+        elif where == fs.SEEK_END:
+            pos += self.file_size
+        if self._map is not None:
+            self.pos = pos
+            return pos
+        if self._ranged_pos is None:
+            if pos == current:
+                return pos
+            if 0 <= pos - current <= self.blocksize * self.adbfs.readahead:
+                # the cached copy would have a hole
+                self._drop_part()
+                self._reader.skip(pos - current)
+                return pos
+            # leave the stream for ranged reads
+            self._drop_part()
+            self._reader.close()
+        self._ranged_pos = pos
+        return pos
+    @fileadberrors
+    def tell(self):
+        if self._map is not None:
+            return self.pos
+        if self.streaming:
+            if self._ranged_pos is not None:
+                return self._ranged_pos
+            return self._reader.pos
+        return self.tmpop.tell()
+
+    @fileadberrors
+    def truncate(self, size=None):
+        _log.debug('truncate %s', self.path)
+        if self.streaming or self._map is not None:
+            raise UnsupportedError('truncate', self.path)
+        self.adbfs._on_file_written(self.path)
+        old_size = os.fstat(self.tmpop.fileno()).st_size
+        if size is None:
+            size = self.tmpop.tell()
+        self.tmpop.truncate(size)
+        if size > old_size:
+            self._dirty.append((old_size, size))
+        self.change=True
+
+    def _dirty_blocks(self, size):
+        """Merge the dirty ranges, aligned to `dirty_blocksize` and clipped
+        to ``size``, into a list of ``(start, end)``."""
+        bs = self.dirty_blocksize
+        merged = []
+        for start, end in sorted(self._dirty):
+            start = start // bs * bs
+            end = min(-(-end // bs) * bs, size)
+            if start >= end:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def _write_back(self):
+        size = os.fstat(self.tmpop.fileno()).st_size
+        ranges = self._dirty_blocks(size)
+        dirty = sum(end - start for start, end in ranges)
+        if self.file_size is None or 'w' in self.mode or dirty > size * self.dirty_ratio:
+            # one plain push, which leaves the old file in place if it
+            # fails; the resumable push_file is for explicit copies
+            self.adbfs._adb.push(self.tmpop.name, self.path)
+            return
+        adb = self.adbfs._adb
+        bs = self.dirty_blocksize
+        with open(self.tmpop.name, 'rb') as local:
+            for start, end in ranges:
+                local.seek(start)
+                adb.write_blocks(self.path, bs, start // bs, local.read(end - start))
+        if size < self.file_size:
+            adb.shell('truncate -s %d %s' % (size, _quote(self.path)))
+        
+    @fileadberrors
+    def close(self):
+        _log.debug('close %s', self.path)
+        if self._map is not None:
+            self._mapview.release()
+            if self.file_size:
+                try:
+                    self._map.close()
+                except BufferError:
+                    # a readview is still held, the map goes with it
+                    pass
+            self.closed = True
+            return
+        if self.streaming:
+            self._drop_part()
+            self._reader.close()
+            self.closed = True
+            return
+        if self.change==True:
+            with self.adbfs._path_locks.hold(abspath(self.path)):
+                self.adbfs._on_file_written(self.path)
+                self.tmpop.flush()
+                self._write_back()
+                self.adbfs.refresh_dircache(dirname(self.path))
+        self.tmpop.close()
+        os.remove(self.tmpop.name)
+        self.closed = True
+
+    def __next__(self):
+        return self.readline()
+
+    @fileadberrors
+    def readline(self, size=None):
+        if self._map is not None:
+            end = self._map.find(b'\n', self.pos) + 1 or len(self._map)
+            if size is not None and size >= 0:
+                end = min(end, self.pos + size)
+            return self.read(end - self.pos)
+        if self.streaming and self._ranged_pos is None:
+            return self._tee(self._reader.readline(size))
+        return next(iotools.line_iterator(self, size))
+
+    def __iter__(self):
+        if self._map is not None or (self.streaming and self._ranged_pos is None):
+            return iter(self.readline, b'')
+        return iotools.line_iterator(self)
+
+
+# lets the stream wrappers of fs.iotools hand readinto / read1 straight
+# through instead of copying via read
+io.IOBase.register(_ADBFile)
+
+
+def adberrors(f):
+    # no lock here: the caches lock themselves, and calls that change the
+    # device take the locks of their paths, see `pathlocked`
+    @wraps(f)
+    def deco(self, *args, **kwargs):
+        _log.debug('%s%r', f.__name__, args)
+        self._enter_dircache()
+        try:
+            try:
+                ret = f(self, *args, **kwargs)
+            except Exception as e:
+                self._translate_exception(args[0] if args else '', e)
+        finally:
+            self._leave_dircache()
+        return ret
+    return deco
+
+
+def pathlocked(*indices):
+    """Hold the `_PathLocks` of the path arguments at ``indices`` (default
+    the first) for the call, and drop the listings of their directories
+    once the device has changed: the calls drop them before they change
+    it, which a listing fetched meanwhile would outlive."""
+    indices = indices or (0,)
+    def wrap(f):
+        @wraps(f)
+        def deco(self, *args, **kwargs):
+            paths = [abspath(normpath(args[i])) for i in indices if i < len(args)]
+            with self._path_locks.hold(*paths):
+                try:
+                    return f(self, *args, **kwargs)
+                finally:
+                    self.refresh_dircache(*[dirname(path) for path in paths])
+        return deco
+    return wrap
+
+
+class _PathLocks(object):
+
+    """ One lock per device path, made on demand and dropped when unused.
+
+    `hold` takes several in sorted order, so two calls on the same paths
+    cannot deadlock.  Calls nest from a directory to its children only.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, *paths):
+        paths = sorted(set(paths))
+        with self._lock:
+            for path in paths:
+                entry = self._locks.get(path)
+                if entry is None:
+                    entry = self._locks[path] = [threading.RLock(), 0]
+                entry[1] += 1
+            locks = [self._locks[path][0] for path in paths]
+        try:
+            for lock in locks:
+                lock.acquire()
+            try:
+                yield
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+        finally:
+            with self._lock:
+                for path in paths:
+                    entry = self._locks[path]
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._locks[path]
+
+
+class _RWLock(object):
+
+    """ Many readers or one writer.  Waiting writers go first, so a steady
+    stream of readers cannot starve them.  Not reentrant. """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def _encode(s):
+    if isinstance(s, str):
+        return s.encode('utf-8')
+    return s
+
+def _quote(path):
+    return shlex_quote(path)
+
+def _arg_batches(paths, limit=64*1024):
+    """Split ``paths`` into quoted argument strings short enough for one
+    device command line."""
+    batch, size = [], 0
+    for path in paths:
+        arg = _quote(path)
+        if batch and size + len(arg) + 1 > limit:
+            yield ' '.join(batch)
+            batch, size = [], 0
+        batch.append(arg)
+        size += len(arg) + 1
+    if batch:
+        yield ' '.join(batch)
+
+def _tar_member_safe(root, member):
+    """Whether ``member`` of a tar from the device stays below ``root``:
+    its name and, for a link, what it points to.  A link out of ``root``
+    would let a later member of the same name be written through it."""
+    names = [member.name]
+    if member.islnk():
+        names.append(member.linkname)
+    elif member.issym():
+        names.append(os.path.join(os.path.dirname(member.name), member.linkname))
+    for name in names:
+        target = os.path.realpath(os.path.join(root, name))
+        if target != root and not target.startswith(root + os.sep):
+            return False
+    return True
+
+def _adb_args(serial=None):
+    return ['adb', '-s', serial] if serial else ['adb']
+
+def _serial_name(serial):
+    """``serial`` made safe as a file or directory name; network devices
+    have serials such as ``192.168.1.5:5555``."""
+    return re.sub(r'[^\w.-]', '_', serial)
+
+def _copydir_command(src, dst, bulk=False):
+    if bulk:
+        cmd = 'mkdir -p %s && tar -cf - -C %s . | tar -xf - -C %s'
+    else:
+        cmd = 'mkdir -p %s && cp -r %s/. %s'
+    return cmd % (_quote(dst), _quote(src), _quote(dst))
+
+def _ls_command(path):
+    return 'ls -l '+_quote(forcedir(path))
+
+def _stat_command(follow=False):
+    return ('stat -L -c ' if follow else 'stat -c ') + _quote('%s %Y %f %n')
+
+def _parse_stat(out):
+    """Yield ``(path, _DirEntry)`` for each line of `_stat_command` output."""
+    for line in out.splitlines():
+        parts = line.split(' ', 3)
+        if len(parts) != 4 or not parts[0].isdigit():
+            continue
+        size, mtime, mode, name = parts
+        mode = int(mode, 16)
+        isdir = stat.S_ISDIR(mode)
+        yield name, _DirEntry(basename(name), isdir, not isdir,
+                              int(size) if stat.S_ISREG(mode) else 0,
+                              float(mtime))
+
+def _resolve_links(path, dirlist, resolved):
+    """Replace the links of the listing of ``path`` by the `_DirEntry` of
+    their targets from ``resolved``."""
+    for name in [name for name in dirlist if 'target' in dirlist[name]]:
+        info=resolved.get(pathjoin(path, name))
+        if info is None:
+            continue
+        for key in ('try_cwd', 'try_retr', 'size', 'mtime'):
+            dirlist[name][key] = info[key]
+        del dirlist[name]['target']
+
+class _DirCache(object):
+
+    """ Directory listings keyed by path, with LRU eviction.
+
+    The cache holds at most ``max_entries`` directories and roughly
+    ``max_bytes`` of listing data; a listing older than ``ttl`` seconds is
+    treated as missing so that changes made on the device show up again.
+    ``hits``, ``misses``, ``evictions`` and ``expirations`` count what
+    happened to lookups.
+
+    Lookups share a `_RWLock`, changes take it alone; among lookups, a
+    small lock guards the LRU order and the counters.  Every invalidation
+    moves the generation of its directory on, to the next number of one
+    sequence; `put` with the `token` taken before a listing was fetched
+    refuses a listing that an invalidation overtook.
+    """
+
+    # rough memory cost of one `_DirEntry` and its dict slot
+    entry_size = 160
+
+    def __init__(self, max_entries=10000, max_bytes=64*1024*1024, ttl=60):
+        self.count = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.generation = 0
+        self._seq = 0
+        self._generations = {}
+        # (sequence number, path) of the latest pop_tree calls; a token
+        # older than the first of them is refused everywhere
+        self._trees = deque(maxlen=256)
+        self._trees_floor = 0
+        self._entries = OrderedDict()
+        self._lock = _RWLock()
+        self._lru_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+
+    def addref(self):
+        with self._count_lock:
+            self.count += 1
+            return self.count
+    def decref(self):
+        with self._count_lock:
+            self.count -= 1
+            return self.count
+
+    def _dirlist_size(self, dirlist):
+        return sys.getsizeof(dirlist) + sum(len(name) for name in dirlist) + self.entry_size * len(dirlist)
+
+    def get(self, path, default=None):
+        with self._lock.read():
+            entry = self._entries.get(path)
+            if entry is not None and (self.ttl is None or entry[1] >= time.time()):
+                with self._lru_lock:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                return entry[0]
+        with self._lru_lock:
+            self.misses += 1
+        if entry is not None:
+            with self._lock.write():
+                if self._entries.get(path) is entry:
+                    self._remove(path)
+                    self.expirations += 1
+        return default
+
+    def __getitem__(self, path):
+        dirlist = self.get(path)
+        if dirlist is None:
+            raise KeyError(path)
+        return dirlist
+
+    def __setitem__(self, path, dirlist):
+        self.put(path, dirlist)
+
+    def token(self, path=None):
+        """The generation of ``path`` now, or without a path the latest one
+        of the cache, which a listing of any directory can be put with."""
+        if path is None:
+            return self.generation, self._seq
+        return self.generation, self._generations.get(path, 0)
+
+    def _invalidated(self, path):
+        self._seq += 1
+        self._generations[path] = self._seq
+
+    def _stale(self, path, token):
+        generation, seq = token
+        if generation != self.generation or self._generations.get(path, 0) > seq or seq < self._trees_floor:
+            return True
+        for tree_seq, tree in reversed(self._trees):
+            if tree_seq <= seq:
+                return False
+            if isbase(path, tree):
+                return True
+        return False
+
+    def _invalidated_all(self):
+        self.generation += 1
+        self._generations.clear()
+
+    def put(self, path, dirlist, token=None):
+        """Store ``dirlist``, unless ``token`` is given and ``path`` was
+        invalidated since; return whether it was stored."""
+        with self._lock.write():
+            if token is not None and self._stale(path, token):
+                return False
+            self._remove(path)
+            nbytes = self._dirlist_size(dirlist)
+            expires = time.time() + self.ttl if self.ttl is not None else None
+            self._entries[path] = (dirlist, expires, nbytes)
+            self.nbytes += nbytes
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     self.nbytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+        return entry
+
+    def pop(self, path, default=None):
+        with self._lock.write():
+            self._invalidated(path)
+            entry = self._remove(path)
+        return default if entry is None else entry[0]
+
+    def pop_tree(self, paths):
+        """Drop the listings of ``paths`` and everything below them."""
+        with self._lock.write():
+            for path in paths:
+                self._seq += 1
+                if len(self._trees) == self._trees.maxlen:
+                    self._trees_floor = self._trees[0][0]
+                self._trees.append((self._seq, path))
+            for cached_path in [p for p in self._entries if any(isbase(p, path) for path in paths)]:
+                self._invalidated(cached_path)
+                self._remove(cached_path)
+
+    def keys(self):
+        with self._lock.read():
+            return list(self._entries.keys())
+
+    def clear(self):
+        with self._lock.write():
+            self._invalidated_all()
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+
+class _SingleFlight(object):
+
+    """ Runs one call per key at a time: callers asking for a key that is
+    already being fetched wait for that result instead of repeating the
+    adb round-trip.  ``calls`` counts the calls run, ``suppressed`` the
+    callers that shared one.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.suppressed = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+                self.calls += 1
+            else:
+                self.suppressed += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+
+class _NegativeCache(object):
+
+    """ Paths known not to exist, so probes such as ``desktop.ini`` or
+    ``Thumbs.db`` do not cost another ``ls -l`` once the listing of their
+    directory has been evicted or has expired.
+
+    Entries live ``ttl`` seconds, at most ``max_entries`` are kept.
+    ``saved`` counts the adb round-trips that were avoided.
+    """
+
+    def __init__(self, max_entries=4096, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.saved = 0
+        self._paths = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, path):
+        with self._lock:
+            expires = self._paths.get(path)
+            if expires is None:
+                return False
+            if self.ttl is not None and expires < time.time():
+                del self._paths[path]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._paths)
+
+    def add(self, path):
+        with self._lock:
+            self._paths.pop(path, None)
+            self._paths[path] = time.time() + self.ttl if self.ttl is not None else 0
+            while len(self._paths) > self.max_entries:
+                self._paths.popitem(last=False)
+
+    def discard(self, path):
+        with self._lock:
+            self._paths.pop(path, None)
+
+    def discard_children(self, dirs):
+        """Forget the paths directly inside any of ``dirs``."""
+        dirs = set(dirs)
+        with self._lock:
+            for path in [p for p in self._paths if dirname(p) in dirs]:
+                del self._paths[path]
+
+    def discard_tree(self, dirs):
+        """Forget the paths anywhere below any of ``dirs``."""
+        with self._lock:
+            for path in [p for p in self._paths if any(isbase(p, d) for d in dirs)]:
+                del self._paths[path]
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+
+
+class _Prefetcher(object):
+
+    """ Warms the dircache of an `ADBFS` from background threads.
+
+    Directories are fetched by priority: the subdirectories of a directory
+    the user just listed (`OPENED`), then their children (`CHILD`), then the
+    rest of the tree (`TREE`).  At most ``workers`` listings run at once and
+    workers wait while any foreground call of the filesystem is running.
+    """
+
+    OPENED, CHILD, TREE = 0, 1, 2
+
+    def __init__(self, adbfs, workers=1):
+        self.adbfs = adbfs
+        self.fetched = 0
+        self._queue = queue.PriorityQueue()
+        self._queued = {}
+        self._seq = itertools.count()
+        self._busy = 0
+        self._stop = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._threads = []
+        for _ in range(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def add(self, path, priority):
+        with self._lock:
+            if self._queued.get(path, self.TREE + 1) <= priority:
+                return
+            self._queued[path] = priority
+            self._queue.put((priority, next(self._seq), path))
+
+    def _add_subdirs(self, path, dirlist, priority):
+        for name, info in list(dirlist.items()):
+            if info['try_cwd'] and 'target' not in info:
+                self.add(pathjoin(path, name), priority)
+
+    def opened(self, path, dirlist):
+        """The user listed ``path``, fetch its subdirectories first."""
+        self._add_subdirs(path, dirlist, self.OPENED)
+
+    def enter(self):
+        with self._lock:
+            self._busy += 1
+
+    def leave(self):
+        with self._lock:
+            self._busy -= 1
+            if not self._busy:
+                self._idle.notify_all()
+
+    def _work(self):
+        adbfs = self.adbfs
+        while True:
+            priority, _, path = self._queue.get()
+            with self._lock:
+                if self._stop:
+                    return
+                if self._queued.get(path) != priority:
+                    # already fetched, or queued again with a better priority
+                    continue
+                del self._queued[path]
+                while self._busy and not self._stop:
+                    self._idle.wait(0.5)
+            dirlist = adbfs.dircache.get(path)
+            if dirlist is None:
+                try:
+                    dirlist = adbfs._fetch_listing(path)
+                except Exception:
+                    continue
+                self.fetched += 1
+            elif priority == self.TREE:
+                continue
+            self._add_subdirs(path, dirlist, self.CHILD if priority == self.OPENED else self.TREE)
+
+    def close(self):
+        with self._lock:
+            self._stop = True
+            self._idle.notify_all()
+        for _ in self._threads:
+            self._queue.put((-1, next(self._seq), None))
+
+
+class _ChangeWatcher(object):
+
+    """ Follows what anything but this filesystem (apps, the camera) changes
+    below ``roots`` on the device and drops just the cached listings and
+    files it touches, see `ADBFS._device_changed`.
+
+    With ``inotifyd`` on the device (toybox, busybox) and at most
+    `max_watches` directories, the events stream from long-running
+    ``inotifyd`` processes that watch every directory; directories created
+    later get an ``inotifyd`` of their own, checked for every ``interval``
+    seconds.  Otherwise ``find -newer`` a stamp file runs every ``interval``
+    seconds, and cached directories it reports are listed again at once.
+    ``events`` counts the changes seen.
+    """
+
+    # subfile created, deleted, moved in or out, written, attributes
+    # changed; the watched directory deleted, moved or unwatchable
+    MASK = 'ndymweDMx'
+    max_watches = 4096
+
+    def __init__(self, adbfs, roots, interval=2, mode='auto'):
+        self.adbfs = adbfs
+        self.roots = [abspath(normpath(root)) for root in roots]
+        self.interval = interval
+        self.mode = mode
+        self.events = 0
+        self._watched = set()
+        self._pids = set()
+        self._lost = []
+        self._fresh = []
+        self._stamp = None
+        self._rescan = threading.Event()
+        self._rescan.set()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        adbfs = self.adbfs
+        while not self._stop.is_set():
+            try:
+                if self.mode == 'auto':
+                    found = adbfs._adb_text('command -v inotifyd >/dev/null && echo found').strip()
+                    self.mode = 'inotify' if found == 'found' else 'poll'
+                if self.mode == 'inotify':
+                    self._watch_new()
+                if self.mode == 'poll':
+                    self._poll()
+            except Exception:
+                # what changed while the device did not answer is unknown
+                if not self._stop.is_set():
+                    adbfs.clear_dircache(*self.roots)
+            self._stop.wait(self.interval)
+
+    def _watch_new(self):
+        """Start an ``inotifyd`` for the directories nothing watches yet."""
+        adbfs = self.adbfs
+        with self._lock:
+            lost, self._lost = self._lost, []
+        if lost:
+            adbfs.clear_dircache(*lost)
+            self._rescan.set()
+        # listings fetched before the watches of new directories were in
+        # place may have missed a change
+        for path in self._fresh:
+            adbfs.refresh_dircache(path)
+        self._fresh = []
+        if not self._rescan.is_set():
+            return
+        self._rescan.clear()
+        out = adbfs._adb_text('find %s -type d 2>/dev/null' % ' '.join(map(_quote, self.roots)))
+        dirs = set(abspath(normpath(line)) for line in out.splitlines() if line)
+        if len(dirs) > self.max_watches:
+            self.mode = 'poll'
+            self._kill()
+            return
+        with self._lock:
+            new = sorted(dirs - self._watched)
+            self._watched.update(new)
+        batch, size = [], 0
+        for path in new:
+            if batch and size + len(path) > 32*1024:
+                self._follow(batch)
+                batch, size = [], 0
+            batch.append(path)
+            size += len(path) + len(self.MASK) + 4
+        if batch:
+            self._follow(batch)
+        self._fresh = new
+
+    def _follow(self, dirs):
+        t = threading.Thread(target=self._stream, args=(dirs,))
+        t.daemon = True
+        t.start()
+
+    def _stream(self, dirs):
+        """Apply the events of one ``inotifyd`` watching ``dirs`` until it
+        exits."""
+        command = 'echo $$; exec inotifyd - ' + ' '.join(_quote(path + ':' + self.MASK) for path in dirs)
+        pid = None
+        buf = b''
+        try:
+            for chunk in self.adbfs._adb.exec_out(command):
+                lines = (buf + chunk).split(b'\n')
+                buf = lines.pop()
+                for line in lines:
+                    line = line.decode('utf-8', 'replace')
+                    if pid is None:
+                        pid = line.strip()
+                        with self._lock:
+                            self._pids.add(pid)
+                    else:
+                        self._event(line)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._pids.discard(pid)
+                if not self._stop.is_set():
+                    self._watched.difference_update(dirs)
+                    self._lost.extend(dirs)
+
+    def _event(self, line):
+        parts = line.split('\t')
+        if len(parts) < 2:
+            return
+        events, path = parts[0], parts[1]
+        self.events += 1
+        if 'o' in events:
+            # the kernel queue overflowed, events were dropped
+            self.adbfs.clear_dircache(*self.roots)
+            return
+        if len(parts) > 2:
+            path = pathjoin(path, parts[2])
+            if 'n' in events or 'y' in events:
+                # may be a directory to watch
+                self._rescan.set()
+        elif set(events) & set('DMx'):
+            with self._lock:
+                self._watched.discard(path)
+            self._rescan.set()
+        self.adbfs._device_changed(path, tree=bool(set(events) & set('dmDMx')))
+
+    def _poll(self):
+        adbfs = self.adbfs
+        if self._stamp is None:
+            stamp = adbfs._adb_text('mktemp 2>/dev/null').strip() or '/data/local/tmp/.adbfs_watch_' + uuid.uuid4().hex
+            adbfs._adb_text('touch %s %s' % (_quote(stamp), _quote(stamp + '.1')))
+            self._stamp = stamp
+            return
+        older, old, new = (_quote(self._stamp + suffix) for suffix in ('', '.1', '.n'))
+        # -newer the stamp of two polls ago, so that a change in the same
+        # second as the last poll is seen on filesystems with 1 s mtimes
+        out = adbfs._adb_text('touch %s && find %s -newer %s 2>/dev/null; mv -f %s %s; mv -f %s %s' % (
+            new, ' '.join(map(_quote, self.roots)), older, old, older, new, old))
+        for line in out.splitlines():
+            if line:
+                self.events += 1
+                self._changed(abspath(normpath(line)))
+
+    def _changed(self, path):
+        """``path`` changed; a cached directory is listed again and the
+        subdirectories gone from it are dropped."""
+        adbfs = self.adbfs
+        old = adbfs.dircache.pop(path, None)
+        adbfs._device_changed(path)
+        if old is None:
+            return
+        try:
+            new = adbfs._fetch_listing(path)
+        except Exception:
+            adbfs.clear_dircache(path)
+            return
+        gone = [pathjoin(path, name) for name, info in old.items()
+                if info['try_cwd'] and not (name in new and new[name]['try_cwd'])]
+        if gone:
+            adbfs.clear_dircache(*gone)
+
+    def _kill(self):
+        with self._lock:
+            pids = [pid for pid in self._pids if pid.isdigit()]
+        if pids:
+            self.adbfs._adb_text('kill %s 2>/dev/null' % ' '.join(pids))
+
+    def close(self):
+        self._stop.set()
+        try:
+            self._kill()
+            if self._stamp:
+                self.adbfs._adb_text('rm -f %s %s %s' % tuple(
+                    _quote(self._stamp + suffix) for suffix in ('', '.1', '.n')))
+        except Exception:
+            pass
+
+
+class _TransferEngine(object):
+
+    """ Copies a directory tree between the host and the device.
+
+    The whole tree is planned first.  Files of at least `large_file` bytes
+    are sent on their own; smaller files are batched per directory into one
+    transfer of up to `batch_files` files or `batch_bytes` bytes.  Up to
+    ``workers`` transfers run at once.  ``progress``, if given, is called
+    with the number of files and bytes done after every transfer.
+
+    `pull_tar` / `push_tar` are the bulk mode: the whole tree goes as one tar
+    stream, which pays off for trees of many small files.
+    """
+
+    large_file = 8 * 1024 * 1024
+    batch_files = 64
+    batch_bytes = 8 * 1024 * 1024
+
+    def __init__(self, adbfs, workers=4, progress=None):
+        self.adbfs = adbfs
+        self.workers = max(1, workers)
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def plan_push(self, local_dir, remote_dir):
+        """Return the remote dirs to create and the files to send, as
+        ``(local path, remote dir, size)``."""
+        dirs, files = [remote_dir], []
+        for root, dirnames, filenames in os.walk(local_dir):
+            rel = os.path.relpath(root, local_dir)
+            rdir = remote_dir if rel == '.' else pathjoin(remote_dir, rel.replace(os.sep, '/'))
+            dirs.extend(pathjoin(rdir, name) for name in dirnames)
+            for name in filenames:
+                local_path = os.path.join(root, name)
+                files.append((local_path, rdir, os.path.getsize(local_path)))
+        return dirs, files
+
+    def plan_pull(self, remote_dir, local_dir):
+        """Return the local dirs to create and the files to fetch, as
+        ``(remote path, local dir, size)``, from one ``ls -l -R``."""
+        dirs, files = [local_dir], []
+        chunks = self.adbfs._adb.exec_out('ls -l -R '+_quote(remote_dir)+' 2>/dev/null')
+        for dirpath, dirlist in _parser.parse_recursive_stream(chunks):
+            rel = dirpath[len(remote_dir):].strip('/')
+            ldir = os.path.join(local_dir, *rel.split('/')) if rel else local_dir
+            for name, info in dirlist.items():
+                if 'target' in info:
+                    continue
+                if info['try_cwd']:
+                    dirs.append(os.path.join(ldir, name))
+                else:
+                    files.append((pathjoin(dirpath, name), ldir, info['size']))
+        return dirs, files
+
+    def device_tree(self, remote_dir):
+        """Return the set of directories and a dict of files to ``(size,
+        mtime)`` under ``remote_dir``, as '/' separated relative paths, from
+        one ``ls -l -R``."""
+        dirs, files = set(), {}
+        chunks = self.adbfs._adb.exec_out('ls -l -R '+_quote(remote_dir)+' 2>/dev/null')
+        for dirpath, dirlist in _parser.parse_recursive_stream(chunks):
+            rel = dirpath[len(remote_dir):].strip('/')
+            for name, info in dirlist.items():
+                if 'target' in info:
+                    continue
+                path = rel + '/' + name if rel else name
+                if info['try_cwd']:
+                    dirs.add(path)
+                else:
+                    files[path] = (info['size'], info['mtime'])
+        return dirs, files
+
+    def host_tree(self, local_dir):
+        """Like `device_tree`, for a host directory, walked with scandir."""
+        dirs, files = set(), {}
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(local_dir, rel) if rel else local_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                path = rel + '/' + entry.name if rel else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.add(path)
+                    stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat()
+                    files[path] = (st.st_size, st.st_mtime)
+        return dirs, files
+
+    @staticmethod
+    def changed(src_files, dst_files):
+        """Relative paths of the files missing from ``dst_files`` or with
+        another size or mtime.  ``ls -l`` only shows minutes, so mtimes are
+        compared to the minute."""
+        out = []
+        for path, (size, mtime) in src_files.items():
+            other = dst_files.get(path)
+            if other is None or other[0] != size or int(other[1]) // 60 != int(mtime) // 60:
+                out.append(path)
+        return sorted(out)
+
+    def _jobs(self, files):
+        jobs, batches = [], {}
+        for f in files:
+            if f[2] >= self.large_file:
+                jobs.append([f])
+                continue
+            batch = batches.get(f[1])
+            if batch is None or len(batch[0]) >= self.batch_files or batch[1] + f[2] > self.batch_bytes:
+                batch = batches[f[1]] = [[], 0]
+                jobs.append(batch[0])
+            batch[0].append(f)
+            batch[1] += f[2]
+        # biggest first, so a large file does not start last
+        jobs.sort(key=lambda job: -sum(f[2] for f in job))
+        return jobs
+
+    def _count(self, files, size):
+        self.files += files
+        self.bytes += size
+        if self.progress:
+            self.progress(self.files, self.bytes)
+
+    def _stats(self, start):
+        seconds = time.time() - start
+        return {'files': self.files,
+                'bytes': self.bytes,
+                'seconds': seconds,
+                'throughput': self.bytes / seconds if seconds else 0.0}
+
+    def pull_tar(self, remote_dir, local_dir):
+        """Stream ``tar c`` of ``remote_dir`` from the device and unpack it
+        into ``local_dir`` as it arrives; mtimes are kept."""
+        start = time.time()
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        root = os.path.realpath(local_dir)
+        reader = _StreamReader(self.adbfs._adb.exec_out('tar -cf - -C %s .' % _quote(remote_dir)),
+                               self.adbfs.readahead)
+        try:
+            with tarfile.open(fileobj=reader, mode='r|') as tar:
+                for member in tar:
+                    if not _tar_member_safe(root, member):
+                        raise OperationFailedError('pull_tar', member.name, msg="Unsafe path in archive: %(path)s")
+                    try:
+                        if hasattr(tarfile, 'data_filter'):
+                            tar.extract(member, root, filter='data')
+                        else:
+                            tar.extract(member, root)
+                    except getattr(tarfile, 'FilterError', ()) as e:
+                        raise OperationFailedError('pull_tar', member.name, msg="Unsafe member in archive: %s" % e)
+                    if member.isfile():
+                        self._count(1, member.size)
+        finally:
+            reader.close()
+        return self._stats(start)
+
+    def push_tar(self, local_dir, remote_dir):
+        """Pack ``local_dir`` with tarfile and stream it into ``tar x`` on
+        the device under ``remote_dir``; mtimes are kept."""
+        start = time.time()
+        writer = _ChunkWriter()
+
+        def count(info):
+            if info.isfile():
+                self._count(1, info.size)
+            return info
+
+        errors = []
+
+        def pack():
+            try:
+                with tarfile.open(fileobj=writer, mode='w|', bufsize=64*1024) as tar:
+                    tar.add(local_dir, '.', filter=count)
+            except Exception as e:
+                errors.append(e)
+            try:
+                writer.close(errors[0] if errors else None)
+            except IOError:
+                # the device side stopped reading, its error is raised
+                pass
+        packer = threading.Thread(target=pack)
+        packer.daemon = True
+        packer.start()
+        try:
+            self.adbfs._adb.exec_in('mkdir -p %s && tar -xf - -C %s' % (_quote(remote_dir), _quote(remote_dir)),
+                                    writer)
+        finally:
+            writer.abort()
+            packer.join()
+        if errors:
+            raise errors[0]
+        return self._stats(start)
+
+    def _run_job(self, transfer, job):
+        transfer([f[0] for f in job], job[0][1])
+        with self._lock:
+            self._count(len(job), sum(f[2] for f in job))
+
+    def run(self, dirs, files, push):
+        """Create ``dirs`` and copy ``files`` as planned; return a dict of
+        ``files``, ``bytes``, ``seconds`` and ``throughput`` (bytes/s)."""
+        adb = self.adbfs._adb
+        start = time.time()
+        if push:
+            for args in _arg_batches(dirs):
+                adb.shell('mkdir -p '+args)
+            transfer = adb.push_many
+        else:
+            for d in dirs:
+                if not os.path.isdir(d):
+                    os.makedirs(d)
+            transfer = adb.pull_many
+        with ThreadPoolExecutor(self.workers) as pool:
+            for future in [pool.submit(self._run_job, transfer, job) for job in self._jobs(files)]:
+                future.result()
+        return self._stats(start)
+
+
+class _Journal(object):
+
+    """ Checkpoints of chunked transfers: one small JSON file per transfer
+    under ``root``, replaced atomically after every verified chunk. """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _file(self, push, local_path, remote_path):
+        key = '%d\0%s\0%s' % (push, os.path.abspath(local_path), remote_path)
+        return os.path.join(self.root, hashlib.md5(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, push, local_path, remote_path):
+        try:
+            with open(self._file(push, local_path, remote_path)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, record):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        name = self._file(record['push'], record['local'], record['remote'])
+        with open(name + '.tmp', 'w') as f:
+            json.dump(record, f)
+        os.replace(name + '.tmp', name)
+
+    def remove(self, record):
+        try:
+            os.remove(self._file(record['push'], record['local'], record['remote']))
+        except OSError:
+            pass
+
+    def pending(self):
+        if not os.path.isdir(self.root):
+            return []
+        records = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.root, name)) as f:
+                        records.append(json.load(f))
+                except (IOError, OSError, ValueError):
+                    pass
+        return records
+
+
+class _ResumableTransfer(object):
+
+    """ Copies one file between the host and the device in `chunk_size`
+    chunks.  Every chunk is checked against ``md5sum`` (or ``sha1sum``) on
+    the device and then recorded in the `_Journal`, so a copy cut short by
+    a lost device continues from its last verified chunk, as long as the
+    source has the same size and mtime.
+    """
+
+    chunk_size = 4 * 1024 * 1024
+    # unit of dd offsets, see the transports' read_blocks / write_blocks
+    blocksize = 64 * 1024
+
+    def __init__(self, adbfs, push, local_path, remote_path):
+        self.adbfs = adbfs
+        self.push = push
+        self.local_path = os.path.abspath(local_path)
+        self.remote_path = abspath(normpath(remote_path))
+
+    def _remote_stat(self):
+        info = self.adbfs._stat_entries([self.remote_path]).get(self.remote_path)
+        return None if info is None else (info['size'], int(info['mtime']))
+
+    def _remote_hash(self, offset, tool):
+        out = self.adbfs._adb_text('dd if=%s bs=%d skip=%d count=1 2>/dev/null | %s' %
+                                   (_quote(self.remote_path), self.chunk_size,
+                                    offset // self.chunk_size, tool))
+        return out.split()[0] if out.strip() else ''
+
+    def _read_chunk(self, offset, size):
+        if self.push:
+            with open(self.local_path, 'rb') as f:
+                f.seek(offset)
+                return f.read(size)
+        bs = self.blocksize
+        return self.adbfs._adb.read_blocks(self.remote_path, bs, offset // bs, (size + bs - 1) // bs)
+
+    def _write_chunk(self, offset, data):
+        if self.push:
+            self.adbfs._adb.write_blocks(self.remote_path, self.blocksize, offset // self.blocksize, data)
+        else:
+            with open(self.local_path, 'r+b') as f:
+                f.seek(offset)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _resumable(self, record, source):
+        if record is None or [record['size'], record['mtime']] != list(source):
+            return False
+        if self.push:
+            target = self._remote_stat()
+            return target is not None and target[0] >= record['done']
+        return os.path.isfile(self.local_path) and os.path.getsize(self.local_path) >= record['done']
+
+    def run(self, progress=None):
+        """Copy the file, continuing an earlier attempt if the journal has
+        one; return a dict of ``bytes`` sent, ``resumed_from``, ``seconds``
+        and ``throughput``."""
+        adbfs = self.adbfs
+        journal = adbfs._journal
+        tool = adbfs._hash_tool()
+        if self.push:
+            st = os.stat(self.local_path)
+            source = (st.st_size, int(st.st_mtime))
+        else:
+            source = self._remote_stat()
+            if source is None:
+                raise ResourceNotFoundError(self.remote_path)
+        size = source[0]
+        record = journal.load(self.push, self.local_path, self.remote_path)
+        if not self._resumable(record, source):
+            record = {'push': self.push, 'local': self.local_path, 'remote': self.remote_path,
+                      'size': size, 'mtime': source[1], 'done': 0}
+            if self.push:
+                adbfs._adb.shell(': > %s' % _quote(self.remote_path))
+            else:
+                open(self.local_path, 'wb').close()
+            journal.save(record)
+        resumed = done = record['done']
+        start = time.time()
+        while done < size:
+            data = self._read_chunk(done, min(self.chunk_size, size - done))
+            self._write_chunk(done, data)
+            if hashlib.new(tool[:-3], data).hexdigest() != self._remote_hash(done, tool):
+                raise OperationFailedError('transfer', self.remote_path,
+                                           msg="Checksum mismatch at offset %d of %%(path)s" % done)
+            done += len(data)
+            record['done'] = done
+            journal.save(record)
+            if progress:
+                progress(done, size)
+        if self.push:
+            adbfs._adb.shell('truncate -s %d %s' % (size, _quote(self.remote_path)))
+        else:
+            with open(self.local_path, 'r+b') as f:
+                f.truncate(size)
+        journal.remove(record)
+        seconds = time.time() - start
+        return {'bytes': size - resumed,
+                'resumed_from': resumed,
+                'seconds': seconds,
+                'throughput': (size - resumed) / seconds if seconds else 0.0}
+
+
+def _shell_line(marker, command):
+    return b'{ ' + _encode(command) + b'\n} </dev/null 2>&1; __rc=$?; echo; echo ' + marker + b' $__rc\n'
+
+def _shell_result(marker, out, last):
+    """The output and exit code of a command from the lines it printed and
+    the marker line ``last``."""
+    code = int(last[len(marker):].strip() or -1)
+    # drop the newline of the separating ``echo``
+    data = b''.join(out)[:-1].replace(b'\r\n', b'\n')
+    return data, code
+
+
+class _ShellSession(object):
+
+    """ A long-lived interactive ``adb shell`` that takes commands over stdin.
+
+    Every command is followed by an ``echo`` of a marker that is unique to the
+    session and the command's exit code, so the end of its output can be found
+    without closing the shell.  A command still running after `timeout`
+    seconds is taken for a stuck shell, which is killed.
+    """
+
+    timeout = 600
+
+    def __init__(self, command='adb shell'):
+        self.marker = ('__adbfs_%s__' % uuid.uuid4().hex).encode('ascii')
+        # a session of its own, so a stuck shell is killed with its children
+        self.proc = subprocess.Popen(command, shell=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT,
+                                     start_new_session=True)
+        self.stdin = self.proc.stdin
+        self.stdout = self.proc.stdout
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def run(self, command):
+        """Run ``command`` and return its output as bytes and its exit code.
+
+        stderr is merged into the output, stdin is ``/dev/null``.  Raises
+        ``EOFError`` if the shell went away before the command finished and
+        ``OperationTimeoutError`` if it had to be killed.
+        """
+        marker = self.marker
+        try:
+            self.stdin.write(_shell_line(marker, command))
+            self.stdin.flush()
+        except (IOError, OSError):
+            raise EOFError('adb shell is gone')
+        out = []
+        readline = self.stdout.readline
+        expired = []
+        timer = threading.Timer(self.timeout, lambda: (expired.append(True), self._abort()))
+        timer.daemon = True
+        timer.start()
+        try:
+            while True:
+                l = readline()
+                if not l:
+                    if expired:
+                        raise OperationTimeoutError('adb shell', msg='adb shell command timed out: %s' % command)
+                    raise EOFError('adb shell is gone')
+                if l.startswith(marker):
+                    break
+                out.append(l)
+        finally:
+            timer.cancel()
+        return _shell_result(marker, out, l)
+
+    def _abort(self):
+        if self.alive():
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                self.proc.kill()
+
+    def close(self):
+        try:
+            self.stdin.close()
+        except (IOError, OSError):
+            pass
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+
+class _SocketShellSession(_ShellSession):
+
+    """ A `_ShellSession` running ``sh`` over an ``exec:`` socket of the adb
+    server instead of an ``adb shell`` process. """
+
+    def __init__(self, client):
+        self.marker = ('__adbfs_%s__' % uuid.uuid4().hex).encode('ascii')
+        self.sock = client.open_service('exec:sh')
+        self.stdin = self.sock.makefile('wb')
+        self.stdout = self.sock.makefile('rb')
+        self._alive = True
+
+    def alive(self):
+        return self._alive
+
+    def run(self, command):
+        try:
+            return super(_SocketShellSession, self).run(command)
+        except (EOFError, socket_error):
+            self._alive = False
+            raise EOFError('adb shell is gone')
+
+    def _abort(self):
+        self._alive = False
+        try:
+            self.sock.shutdown(SHUT_RDWR)
+        except socket_error:
+            pass
+
+    def close(self):
+        self._alive = False
+        for f in (self.stdin, self.stdout, self.sock):
+            try:
+                f.close()
+            except (IOError, OSError):
+                pass
+
+
+class _ShellPool(object):
+
+    """ A fixed size pool of `_ShellSession` objects.
+
+    Sessions are made by calling ``factory``, on first use and again when
+    they die.
+    """
+
+    def __init__(self, size=2, factory=_ShellSession):
+        self.size = max(1, size)
+        self.factory = factory
+        self._free = queue.LifoQueue()
+        for _ in range(self.size):
+            self._free.put(None)
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _session(self, session):
+        if session is not None and session.alive():
+            return session
+        if session is not None:
+            self._discard(session)
+        session = self.factory()
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def _discard(self, session):
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+        session.close()
+
+    def run(self, command):
+        """Run ``command`` on a free session, see `_ShellSession.run`."""
+        session = self._free.get()
+        try:
+            for attempt in (0, 1):
+                session = self._session(session)
+                try:
+                    return session.run(command)
+                except EOFError:
+                    self._discard(session)
+                    session = None
+                except OperationTimeoutError:
+                    # the same command would hang the next session too
+                    self._discard(session)
+                    session = None
+                    raise
+            raise RemoteConnectionError(msg='adb shell keeps dying')
+        finally:
+            self._free.put(session)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+
+class _SubprocessTransport(object):
+
+    """ Reaches the device through the ``adb`` binary.
+
+    Shell commands go through a `_ShellPool` of ``adb shell`` sessions, file
+    transfers through ``adb pull`` / ``adb push``.
+    """
+
+    write_chunk = 1024 * 1024
+
+    def __init__(self, pool_size=2, serial=None):
+        self.adb = _adb_args(serial)
+        command = ' '.join(shlex_quote(arg) for arg in self.adb + ['shell'])
+        self.shells = _ShellPool(pool_size, lambda: _ShellSession(command))
+
+    def _adb(self, *args):
+        back=subprocess.Popen(self.adb+list(args),stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        out=back.communicate()[0]
+        if back.returncode:
+            raise OperationFailedError('adb '+args[0], msg=out.decode('utf-8', 'replace'))
+        return out
+
+    def shell(self, command):
+        return self.shells.run(command)
+
+    def pull(self, path, local_path):
+        self._adb('pull', path, local_path)
+
+    def push(self, local_path, path):
+        self._adb('push', local_path, path)
+
+    def pull_many(self, paths, local_dir):
+        self._adb('pull', *(list(paths)+[local_dir]))
+
+    def push_many(self, local_paths, path):
+        self._adb('push', *(list(local_paths)+[forcedir(path)]))
+
+    def exec_out(self, command, blocksize=1024*64):
+        """Yield the raw stdout of ``command`` as it arrives."""
+        back=subprocess.Popen(self.adb+['exec-out',command],stdout=subprocess.PIPE)
+        try:
+            while True:
+                data=back.stdout.read1(blocksize)
+                if not data:
+                    break
+                yield data
+        finally:
+            if back.poll() is None:
+                back.kill()
+            back.stdout.close()
+            back.wait()
+
+    def exec_in(self, command, chunks):
+        """Feed the byte ``chunks`` to the stdin of ``command``."""
+        back=subprocess.Popen(self.adb+['exec-in',command],stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        try:
+            for chunk in chunks:
+                back.stdin.write(chunk)
+        finally:
+            back.stdin.close()
+            out=back.stdout.read()
+            back.wait()
+        if back.returncode:
+            raise OperationFailedError('adb exec-in', msg=out.decode('utf-8', 'replace'))
+
+    def stream(self, path, blocksize=1024*64):
+        return self.exec_out('cat '+_quote(path), blocksize)
+
+    def read_blocks(self, path, blocksize, index, count):
+        # base64 keeps binary data intact through the text shell session
+        data=self.shells.run('dd if=%s bs=%d skip=%d count=%d 2>/dev/null | base64' %
+                             (_quote(path), blocksize, index, count))[0]
+        return base64.b64decode(data)
+
+    def write_blocks(self, path, blocksize, index, data):
+        # feed the data as base64 through a here-document of the shell session
+        for i in range(0, len(data), self.write_chunk):
+            chunk = data[i:i + self.write_chunk]
+            out, code = self.shells.run(
+                "base64 -d <<'__adbfs_eof__' | dd of=%s bs=%d seek=%d conv=notrunc 2>&1\n%s__adbfs_eof__" %
+                (_quote(path), blocksize, index + i // blocksize,
+                 base64.encodebytes(chunk).decode('ascii')))
+            if code:
+                raise OperationFailedError('write', path, msg=out.decode('utf-8', 'replace'))
+
+    def read(self, path):
+        # exec-out has no pty, so no CR/LF translation; the pipe is read
+        # straight into one growing buffer
+        back=subprocess.Popen(self.adb+['exec-out','cat '+_quote(path)+' 2>/dev/null'],stdout=subprocess.PIPE,bufsize=0)
+        buf=bytearray(1024*64)
+        pos=0
+        try:
+            while True:
+                if pos==len(buf):
+                    buf.extend(bytes(len(buf)))
+                n=back.stdout.readinto(memoryview(buf)[pos:])
+                if not n:
+                    break
+                pos+=n
+        finally:
+            back.stdout.close()
+            back.wait()
+        del buf[pos:]
+        return buf
+
+    def write(self, path, data):
+        self.exec_in('cat > '+_quote(path), [memoryview(data)])
+
+    def close(self):
+        self.shells.close()
+
+
+class _SocketTransport(object):
+
+    """ Reaches the device by talking to the adb server on its TCP port,
+    see `adbclient.ADBClient`.  No process is spawned per call: shell
+    commands use a pool of ``exec:sh`` sockets and file transfers reuse sync
+    connections. """
+
+    def __init__(self, pool_size=2, host='127.0.0.1', port=5037, serial=None):
+        self.client = ADBClient(host, port, serial)
+        self.shells = _ShellPool(pool_size, lambda: _SocketShellSession(self.client))
+
+    def shell(self, command):
+        return self.shells.run(command)
+
+    def pull(self, path, local_path):
+        self.client.pull_file(path, local_path)
+
+    def push(self, local_path, path):
+        self.client.push_file(local_path, path)
+
+    def pull_many(self, paths, local_dir):
+        for path in paths:
+            self.client.pull_file(path, os.path.join(local_dir, basename(path)))
+
+    def push_many(self, local_paths, path):
+        for local_path in local_paths:
+            self.client.push_file(local_path, pathjoin(path, os.path.basename(local_path)))
+
+    def exec_out(self, command, blocksize=1024*64):
+        return self.client.exec_out(command)
+
+    def exec_in(self, command, chunks):
+        # exec: reports no exit status, the command echoes its own
+        out = self.client.exec_in('{ %s\n} 2>&1; echo "rc=$?"' % command, chunks)
+        out, _, code = out.rpartition(b'rc=')
+        if code.strip() != b'0':
+            raise OperationFailedError('adb exec-in', msg=out.decode('utf-8', 'replace'))
+
+    def stream(self, path, blocksize=1024*64):
+        return self.client.iter_pull(path)
+
+    def read_blocks(self, path, blocksize, index, count):
+        return self.client.shell('dd if=%s bs=%d skip=%d count=%d 2>/dev/null' %
+                                 (_quote(path), blocksize, index, count))
+
+    def write_blocks(self, path, blocksize, index, data):
+        self.exec_in('dd of=%s bs=%d seek=%d conv=notrunc' % (_quote(path), blocksize, index), [data])
+
+    def read(self, path):
+        try:
+            return self.client.pull(path)
+        except ADBError as e:
+            raise ResourceNotFoundError(path, msg=str(e))
+
+    def write(self, path, data):
+        self.client.push(data, path)
+
+    def close(self):
+        self.shells.close()
+        self.client.close()
+
+
+# limit of one line read from a shell session; long ``ls -l`` lines stay
+# well below it
+_ASYNC_LINE_LIMIT = 16*1024*1024
+
+
+class _AsyncShellSession(object):
+
+    """ A `_ShellSession` on asyncio streams that pipelines its commands.
+
+    Each command is written as soon as it is asked for, behind those still
+    running; a reader task cuts the output at the markers and hands it to
+    the waiting callers in the same order.  A caller that is cancelled
+    keeps its place, so the output of its command is read and dropped.
+    Once commands and markers may be out of step, the session is failed.
+    """
+
+    def __init__(self, reader, writer, proc=None):
+        self.marker = ('__adbfs_%s__' % uuid.uuid4().hex).encode('ascii')
+        self.reader = reader
+        self.writer = writer
+        self.proc = proc
+        self._waiting = deque()
+        self._alive = True
+        self._task = asyncio.ensure_future(self._read())
+
+    @property
+    def pending(self):
+        return len(self._waiting)
+
+    def alive(self):
+        return self._alive
+
+    async def _read(self):
+        marker = self.marker
+        out = []
+        try:
+            while True:
+                l = await self.reader.readline()
+                if not l:
+                    break
+                if not l.startswith(marker):
+                    out.append(l)
+                    continue
+                if not self._waiting:
+                    # a marker nobody waits for: out of step
+                    self.writer.close()
+                    break
+                future = self._waiting.popleft()
+                if not future.done():
+                    future.set_result(_shell_result(marker, out, l))
+                out = []
+        except (IOError, OSError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._fail()
+
+    def _fail(self):
+        """Mark the session dead and fail the commands waiting on it."""
+        self._alive = False
+        while self._waiting:
+            future = self._waiting.popleft()
+            if not future.done():
+                future.set_exception(EOFError('adb shell is gone'))
+
+    async def run(self, command):
+        """Run ``command``, see `_ShellSession.run`."""
+        if not self._alive:
+            raise EOFError('adb shell is gone')
+        future = asyncio.get_event_loop().create_future()
+        self._waiting.append(future)
+        try:
+            self.writer.write(_shell_line(self.marker, command))
+            await self.writer.drain()
+        except (IOError, OSError):
+            # the command may not have gone out whole
+            self._fail()
+        return await future
+
+    async def close(self):
+        self._alive = False
+        self.writer.close()
+        self._task.cancel()
+        if self.proc is not None:
+            if self.proc.returncode is None:
+                self.proc.kill()
+            await self.proc.wait()
+
+
+class _AsyncShellPool(object):
+
+    """ Up to ``size`` `_AsyncShellSession` objects made by the coroutine
+    ``factory``, with at most ``pipeline`` commands queued on each.  A
+    command goes to the session with the fewest queued. """
+
+    def __init__(self, factory, size=2, pipeline=32):
+        self.factory = factory
+        self.size = max(1, size)
+        self.pipeline = pipeline
+        self._sessions = []
+        self._spawn_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.size * pipeline)
+
+    def _least_busy(self):
+        self._sessions[:] = [session for session in self._sessions if session.alive()]
+        return min(self._sessions, key=lambda session: session.pending, default=None)
+
+    async def _session(self):
+        session = self._least_busy()
+        if session is None or session.pending and len(self._sessions) < self.size:
+            async with self._spawn_lock:
+                self._least_busy()
+                if len(self._sessions) < self.size:
+                    session = await self.factory()
+                    self._sessions.append(session)
+            session = self._least_busy()
+        return session
+
+    async def run(self, command):
+        async with self._slots:
+            for attempt in (0, 1):
+                session = await self._session()
+                try:
+                    return await session.run(command)
+                except EOFError:
+                    await session.close()
+            raise RemoteConnectionError(msg='adb shell keeps dying')
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            await session.close()
 
-    @fileadberrors
-    def flush(self):
-        self.adbfs._on_file_written(self.path)
-        self.tmpop.flush()
-    @fileadberrors
-    def seek(self, pos, where=fs.SEEK_SET):
-        self.tmpop.seek(pos, where)
-    @fileadberrors
-    def tell(self):
-        return self.tmpop.tell()
 
-    @fileadberrors
-    def truncate(self, size=None):
-        print('truncate')
-        self.adbfs._on_file_written(self.path)
-        self.tmpop.truncate(size)
-        
-    @fileadberrors
-    def close(self):
-        print('closed')
-        if self.change==True:
-            self.adbfs._on_file_written(self.path)
-            self._cmd_co('adb push '+self.tmpop.name+' '+self.path)
-        self.tmpop.close()
-        self.closed = True
+class _AsyncSubprocessTransport(object):
 
-    def __next__(self):
-        return self.readline()
+    """ `_SubprocessTransport` for asyncio: shell commands are pipelined
+    over ``adb shell`` processes, exec-in/-out spawn ``adb`` as asyncio
+    subprocesses. """
 
-    def readline(self, size=None):
-        return next(iotools.line_iterator(self, size))
+    def __init__(self, pool_size=2, pipeline=32, serial=None):
+        self.adb = _adb_args(serial)
+        self.shells = _AsyncShellPool(self._spawn, pool_size, pipeline)
 
-    def __iter__(self):
-        return iotools.line_iterator(self)
+    async def _spawn(self):
+        proc = await asyncio.create_subprocess_exec(*self.adb + ['shell'],
+                                                     stdin=subprocess.PIPE,
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.STDOUT,
+                                                     limit=_ASYNC_LINE_LIMIT)
+        return _AsyncShellSession(proc.stdout, proc.stdin, proc)
 
+    async def shell(self, command):
+        return await self.shells.run(command)
 
-def adberrors(f):
-    @wraps(f)
-    def deco(self, *args, **kwargs):
-        self._lock.acquire()
-        print(f)
+    async def exec_out(self, command):
+        """Return the raw stdout of ``command``."""
+        proc = await asyncio.create_subprocess_exec(*self.adb + ['exec-out', command],
+                                                    stdout=subprocess.PIPE)
+        return (await proc.communicate())[0]
+
+    async def exec_in(self, command, data):
+        """Feed ``data`` to the stdin of ``command``, return its output."""
+        proc = await asyncio.create_subprocess_exec(*self.adb + ['exec-in', command],
+                                                    stdin=subprocess.PIPE,
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=subprocess.STDOUT)
+        out = (await proc.communicate(data))[0]
+        if proc.returncode:
+            raise OperationFailedError('adb exec-in', msg=out.decode('utf-8', 'replace'))
+        return out
+
+    async def close(self):
+        await self.shells.close()
+
+
+class _AsyncSocketTransport(object):
+
+    """ `_SocketTransport` for asyncio: every session and exec-in/-out is a
+    stream to the adb server, see `ADBClient.open_stream`. """
+
+    def __init__(self, pool_size=2, pipeline=32, host='127.0.0.1', port=5037, serial=None):
+        self.client = ADBClient(host, port, serial)
+        self.shells = _AsyncShellPool(self._connect, pool_size, pipeline)
+
+    async def _connect(self):
+        reader, writer = await self.client.open_stream('exec:sh', _ASYNC_LINE_LIMIT)
+        return _AsyncShellSession(reader, writer)
+
+    async def shell(self, command):
+        return await self.shells.run(command)
+
+    async def exec_out(self, command):
+        reader, writer = await self.client.open_stream('exec:' + command)
         try:
-            self._enter_dircache()
-            try:
-                try:
-                    ret = f(self, *args, **kwargs)
-                except Exception as e:
-                    self._translate_exception(args[0] if args else '', e)
-            finally:
-                self._leave_dircache()
+            return await reader.read()
         finally:
-            self._lock.release()
-        return ret
-    return deco
+            writer.close()
 
+    async def exec_in(self, command, data):
+        reader, writer = await self.client.open_stream('exec:' + command)
+        try:
+            writer.write(data)
+            writer.write_eof()
+            await writer.drain()
+            return await reader.read()
+        finally:
+            writer.close()
 
-def _encode(s):
-    if isinstance(s, str):
-        return s.encode('utf-8')
-    return s
+    async def close(self):
+        await self.shells.close()
 
-class _DirCache(dict):
-    def __init__(self):
-        super(_DirCache, self).__init__()
-        self.count = 0
-    def addref(self):
-        self.count += 1
-        return self.count
-    def decref(self):
-        self.count -= 1
-        return self.count
 
 class ADBFS(FS):
 
@@ -364,45 +2919,157 @@ class ADBFS(FS):
               'file.read_and_write' : False,
               }
 
-    def __init__(self, dircache=True,dircacheall=True,follow_symlinks=False):
+    # smaller writes are sent raw, compressing them does not pay
+    compress_min = 4096
+
+    def __init__(self, dircache=True,dircacheall=True,follow_symlinks=False,shell_pool_size=2,
+                 transport='subprocess', adb_host='127.0.0.1', adb_port=5037,
+                 stream_reads=True, readahead=8, block_cache_size=256,
+                 dircache_entries=10000, dircache_bytes=64*1024*1024, dircache_ttl=60,
+                 prefetch=0, negcache_entries=4096, negcache_ttl=30, compress=None,
+                 journal_dir=None, file_cache_dir=None, file_cache_bytes=1024*1024*1024,
+                 serial=None, watch=None, watch_interval=2):
         """Connect to a adb.
         :param dircache: If True then directory information will be cached,
             speeding up operations such as `getinfo`, `isdir`, `isfile`, but
             changes to the adb file structure will not be visible until
-            :meth:`~fs.adbfs.ADBFS.clear_dircache` is called
+            :meth:`~fs.adbfs.ADBFS.clear_dircache` is called or the cached
+            listing is older than `dircache_ttl`
+        :param dircacheall: If True the whole device is listed into the
+            dircache by a background thread, while the filesystem is usable
+        :param prefetch: Number of background threads that warm the dircache,
+            starting with the subdirectories of listed directories; 0 to
+            only fetch directories when they are used
+        :param dircache_entries: Maximum number of directories kept in the
+            dircache
+        :param dircache_bytes: Approximate memory budget of the dircache
+        :param dircache_ttl: Seconds a directory listing stays valid, None to
+            keep listings until they are evicted or cleared
+        :param negcache_entries: Maximum number of missing paths remembered,
+            0 to disable the negative cache
+        :param negcache_ttl: Seconds a path is remembered as missing
+        :param shell_pool_size: Number of persistent ``adb shell`` sessions
+            used to run commands on the device
+        :param transport: ``'subprocess'`` to go through the ``adb`` binary,
+            ``'socket'`` to talk to the adb server at `adb_host`:`adb_port`
+            directly
+        :param stream_reads: If True files opened read only are streamed from
+            the device as they are read instead of pulled to a temp file
+            first.  With the file cache on, a file that fits in it is also
+            copied there as it streams, so disk use grows with the file
+        :param readahead: Number of blocks a streamed read may buffer ahead
+        :param block_cache_size: Number of blocks kept in memory for random
+            access reads
+        :param compress: ``'gzip'``, ``'lz4'`` or ``'auto'`` to compress the
+            transfers of `getcontents` / `setcontents` with that tool on the
+            device if it has it, None to send them raw.  Already compressed
+            file types are always sent raw
+        :param journal_dir: Directory for the checkpoints of resumable
+            transfers, by default ``~/.adbfs/journal``
+        :param file_cache_dir: Directory keeping device files between opens,
+            by default ``~/.adbfs/cache``
+        :param file_cache_bytes: Disk budget of that cache, 0 to disable it
+        :param serial: Serial of the device, as ``adb devices`` lists it;
+            needed when more than one is attached.  The file cache and the
+            journal of a device given by serial are in a subdirectory
+            named after it
+        :param watch: Device directories to watch for changes made by
+            anything else, such as apps or the camera; only the cached
+            listings and files they touch are dropped, so `dircache_ttl`
+            can be long or None.  Uses ``inotifyd`` if the device has it,
+            else polls with ``find -newer``
+        :param watch_interval: Seconds between polls, and between checks
+            for new directories to watch
 
         """
         super(ADBFS, self).__init__()
         self.use_dircache = dircache
+        self.dircache_entries = dircache_entries
+        self.dircache_bytes = dircache_bytes
+        self.dircache_ttl = dircache_ttl
+        self.negcache_entries = negcache_entries
+        self.negcache_ttl = negcache_ttl
         self.follow_symlinks = follow_symlinks
+        self.shell_pool_size = shell_pool_size
+        self.transport = transport
+        self.adb_host = adb_host
+        self.adb_port = adb_port
+        self.stream_reads = stream_reads
+        self.readahead = readahead
+        self.block_cache_size = block_cache_size
+        self.prefetch = prefetch
+        self.compress = compress
+        self.serial = serial
+        self.watch = watch
+        self.watch_interval = watch_interval
+        self._device_codecs = None
+        self.journal_dir = journal_dir or os.path.join(os.path.expanduser('~'), '.adbfs', 'journal')
+        self.file_cache_dir = file_cache_dir or os.path.join(os.path.expanduser('~'), '.adbfs', 'cache')
+        if serial:
+            # several devices must not sweep each other's files
+            self.journal_dir = os.path.join(self.journal_dir, _serial_name(serial))
+            self.file_cache_dir = os.path.join(self.file_cache_dir, _serial_name(serial))
+        self._journal = _Journal(self.journal_dir)
+        self._hash_tools = None
+        self.file_cache_bytes = file_cache_bytes
+        self._fcache = None
+        self._clock_offset = None
+        self._block_cache = _BlockCache(block_cache_size)
         self._lock = threading.RLock()
+        self._path_locks = _PathLocks()
+        self._adb = self._make_transport()
         self._init_dircache()
         self._cache_hint = False
+        self._cache_all_thread = None
+        self._prefetcher = _Prefetcher(self, prefetch) if prefetch else None
         if dircacheall==True:
-            self._cache_all()
-    def _cache_all(self):
-
-        def on_line(line):
-            if not isinstance(line, str):
-                line = line.decode('utf-8')
-            info = parse_adb_list_line(line)
-            if info:
-                info = info.__dict__
-                if info['name'] not in ('.', '..'):
-                    dirlist[info['name']] = info
-        byline=self._adb_get('ls -l -R')
-        for le in byline:
-            if le[0]=='.':
-                path=le[1:-2]
-                dirlist = {}
+            if self._prefetcher:
+                self._prefetcher.add('/', _Prefetcher.TREE)
             else:
-                on_line(le)
-                self.dircache[path] = dirlist
-                self.dircache.addref()
-                print('cache',path)
-        print(self.dircache.count)
+                self._start_cache_all()
+        self._watcher = _ChangeWatcher(self, watch, watch_interval) if watch else None
+    def _make_transport(self):
+        if self.transport == 'subprocess':
+            return _SubprocessTransport(self.shell_pool_size, self.serial)
+        if self.transport == 'socket':
+            return _SocketTransport(self.shell_pool_size, self.adb_host, self.adb_port, self.serial)
+        raise ValueError('unknown transport %r' % self.transport)
+
+    def _cache_all(self, path='/'):
+        """Fill the dircache from an ``ls -l -R`` of ``path``.
+
+        The listing is parsed as it arrives and every directory is
+        published as soon as its block is complete, unless the directory was
+        invalidated since the listing started.
+        """
+        token = self.dircache.token()
+        chunks=self._adb.exec_out('ls -l -R '+_quote(path)+' 2>/dev/null')
+        for dirpath, dirlist in _parser.parse_recursive_stream(chunks):
+            self._listed(dirpath, dirlist, token)
+        _log.debug('cached %d listings below %s', len(self.dircache), path)
+
+    def _start_cache_all(self):
+        self._cache_all_thread = threading.Thread(target=self._cache_all)
+        self._cache_all_thread.daemon = True
+        self._cache_all_thread.start()
     def _init_dircache(self):
-        self.dircache = _DirCache()
+        self.dircache = _DirCache(self.dircache_entries, self.dircache_bytes, self.dircache_ttl)
+        self.negcache = _NegativeCache(self.negcache_entries, self.negcache_ttl)
+        self._inflight = _SingleFlight()
+
+    def dircache_stats(self):
+        """Return the hit, miss, eviction and size counters of the dircache,
+        how many adb round-trips the negative cache saved, and how many
+        listings and stats were fetched, how many duplicate fetches
+        concurrent callers were spared and how many device changes the
+        watcher saw."""
+        stats = self.dircache.stats()
+        stats['negative_entries'] = len(self.negcache)
+        stats['negative_saved'] = self.negcache.saved
+        stats['fetches'] = self._inflight.calls
+        stats['fetches_suppressed'] = self._inflight.suppressed
+        stats['device_changes'] = self._watcher.events if self._watcher else 0
+        return stats
 
     @synchronize
     def cache_hint(self, enabled):
@@ -410,8 +3077,12 @@ class ADBFS(FS):
 
     def _enter_dircache(self):
         self.dircache.addref()
+        if self._prefetcher:
+            self._prefetcher.enter()
 
     def _leave_dircache(self):
+        if self._prefetcher:
+            self._prefetcher.leave()
         self.dircache.decref()
         if self.use_dircache:
             pass
@@ -419,75 +3090,164 @@ class ADBFS(FS):
             self.clear_dircache()
         assert self.dircache.count >= 0, "dircache count should never be negative"
 
-    @synchronize
+    def _forget(self, path):
+        """Drop the cached content of file ``path``."""
+        self._block_cache.invalidate(normpath(path))
+        if self._fcache is not None:
+            self._fcache.invalidate(abspath(normpath(path)))
+
+    def _device_changed(self, path, tree=False):
+        """Something else changed ``path`` on the device: drop its cached
+        content and the listing of its directory, and with ``tree`` every
+        listing below it."""
+        path = abspath(normpath(path))
+        self._forget(path)
+        if tree:
+            self.clear_dircache(path)
+        elif path in self.dircache:
+            self.dircache.pop(path, None)
+        self.refresh_dircache(dirname(path))
+
     def _on_file_written(self, path):
+        self._forget(path)
+        self.negcache.discard(abspath(normpath(path)))
         self.refresh_dircache(dirname(path))
+    def _adb_text(self,command):
+        return self._adb.shell(command)[0].decode('utf-8', 'replace')
+    def _codec_for(self, path):
+        if not self.compress or splitext(path)[1].lower() in _COMPRESSED_EXTS:
+            return None
+        if self._device_codecs is None:
+            self._device_codecs = _codecs_on_device(self._adb_text(_CODEC_PROBE))
+        for codec in self._device_codecs:
+            if self.compress in ('auto', codec.tool):
+                return codec
+        return None
+    def _file_cache(self):
+        if self._fcache is None and self.file_cache_bytes:
+            serial = self.serial or self._adb_text('getprop ro.serialno 2>/dev/null').strip() or 'device'
+            with self._lock:
+                if self._fcache is None:
+                    self._fcache = _FileCache(self.file_cache_dir, self.file_cache_bytes, serial)
+        return self._fcache
+    def _device_time(self):
+        """The device clock, from its offset to ours, measured once."""
+        if self._clock_offset is None:
+            out = self._adb_text('date +%s').strip()
+            self._clock_offset = int(out) - time.time() if out.isdigit() else 0.0
+        return time.time() + self._clock_offset
+    def _stat_key(self, path):
+        """``(size, mtime)`` of ``path`` as stat'ed on the device now, the
+        key of the file cache, or None."""
+        out = self._adb_text('stat -c %s %s' % (_quote('%s %Y'), _quote(path))).split()
+        if len(out) != 2 or not all(part.isdigit() for part in out):
+            return None
+        return tuple(map(int, out))
+    def _cached_copy(self, path):
+        """Return the local copy of ``path`` in the file cache, or None.
+        Only a path the cache holds costs a stat on the device."""
+        if not self.file_cache_bytes:
+            return None
+        path = abspath(normpath(path))
+        cache = self._file_cache()
+        if path not in cache:
+            return None
+        key = self._stat_key(path)
+        return cache.get(path, *key) if key else None
+    def _cache_since(self, path):
+        """If the file cache may keep ``path`` once it is read, return the
+        device time before reading, for `_cache_add`; else None.  Decided on
+        the listing, without asking the device."""
+        if not self.file_cache_bytes:
+            return None
+        info = self._lookup(path)
+        if info is None or info['try_cwd'] or 'target' in info or info['size'] > self.file_cache_bytes:
+            return None
+        return self._device_time()
+    def _cache_add(self, path, part, since):
+        """Hand the local copy ``part`` of ``path``, read from device time
+        ``since`` on, to the file cache; return its name there, or None.
+
+        The copy is kept only if the file was last changed a minute before
+        ``since``: then it did not change while it was read, and it is not
+        likely to be written again within the same second at the same size,
+        which the key would not tell apart.
+        """
+        path = abspath(normpath(path))
+        key = self._stat_key(path)
+        if key is None or since - key[1] < 60:
+            os.remove(part)
+            return None
+        return self._file_cache().add(path, key[0], key[1], part)
+    def _cache_file(self, path, since):
+        """Pull ``path`` into the file cache; return the local name, or
+        None.  ``since`` is from `_cache_since`."""
+        part = self._file_cache().new_part()
+        self._adb.pull(path, part)
+        return self._cache_add(path, part, since)
+    def _listed(self, path, dirlist, token=None):
+        """Store a fresh listing of ``path``, dropping cached files that it
+        shows changed.  See `_DirCache.put` for ``token``."""
+        self.dircache.put(path, dirlist, token)
+        if self._fcache is not None:
+            self._fcache.refresh(path, dirlist)
+    def _hash_tool(self):
+        if self._hash_tools is None:
+            self._hash_tools = self._adb_text('for c in md5sum sha1sum; do command -v $c >/dev/null && echo $c; done').split()
+        if not self._hash_tools:
+            raise UnsupportedError('verify transfers', msg="Device has neither md5sum nor sha1sum")
+        return self._hash_tools[0]
     def _adb_get(self,command):
-        back=subprocess.Popen('adb shell' ,shell=True,stdin=subprocess.PIPE,stdout=subprocess.PIPE)
-        inby=command.encode('utf-8')+b';exit\n'
-        back.stdin.write(inby)
-        by=back.communicate()[0].decode('utf-8')
-        back.kill()
+        by=self._adb.shell(command)[0].decode('utf-8', 'replace')
         byline=by.splitlines(False)
-        for a in range(0,len(byline)-1):
-            if byline[a]=='' and byline[a+1]=='':
-                byline=byline[a+2:]
-                break
         byline=[a for a in byline if a]
         return byline
-    @synchronize
+    def _fetch_dir(self, path):
+        dirlist=_parser.parse_block(self._adb_text(_ls_command(path)))
+        if self.follow_symlinks:
+            # resolve every link of the directory with a single stat -L
+            links=[pathjoin(path, name) for name in dirlist if 'target' in dirlist[name]]
+            _resolve_links(path, dirlist, self._stat_entries(links, follow=True))
+        return dirlist
+
+    def _fetch_listing(self, path):
+        """``ls -l`` the directory ``path`` and cache the listing; callers
+        that ask for it meanwhile share the fetch."""
+        token = self.dircache.token(path)
+        def fetch():
+            dirlist = self._fetch_dir(path)
+            self._listed(path, dirlist, token)
+            return dirlist
+        # keyed by the token, so no one who saw an invalidation joins a
+        # fetch started before it
+        return self._inflight.do(('ls', path, token), fetch)
+
+    def _stat_entries(self, paths, follow=False):
+        """Stat many absolute ``paths`` with as few shell commands as the
+        command line length allows; return a dict of path to `_DirEntry`.
+        Missing paths are left out.  Concurrent identical batches share one
+        command, see `_fetch_listing`."""
+        entries = {}
+        command = _stat_command(follow)
+        tokens = tuple(self.dircache.token(path) for path in sorted(set(map(dirname, paths))))
+        for args in _arg_batches(paths):
+            key = ('stat', command, args, tokens)
+            out = self._inflight.do(key, self._adb_text, command+' '+args+' 2>/dev/null')
+            entries.update(_parse_stat(out))
+        return entries
+
     def _readdir(self, path):
         
         path = abspath(normpath(path))
         if self.dircache.count:
             cached_dirlist = self.dircache.get(path)
-            if cached_dirlist:
-                print('getcache')
+            if cached_dirlist is not None:
+                _log.debug('listing of %s from cache', path)
                 return cached_dirlist
-        dirlist = {}
-
-        def on_line(line):
-            if not isinstance(line, str):
-                line = line.decode('utf-8')
-            info = parse_adb_list_line(line)
-            if info:
-                info = info.__dict__
-                if info['name'] not in ('.', '..'):
-                    dirlist[info['name']] = info
-        gpath=forcedir(path).replace(r'(',r'\(').replace(r')',r'\)').replace(r';',r'\;')
-        byline=self._adb_get('ls -l '+gpath)
-        
-        if len(byline)>0:
-            if byline[0].find('Permission denied')==-1 and byline[0].find('Not a directory')==-1 and byline[0].find('No such file')==-1:
-                [on_line(le) for le in byline]
-        self.dircache[path] = dirlist
-        print('cache',path)
-        def is_symlink(info):
-            return info['try_retr'] and info['try_cwd'] and 'target' in info
-
-        def resolve_symlink(linkpath):
-            linkinfo = self.getinfo(linkpath)
-            if 'resolved' not in linkinfo:
-                linkinfo['resolved'] = linkpath
-            if is_symlink(linkinfo):
-                target = linkinfo['target']
-                base, fname = pathsplit(linkpath)
-                return resolve_symlink(pathjoin(base, target))
-            else:
-                return linkinfo
-
-        if self.follow_symlinks:
-            for name in dirlist:
-                if is_symlink(dirlist[name]):
-                    target = dirlist[name]['target']
-                    linkinfo = resolve_symlink(pathjoin(path, target))
-                    for key in linkinfo:
-                        if key != 'name':
-                            dirlist[name][key] = linkinfo[key]
-                    del dirlist[name]['target']
+        dirlist=self._fetch_listing(path)
+        _log.debug('listed %s', path)
         return dirlist
 
-    @synchronize
     def clear_dircache(self, *paths):
         """
         Clear cached directory information.
@@ -497,24 +3257,40 @@ class ADBFS(FS):
 
         """
 
+        self._block_cache.bump()
         if not paths:
             self.dircache.clear()
+            self.negcache.clear()
         else:
-            dircache = self.dircache
             paths = [normpath(abspath(path)) for path in paths]
-            for cached_path in list(dircache.keys()):
-                for path in paths:
-                    if isbase(cached_path, path):
-                        dircache.pop(cached_path, None)
-                        break
+            self.negcache.discard_tree(paths)
+            self.dircache.pop_tree(paths)
 
-    @synchronize
     def refresh_dircache(self, *paths):
+        paths = [abspath(normpath(path)) for path in paths]
+        self._block_cache.bump()
         for path in paths:
-            path = abspath(normpath(path))
             self.dircache.pop(path, None)
+            self.negcache.discard(path)
+        self.negcache.discard_children(paths)
+
+    def _lookup(self, path):
+        """Return the listing entry of ``path``, or None if it does not
+        exist.  Misses are remembered in the negative cache, which answers
+        for the path while its directory listing is not cached."""
+        path = abspath(normpath(path))
+        base, fname = pathsplit(path)
+        dirlist = self.dircache.get(base) if self.dircache.count else None
+        if dirlist is None:
+            if self.negcache_entries and path in self.negcache:
+                self.negcache.saved += 1
+                return None
+            dirlist = self._readdir(base)
+        info = dirlist.get(fname)
+        if info is None and self.negcache_entries:
+            self.negcache.add(path)
+        return info
 
-    @synchronize
     def _check_path(self, path):
         path = normpath(path)
         base, fname = pathsplit(abspath(path))
@@ -533,21 +3309,32 @@ class ADBFS(FS):
     def __getstate__(self):
         state = super(ADBFS, self).__getstate__()
         del state['_lock']
+        state.pop('_path_locks', None)
+        state.pop('_inflight', None)
         state.pop('_adb', None)
+        state.pop('_cache_all_thread', None)
+        state.pop('_prefetcher', None)
+        state.pop('_watcher', None)
+        state['_fcache'] = None
         return state
 
     def __setstate__(self,state):
         super(ADBFS, self).__setstate__(state)
         self._init_dircache()
         self._lock = threading.RLock()
+        self._path_locks = _PathLocks()
+        self._block_cache = _BlockCache(self.block_cache_size)
+        self._adb = self._make_transport()
+        self._prefetcher = _Prefetcher(self, self.prefetch) if self.prefetch else None
+        self._watcher = _ChangeWatcher(self, self.watch, self.watch_interval) if self.watch else None
         #self._adb = None
         #self.adb
 
     def __str__(self):
-        return '<ADBFS %s>' % self.host
+        return '<ADBFS %s>' % (self.serial or 'device')
 
     def __unicode__(self):
-        return '<ADBFS %s>' % self.host
+        return '<ADBFS %s>' % (self.serial or 'device')
 
     @convert_os_errors
     def _translate_exception(self, path, exception):
@@ -562,6 +3349,11 @@ class ADBFS(FS):
 
     @adberrors
     def close(self):
+        if self._watcher:
+            self._watcher.close()
+        if self._prefetcher:
+            self._prefetcher.close()
+        self._adb.close()
         self.closed = True
 
     @iotools.filelike_to_stream
@@ -569,7 +3361,7 @@ class ADBFS(FS):
     def open(self, path, mode, buffering=-1, encoding=None, errors=None, newline=None, line_buffering=False, **kwargs):
         path = normpath(path)
         mode = mode.lower()
-        print('open'+path+mode)
+        _log.debug('open %s %s', path, mode)
         if self.isdir(path):
             raise ResourceInvalidError(path)
         if 'r' in mode or 'a' in mode:
@@ -582,21 +3374,30 @@ class ADBFS(FS):
         return f
 
     @adberrors
+    @pathlocked()
     def setcontents(self, path, data=b'', encoding=None, errors=None, chunk_size=1024*64):
         path = normpath(path)
-        self.refresh_dircache(dirname(path))
-        back=subprocess.Popen('adb shell dd of='+path+' conv=notrunc',shell=True,stdin=subprocess.PIPE)
-        back.stdin.write(data)
-        back.stdin.write(b'\004')
-        back.wait()
-        back.kill()
+        if isinstance(data, six.text_type):
+            data = data.encode(encoding or 'utf-8', errors or 'strict')
+        self._on_file_written(path)
+        codec = self._codec_for(path) if len(data) >= self.compress_min else None
+        if codec and _compressible(data):
+            self._adb.exec_in('%s > %s' % (codec.decompress_cmd, _quote(path)), codec.pack(data))
+        else:
+            self._adb.write(path, data)
     @adberrors
     def getcontents(self, path, mode="rb", encoding=None, errors=None, newline=None):
         path = normpath(path)
         # 方法1
-        back=subprocess.Popen('adb shell dd if='+path+' conv=notrunc',shell=True,stdout=subprocess.PIPE)
-        data=back.communicate()[0]
-        back.kill()
+        codec = self._codec_for(path)
+        data = None
+        if codec:
+            data = codec.unpack(self._adb.exec_out('%s %s 2>/dev/null' % (codec.compress_cmd, _quote(path))))
+        if data is None:
+            data=self._adb.read(path)
+        if not data and not self.isfile(path):
+            raise ResourceNotFoundError(path)
+        data = bytes(data)
         if 'b' in mode:
             return data
         return iotools.decode_binary(data, encoding=encoding, errors=errors)
@@ -608,18 +3409,16 @@ class ADBFS(FS):
         path = normpath(path)
         if path in ('', '/'):
             return True
-        dirlist, fname = self._get_dirlist(path)
-        return fname in dirlist
+        return self._lookup(path) is not None
 
     @adberrors
     def isdir(self, path):
        
         path = normpath(path)
-        print('isdir '+path)
+        _log.debug('isdir %s', path)
         if path in ('', '/'):
             return True
-        dirlist, fname = self._get_dirlist(path)
-        info = dirlist.get(fname)
+        info = self._lookup(path)
         if info is None:
             return False
         return info['try_cwd']
@@ -627,11 +3426,10 @@ class ADBFS(FS):
     @adberrors
     def isfile(self, path):
         path = normpath(path)
-        print('isfile '+path)
+        _log.debug('isfile %s', path)
         if path in ('', '/'):
             return False
-        dirlist, fname = self._get_dirlist(path)
-        info = dirlist.get(fname)
+        info = self._lookup(path)
         if info is None:
             return False
         return not info['try_cwd']
@@ -644,7 +3442,10 @@ class ADBFS(FS):
             raise ResourceNotFoundError(path)
         if not self.isdir(path):
             raise ResourceInvalidError(path)
-        paths = list(self._readdir(path).keys())
+        dirlist = self._readdir(path)
+        if self._prefetcher:
+            self._prefetcher.opened(abspath(path), dirlist)
+        paths = list(dirlist.keys())
 
         return self._listdir_helper(path, paths, wildcard, full, absolute, dirs_only, files_only)
 
@@ -656,24 +3457,21 @@ class ADBFS(FS):
                           dirs_only=False,
                           files_only=False):
         path = normpath(path)
-        def getinfo(p):
-            try:
-                if full or absolute:
-                    return self.getinfo(p)
-                else:
-                    return self.getinfo(pathjoin(path,p))
-            except FSError:
-                return {}
-
-        return [(p, getinfo(p))
-                    for p in self.listdir(path,
-                                          wildcard=wildcard,
-                                          full=full,
-                                          absolute=absolute,
-                                          dirs_only=dirs_only,
-                                          files_only=files_only)]
+        paths = self.listdir(path,
+                             wildcard=wildcard,
+                             full=full,
+                             absolute=absolute,
+                             dirs_only=dirs_only,
+                             files_only=files_only)
+        if not (full or absolute):
+            paths = [(p, pathjoin(path, p)) for p in paths]
+        else:
+            paths = [(p, p) for p in paths]
+        infos = self.statmany([fullpath for p, fullpath in paths])
+        return [(p, infos.get(fullpath, {})) for p, fullpath in paths]
     
     @adberrors
+    @pathlocked()
     def makedir(self, path, recursive=False, allow_recreate=False):
         path = normpath(path)
         if path in ('', '/'):
@@ -682,10 +3480,10 @@ class ADBFS(FS):
             if not self.isdir(path):
                 self.clear_dircache(dirname(path))
                 
-                stline=self._adb_get('mkdir '+path)
+                stline=self._adb_get('mkdir '+_quote(path))
                 if recursive or allow_recreate:
                     return
-                elif stline[0].find(r"': File exixts")!=-1:
+                elif stline and stline[0].find("File exists")!=-1:
                     raise DestinationExistsError(path, msg="Can not create a directory that already exists : %(path)s")
         if recursive:
             for p in recursepath(path):
@@ -703,17 +3501,30 @@ class ADBFS(FS):
             checkdir(path)
 
     @adberrors
+    @pathlocked()
     def remove(self, path):
         if not self.exists(path):
             raise ResourceNotFoundError(path)
         if not self.isfile(path):
             raise ResourceInvalidError(path)
-        self.refresh_dircache(dirname(path))
-        self._adb_get('rm '+path)
+        self._on_file_written(normpath(path))
+        self._adb_get('rm '+_quote(path))
 
     @adberrors
     def removedir(self, path, recursive=False, force=False):
         path = abspath(normpath(path))
+        self._removedir(path, force)
+        if recursive:
+            # walk up only once the lock of path is released: locks nest
+            # from a directory to its children, never the other way
+            try:
+                if dirname(path) not in ('', '/'):
+                    self.removedir(dirname(path), recursive=True)
+            except DirectoryNotEmptyError:
+                pass
+
+    @pathlocked()
+    def _removedir(self, path, force):
         if not self.exists(path):
             raise ResourceNotFoundError(path)
         if self.isfile(path):
@@ -735,40 +3546,70 @@ class ADBFS(FS):
                     except FSError:
                         pass
             self.clear_dircache(dirname(path))
-            self._adb_get('rmdir '+path)
+            self._adb_get('rmdir '+_quote(path))
         except error_reply:
             pass
-        if recursive:
-            try:
-                if dirname(path) not in ('', '/'):
-                    self.removedir(dirname(path), recursive=True)
-            except DirectoryNotEmptyError:
-                pass
         self.clear_dircache(dirname(path), path)
 
     @adberrors
+    @pathlocked(0, 1)
     def rename(self, src, dst):
         
         self.refresh_dircache(dirname(src), dirname(dst))
-        self.adb.rename(_encode(src), _encode(dst))
-        st=adb_get('shell mv '+_encode(src)+' '+_encode(dst))
+        self._forget(src)
+        self._forget(dst)
+        st='\n'.join(self._adb_get('mv %s %s' % (_quote(src), _quote(dst))))
         if st.find('No such')!=-1:
-            if st.find(_encode(src))!=-1:
-                raise ParentDirectoryMissingError
-            elif st.find(_encode(dst))!=-1:
-                raise ResourceNotFoundError
+            if st.find(src)!=-1:
+                raise ParentDirectoryMissingError(src)
+            elif st.find(dst)!=-1:
+                raise ResourceNotFoundError(dst)
         elif st.find('Not a directory')!=-1:
-            raise ResourceInvalidError
+            raise ResourceInvalidError(dst)
         
+    def _info_dict(self, entry):
+        info = entry.copy()
+        info['modified_time'] = datetime.datetime.fromtimestamp(info['mtime'])
+        info['created_time'] = info['modified_time']
+        return info
+
     @adberrors
     def getinfo(self, path):
         dirlist, fname = self._check_path(path)
         if not fname:
             return {}
-        info = dirlist[fname].copy()
-        info['modified_time'] = datetime.datetime.fromtimestamp(info['mtime'])
-        info['created_time'] = info['modified_time']
-        return info
+        return self._info_dict(dirlist[fname])
+
+    @adberrors
+    def statmany(self, paths):
+        """
+        Get the info of many paths in one go.
+
+        Paths whose directory listing is cached are answered from the
+        dircache, all the others are stat'ed together in a single shell
+        command (split only if the command line would get too long).
+
+        :param paths: An iterable of paths
+        :rtype: dict
+        :return: A mapping of each given path that exists to a dict as
+            returned by `getinfo`
+        """
+        result = {}
+        todo = []
+        for path in paths:
+            apath = abspath(normpath(path))
+            base, fname = pathsplit(apath)
+            dirlist = self.dircache.get(base) if self.dircache.count else None
+            if dirlist is None:
+                todo.append((path, apath))
+            elif fname in dirlist:
+                result[path] = self._info_dict(dirlist[fname])
+        if todo:
+            entries = self._stat_entries([apath for path, apath in todo], follow=self.follow_symlinks)
+            for path, apath in todo:
+                if apath in entries:
+                    result[path] = self._info_dict(entries[apath])
+        return result
 
     @adberrors
     def getsize(self, path):
@@ -781,13 +3622,10 @@ class ADBFS(FS):
         if size is not None:
             return size
 
-        st=adb_get('shell stat '+path)
-        li=st.splitlines()
-        for x in li:
-            if x.find('Size:')!=-1:
-                li2=x.split()
-                size=int(li2[1])
-                break
+        apath=abspath(normpath(path))
+        info=self._stat_entries([apath]).get(apath)
+        if info is not None:
+            size=info['size']
         if size is None:
             dirlist, fname = self._check_path(path)
             size = dirlist[fname].get('size')
@@ -803,9 +3641,12 @@ class ADBFS(FS):
         dirlist, fname = self._check_path(path)
         if fname not in dirlist:
             raise ResourceNotFoundError(path)
-        return dirlist[fname].get('raw_line', 'No description available')
+        # listings are cached without their raw lines, ask the device again
+        byline=self._adb_get('ls -l -d '+_quote(path))
+        return byline[0] if byline else 'No description available'
 
     @adberrors
+    @pathlocked(0, 1)
     def move(self, src, dst, overwrite=False, chunk_size=16384):
         if not overwrite and self.exists(dst):
             raise DestinationExistsError(dst)
@@ -819,6 +3660,7 @@ class ADBFS(FS):
             self.refresh_dircache(src, dirname(src), dst, dirname(dst))
 
     @adberrors
+    @pathlocked(0, 1)
     def copy(self, src, dst, overwrite=False, chunk_size=1024*64):
         if not self.isfile(src):
             if self.isdir(src):
@@ -829,20 +3671,501 @@ class ADBFS(FS):
 
         dst = normpath(dst)
         
-        st=adb_get('shell cp -F'+src+' '+dst)
+        self._adb_get('cp %s %s' % (_quote(src), _quote(dst)))
         
         self.refresh_dircache(dirname(dst))
         
 
+    def _check_copydir(self, src, dst, overwrite):
+        if not self.isdir(src):
+            if self.isfile(src):
+                raise ResourceInvalidError(src, msg="Source is not a directory: %(path)s")
+            raise ResourceNotFoundError(src)
+        if not overwrite and self.exists(dst):
+            raise DestinationExistsError(dst)
+
     @adberrors
+    @pathlocked(0, 1)
     def movedir(self, src, dst, overwrite=False, ignore_errors=False, chunk_size=16384):
-        self.clear_dircache(dirname(src), dirname(dst))
+        src, dst = abspath(normpath(src)), abspath(normpath(dst))
+        self._check_copydir(src, dst, overwrite)
+        self.clear_dircache(dirname(src), dirname(dst), src, dst)
+        if not self.exists(dst):
+            out, code = self._adb.shell('mv %s %s' % (_quote(src), _quote(dst)))
+            if not code:
+                return
         super(ADBFS, self).movedir(src, dst, overwrite, ignore_errors, chunk_size)
 
     @adberrors
-    def copydir(self, src, dst, overwrite=False, ignore_errors=False, chunk_size=16384):
-        self.clear_dircache(dirname(dst))
-        super(ADBFS, self).copydir(src, dst, overwrite, ignore_errors, chunk_size)
+    @pathlocked(0, 1)
+    def copydir(self, src, dst, overwrite=False, ignore_errors=False, chunk_size=16384, bulk=False):
+        """
+        Copies a directory on the device, with one ``cp -r``, or with
+        ``bulk`` set, through a ``tar c | tar x`` pipe that keeps mtimes.
+        """
+        src, dst = abspath(normpath(src)), abspath(normpath(dst))
+        self._check_copydir(src, dst, overwrite)
+        self.clear_dircache(dirname(dst), dst)
+        # the whole tree in one device side command, file by file only if
+        # that fails
+        out, code = self._adb.shell(_copydir_command(src, dst, bulk))
+        if code:
+            self.clear_dircache(dst)
+            super(ADBFS, self).copydir(src, dst, True, ignore_errors, chunk_size)
+
+    @adberrors
+    def pull_file(self, path, local_path, progress=None):
+        """
+        Copy a device file to the host in verified chunks.  A copy that was
+        cut short continues from its last verified chunk, see
+        `_ResumableTransfer`.
+
+        :param progress: Called with the bytes done and the file size after
+            every chunk
+        """
+        return _ResumableTransfer(self, False, local_path, path).run(progress)
+
+    @adberrors
+    @pathlocked(1)
+    def push_file(self, local_path, path, progress=None):
+        """
+        Copy a host file to the device in verified chunks.  A copy that was
+        cut short continues from its last verified chunk, see
+        `_ResumableTransfer`.
+
+        :param progress: Called with the bytes done and the file size after
+            every chunk
+        """
+        self._on_file_written(abspath(normpath(path)))
+        return _ResumableTransfer(self, True, local_path, path).run(progress)
+
+    @adberrors
+    def resume_transfers(self, progress=None):
+        """
+        Finish the `pull_file` / `push_file` copies left in the journal by
+        a lost device.
+
+        :return: A list of ``(local path, device path, stats)``
+        """
+        done = []
+        for record in self._journal.pending():
+            if record['push']:
+                if not os.path.isfile(record['local']):
+                    self._journal.remove(record)
+                    continue
+                self._on_file_written(record['remote'])
+            elif not self._stat_entries([record['remote']]):
+                self._journal.remove(record)
+                continue
+            stats = _ResumableTransfer(self, record['push'], record['local'], record['remote']).run(progress)
+            done.append((record['local'], record['remote'], stats))
+        return done
+
+    @adberrors
+    def sync_dir(self, src, dst, to_device=False, delete=False, workers=4, progress=None):
+        """
+        Make ``dst`` a copy of ``src`` by sending only the files that are
+        new or differ in size or mtime, over ``workers`` parallel transfers.
+        ``src`` is on the device and ``dst`` on the host, the other way
+        round with ``to_device`` set.
+
+        :param delete: Also remove files and directories under ``dst`` that
+            are not in ``src``
+        :return: A dict of ``files``, ``bytes``, ``seconds`` and
+            ``throughput`` of what was sent, plus ``checked``, ``deleted`` and
+            ``elapsed`` (the seconds for the whole sync)
+        """
+        start = time.time()
+        engine = _TransferEngine(self, workers, progress)
+        if to_device:
+            dst = abspath(normpath(dst))
+            src_dirs, src_files = engine.host_tree(src)
+            dst_dirs, dst_files = engine.device_tree(dst) if self.isdir(dst) else (set(), {})
+            self.clear_dircache(dirname(dst), dst)
+            dirs = [dst] + [pathjoin(dst, d) for d in sorted(src_dirs - dst_dirs)]
+            files = [(os.path.join(src, *path.split('/')), dirname(pathjoin(dst, path)), src_files[path][0])
+                     for path in engine.changed(src_files, dst_files)]
+        else:
+            src = abspath(normpath(src))
+            if not self.isdir(src):
+                raise ResourceNotFoundError(src)
+            src_dirs, src_files = engine.device_tree(src)
+            dst_dirs, dst_files = engine.host_tree(dst)
+            dirs = [dst] + [os.path.join(dst, *d.split('/')) for d in sorted(src_dirs - dst_dirs)]
+            files = [(pathjoin(src, path), os.path.dirname(os.path.join(dst, *path.split('/'))), src_files[path][0])
+                     for path in engine.changed(src_files, dst_files)]
+        stats = engine.run(dirs, files, push=to_device)
+        if not to_device:
+            # adb pull does not keep mtimes, the next comparison needs them
+            for path in engine.changed(src_files, dst_files):
+                mtime = src_files[path][1]
+                os.utime(os.path.join(dst, *path.split('/')), (mtime, mtime))
+        deleted = 0
+        if delete:
+            # only the topmost extra directories, the rest goes with them
+            gone = dst_dirs - src_dirs
+            extra_dirs = [d for d in sorted(gone) if d.rpartition('/')[0] not in gone]
+            extra_files = [f for f in sorted(set(dst_files) - set(src_files)) if f.rpartition('/')[0] not in gone]
+            if to_device:
+                paths = [pathjoin(dst, p) for p in extra_files + extra_dirs]
+                for args in _arg_batches(paths):
+                    self._adb.shell('rm -rf '+args)
+            else:
+                for f in extra_files:
+                    os.remove(os.path.join(dst, *f.split('/')))
+                for d in extra_dirs:
+                    shutil.rmtree(os.path.join(dst, *d.split('/')))
+            deleted = len(extra_files) + len(extra_dirs)
+        stats['checked'] = len(src_files)
+        stats['deleted'] = deleted
+        stats['elapsed'] = time.time() - start
+        return stats
+
+    @adberrors
+    def pull_dir(self, src, dst, workers=4, progress=None, bulk=False):
+        """
+        Copy the device directory ``src`` to the host directory ``dst``,
+        over ``workers`` parallel transfers, or with ``bulk`` set as one tar
+        stream, see `_TransferEngine`.
+
+        :return: A dict of ``files``, ``bytes``, ``seconds`` and
+            ``throughput`` in bytes per second
+        """
+        src = abspath(normpath(src))
+        if not self.isdir(src):
+            raise ResourceNotFoundError(src)
+        engine = _TransferEngine(self, workers, progress)
+        if bulk:
+            return engine.pull_tar(src, dst)
+        dirs, files = engine.plan_pull(src, dst)
+        return engine.run(dirs, files, push=False)
+
+    @adberrors
+    @pathlocked(1)
+    def push_dir(self, src, dst, workers=4, progress=None, bulk=False):
+        """
+        Copy the host directory ``src`` to the device directory ``dst``,
+        over ``workers`` parallel transfers, or with ``bulk`` set as one tar
+        stream, see `_TransferEngine`.
+
+        :return: A dict of ``files``, ``bytes``, ``seconds`` and
+            ``throughput`` in bytes per second
+        """
+        dst = abspath(normpath(dst))
+        engine = _TransferEngine(self, workers, progress)
+        self.clear_dircache(dirname(dst), dst)
+        if bulk:
+            return engine.push_tar(src, dst)
+        dirs, files = engine.plan_push(src, dst)
+        return engine.run(dirs, files, push=True)
+
+
+class _AsyncSingleFlight(object):
+
+    """ `_SingleFlight` for coroutines of one event loop. """
+
+    def __init__(self):
+        self.calls = 0
+        self.suppressed = 0
+        self._flights = {}
+
+    async def do(self, key, fn, *args):
+        future = self._flights.get(key)
+        if future is None:
+            future = self._flights[key] = asyncio.ensure_future(fn(*args))
+            future.add_done_callback(lambda f: self._flights.pop(key, None))
+            self.calls += 1
+        else:
+            self.suppressed += 1
+        # one caller giving up must not cancel the fetch for the others
+        return await asyncio.shield(future)
+
+
+class AsyncADBFS(object):
+
+    """ An asyncio front end of `ADBFS`.
+
+    Has coroutine versions of `listdir`, `getinfo`, `exists`, `isdir`,
+    `isfile`, `getcontents`, `setcontents` and `copydir`.  Shell commands
+    are pipelined over ``sessions`` persistent shells, so thousands of
+    calls can be in flight at once without a thread each.  The caches are
+    those of the synchronous `ADBFS` in ``fs``, which stays the
+    `fs.base.FS` interface of the same device.
+
+    Use it from one event loop and `close` it there.
+    """
+
+    def __init__(self, adbfs=None, sessions=None, pipeline=32, **kwargs):
+        """
+        :param adbfs: The `ADBFS` to share caches and settings with; made
+            from ``kwargs`` if not given
+        :param sessions: Number of persistent shells, by default the
+            ``shell_pool_size`` of the `ADBFS`
+        :param pipeline: Commands queued at once on each shell
+        """
+        self._own_fs = adbfs is None
+        self.fs = ADBFS(**kwargs) if adbfs is None else adbfs
+        sessions = sessions or self.fs.shell_pool_size
+        if self.fs.transport == 'socket':
+            self._adb = _AsyncSocketTransport(sessions, pipeline, self.fs.adb_host, self.fs.adb_port, self.fs.serial)
+        else:
+            self._adb = _AsyncSubprocessTransport(sessions, pipeline, self.fs.serial)
+        self._inflight = _AsyncSingleFlight()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._adb.close()
+        if self._own_fs:
+            self.fs.close()
+
+    def stats(self):
+        """`ADBFS.dircache_stats`, with the fetches made here added."""
+        stats = self.fs.dircache_stats()
+        stats['fetches'] += self._inflight.calls
+        stats['fetches_suppressed'] += self._inflight.suppressed
+        return stats
+
+    async def _text(self, command):
+        return (await self._adb.shell(command))[0].decode('utf-8', 'replace')
+
+    async def _codec_for(self, path):
+        fs = self.fs
+        if fs.compress and fs._device_codecs is None:
+            fs._device_codecs = _codecs_on_device(await self._text(_CODEC_PROBE))
+        return fs._codec_for(path)
+
+    async def _fetch_dir(self, path, token):
+        dirlist = _parser.parse_block(await self._text(_ls_command(path)))
+        if self.fs.follow_symlinks:
+            links = [pathjoin(path, name) for name in dirlist if 'target' in dirlist[name]]
+            resolved = {}
+            for args in _arg_batches(links):
+                resolved.update(_parse_stat(await self._text(_stat_command(True)+' '+args+' 2>/dev/null')))
+            _resolve_links(path, dirlist, resolved)
+        if self.fs.use_dircache:
+            self.fs._listed(path, dirlist, token)
+        return dirlist
+
+    async def _readdir(self, path):
+        path = abspath(normpath(path))
+        dircache = self.fs.dircache
+        if self.fs.use_dircache:
+            dirlist = dircache.get(path)
+            if dirlist is not None:
+                return dirlist
+        token = dircache.token(path)
+        # see `ADBFS._fetch_listing` for the token in the key
+        return await self._inflight.do(('ls', path, token), self._fetch_dir, path, token)
+
+    async def _lookup(self, path):
+        """See `ADBFS._lookup`."""
+        fs = self.fs
+        path = abspath(normpath(path))
+        base, fname = pathsplit(path)
+        dirlist = fs.dircache.get(base) if fs.use_dircache else None
+        if dirlist is None:
+            if fs.negcache_entries and path in fs.negcache:
+                fs.negcache.saved += 1
+                return None
+            dirlist = await self._readdir(base)
+        info = dirlist.get(fname)
+        if info is None and fs.negcache_entries:
+            fs.negcache.add(path)
+        return info
+
+    async def exists(self, path):
+        if normpath(path) in ('', '/'):
+            return True
+        return await self._lookup(path) is not None
+
+    async def isdir(self, path):
+        if normpath(path) in ('', '/'):
+            return True
+        info = await self._lookup(path)
+        return info is not None and info['try_cwd']
+
+    async def isfile(self, path):
+        if normpath(path) in ('', '/'):
+            return False
+        info = await self._lookup(path)
+        return info is not None and not info['try_cwd']
+
+    async def listdir(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        path = normpath(path)
+        if path not in ('', '/'):
+            info = await self._lookup(path)
+            if info is None:
+                raise ResourceNotFoundError(path)
+            if not info['try_cwd']:
+                raise ResourceInvalidError(path)
+        dirlist = await self._readdir(path)
+        return self.fs._listdir_helper(path, list(dirlist.keys()), wildcard, full, absolute, dirs_only, files_only)
+
+    async def getinfo(self, path):
+        base, fname = pathsplit(abspath(normpath(path)))
+        if not fname:
+            return {}
+        dirlist = await self._readdir(base)
+        if fname not in dirlist:
+            raise ResourceNotFoundError(path)
+        return self.fs._info_dict(dirlist[fname])
+
+    async def getcontents(self, path, mode="rb", encoding=None, errors=None, newline=None):
+        path = normpath(path)
+        codec = await self._codec_for(path)
+        data = None
+        if codec:
+            data = codec.unpack([await self._adb.exec_out('%s %s 2>/dev/null' % (codec.compress_cmd, _quote(path)))])
+        if data is None:
+            data = await self._adb.exec_out('cat %s 2>/dev/null' % _quote(path))
+        if not data and not await self.isfile(path):
+            raise ResourceNotFoundError(path)
+        if 'b' in mode:
+            return bytes(data)
+        return iotools.decode_binary(data, encoding=encoding, errors=errors, newline=newline)
+
+    async def setcontents(self, path, data=b'', encoding=None, errors=None):
+        path = normpath(path)
+        if isinstance(data, six.text_type):
+            data = data.encode(encoding or 'utf-8', errors or 'strict')
+        codec = await self._codec_for(path) if len(data) >= self.fs.compress_min else None
+        try:
+            # errors, such as a missing directory, are the only output
+            if codec and _compressible(data):
+                out = await self._adb.exec_in('%s 2>&1 > %s' % (codec.decompress_cmd, _quote(path)),
+                                              b''.join(codec.pack(data)))
+            else:
+                out = await self._adb.exec_in('cat 2>&1 > %s' % _quote(path), data)
+        finally:
+            self.fs._on_file_written(path)
+        if out:
+            raise OperationFailedError('setcontents', path, msg=out.decode('utf-8', 'replace'))
+
+    async def copydir(self, src, dst, overwrite=False, bulk=False):
+        """See `ADBFS.copydir`; there is no file by file fallback."""
+        src, dst = abspath(normpath(src)), abspath(normpath(dst))
+        if not await self.isdir(src):
+            if await self.isfile(src):
+                raise ResourceInvalidError(src, msg="Source is not a directory: %(path)s")
+            raise ResourceNotFoundError(src)
+        if not overwrite and await self.exists(dst):
+            raise DestinationExistsError(dst)
+        try:
+            out, code = await self._adb.shell(_copydir_command(src, dst, bulk))
+        finally:
+            self.fs.clear_dircache(dirname(dst), dst)
+        if code:
+            raise OperationFailedError('copydir', dst, msg=out.decode('utf-8', 'replace'))
+
+
+def list_devices(transport='subprocess', adb_host='127.0.0.1', adb_port=5037):
+    """Serials of the devices that are attached and ready."""
+    if transport == 'socket':
+        lines = ADBClient(adb_host, adb_port).devices()
+    else:
+        out = subprocess.Popen(['adb', 'devices'], stdout=subprocess.PIPE).communicate()[0]
+        lines = [l.split('\t', 1) for l in out.decode('utf-8', 'replace').splitlines()[1:] if '\t' in l]
+    return [serial for serial, state in lines if state.strip() == 'device']
+
+
+class MultiADBFS(MountFS):
+
+    """ Many devices in one filesystem.
+
+    Every device is a directory named after its serial, served by an `ADBFS`
+    of its own, with its own caches and connections; calls on different
+    devices do not wait for each other.  `push_dir`, `pull_dir`,
+    `push_file` and `pull_file` send one transfer to many devices at once,
+    a thread per device, and report it per device.
+    """
+
+    def __init__(self, serials=None, **kwargs):
+        """
+        :param serials: Serials of the devices to mount, by default all that
+            `list_devices` finds
+        :param kwargs: Passed on to the `ADBFS` of every device
+        """
+        super(MultiADBFS, self).__init__(thread_synchronize=False)
+        self._kwargs = kwargs
+        self._devices_lock = threading.Lock()
+        self.devices = OrderedDict()
+        if serials is None:
+            serials = list_devices(kwargs.get('transport', 'subprocess'),
+                                   kwargs.get('adb_host', '127.0.0.1'),
+                                   kwargs.get('adb_port', 5037))
+        for serial in serials:
+            self.add_device(serial)
+
+    def __str__(self):
+        return '<MultiADBFS %s>' % ', '.join(self.devices)
+
+    def add_device(self, serial):
+        """Mount the device ``serial`` at ``/<serial>``; return its `ADBFS`."""
+        adbfs = ADBFS(serial=serial, **self._kwargs)
+        with self._devices_lock:
+            self.devices[serial] = adbfs
+            self.mountdir(_serial_name(serial), adbfs)
+        return adbfs
+
+    def remove_device(self, serial):
+        with self._devices_lock:
+            adbfs = self.devices.pop(serial)
+            self.unmount(_serial_name(serial))
+        adbfs.close()
+
+    def _fan_out(self, serials, call, progress):
+        """Run ``call(adbfs, name, progress)`` for every device in
+        ``serials``, all by default, in parallel.  ``progress`` gets the
+        serial before the arguments of the call's progress.  Return a dict
+        of serial to result; a device that failed has its exception there
+        instead, and the others go on."""
+        with self._devices_lock:
+            devices = [(serial, self.devices[serial]) for serial in (serials or list(self.devices))]
+        results = OrderedDict()
+        if not devices:
+            return results
+        with ThreadPoolExecutor(len(devices)) as pool:
+            futures = [(serial, pool.submit(call, adbfs, _serial_name(serial),
+                                            progress and partial(progress, serial)))
+                       for serial, adbfs in devices]
+            for serial, future in futures:
+                try:
+                    results[serial] = future.result()
+                except Exception as e:
+                    results[serial] = e
+        return results
+
+    def push_dir(self, src, dst, serials=None, workers=4, progress=None, bulk=False):
+        """`ADBFS.push_dir` of the host directory ``src`` to ``dst`` on every
+        device; return a dict of serial to its stats, each with its own
+        ``throughput``."""
+        return self._fan_out(serials, lambda adbfs, name, progress:
+                             adbfs.push_dir(src, dst, workers, progress, bulk), progress)
+
+    def pull_dir(self, src, dst, serials=None, workers=4, progress=None, bulk=False):
+        """`ADBFS.pull_dir` of ``src`` from every device to
+        ``dst/<serial>`` on the host; see `push_dir`."""
+        return self._fan_out(serials, lambda adbfs, name, progress:
+                             adbfs.pull_dir(src, os.path.join(dst, name), workers, progress, bulk), progress)
+
+    def push_file(self, local_path, path, serials=None, progress=None):
+        """`ADBFS.push_file` to every device; see `push_dir`."""
+        return self._fan_out(serials, lambda adbfs, name, progress:
+                             adbfs.push_file(local_path, path, progress), progress)
+
+    def pull_file(self, path, local_dir, serials=None, progress=None):
+        """`ADBFS.pull_file` from every device to ``local_dir/<serial>``
+        named after ``path``; see `push_dir`."""
+        def pull(adbfs, name, progress):
+            target = os.path.join(local_dir, name)
+            os.makedirs(target, exist_ok=True)
+            return adbfs.pull_file(path, os.path.join(target, basename(path)), progress)
+        return self._fan_out(serials, pull, progress)
 
 
 if __name__ == "__main__":
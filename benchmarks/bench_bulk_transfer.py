@@ -0,0 +1,62 @@
+"""Moving a tree of many small files: `pull_dir` / `push_dir` with ``bulk``
+set (one tar stream) against the per-file transfers, and against running
+``adb pull`` once per file (timed on at most 500 files).
+
+    python benchmarks/bench_bulk_transfer.py [files] [file bytes]
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+import common
+
+
+def make_tree(root, files, size):
+    for i in range(files):
+        folder = os.path.join(root, 'd%03d' % (i // 100))
+        if i % 100 == 0:
+            os.makedirs(folder)
+        with open(os.path.join(folder, 'f%05d.bin' % i), 'wb') as f:
+            f.write(os.urandom(size))
+
+
+def adb_pull_each(tree, dst, limit):
+    count = 0
+    for folder, dirs, names in os.walk(tree):
+        target = os.path.join(dst, os.path.relpath(folder, tree))
+        os.makedirs(target, exist_ok=True)
+        for name in names:
+            if count == limit:
+                return count
+            subprocess.check_call(['adb', 'pull', os.path.join(folder, name), os.path.join(target, name)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            count += 1
+    return count
+
+
+def main(files=10000, size=1024):
+    rows = []
+    with common.scratch('bulk') as scratch:
+        tree = os.path.join(scratch, 'tree')
+        make_tree(tree, files, size)
+        dst = os.path.join(scratch, 'out')
+        limit = min(files, 500)
+        rows.append(('adb pull per file', limit / common.timed(adb_pull_each, tree, dst, limit)))
+        shutil.rmtree(dst)
+        for transport in ('subprocess', 'socket'):
+            with common.quiet():
+                fs = common.make_fs(transport)
+                for bulk in (False, True):
+                    mode = 'bulk' if bulk else 'per-file'
+                    for name, fn in (('pull_dir', fs.pull_dir), ('push_dir', fs.push_dir)):
+                        seconds = common.timed(fn, tree, dst, bulk=bulk)
+                        shutil.rmtree(dst)
+                        rows.append(('%s %s %s' % (transport, name, mode), files / seconds))
+                fs.close()
+    print('%d files of %d bytes' % (files, size))
+    common.report(rows, 'files/s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,57 @@
+"""Effective throughput of `setcontents` / `getcontents` with gzip or lz4
+compression against raw transfers, on a compressible log corpus and an
+incompressible random one.
+
+    python benchmarks/bench_compression.py [MB]
+"""
+import os
+import sys
+
+import common
+import adbfs
+
+
+def corpora(size):
+    line = b'2024-03-01 12:00:%02d.%03d  %4d  %4d I ActivityManager: Start proc %d:com.example.app/u0a%d\n'
+    lines = []
+    n = 0
+    while n < size:
+        i = len(lines)
+        lines.append(line % (i % 60, i % 1000, 1000 + i % 97, 2000 + i % 89, 3000 + i % 4099, i % 211))
+        n += len(lines[-1])
+    return [('log', b''.join(lines)[:size]), ('random', os.urandom(size))]
+
+
+def main(megabytes=16):
+    size = megabytes * 1024 * 1024
+    modes = [None, 'gzip'] + (['lz4'] if adbfs.lz4frame is not None else [])
+    rows = []
+    with common.scratch('compress') as device:
+        for transport in ('subprocess', 'socket'):
+            for compress in modes:
+                with common.quiet():
+                    fs = common.make_fs(transport, compress=compress)
+                    codec = fs._codec_for('probe.bin')
+                if compress and codec is None:
+                    print('%s: no %s on the device, skipped' % (transport, compress))
+                    continue
+                for corpus, data in corpora(size):
+                    path = os.path.join(device, corpus + '.bin')
+                    with common.quiet():
+                        put = common.timed(fs.setcontents, path, data)
+                        got = common.timed(fs.getcontents, path)
+                    name = '%s %s %s' % (transport, compress or 'raw', corpus)
+                    rows.append((name + ' set', size / 1e6 / put))
+                    rows.append((name + ' get', size / 1e6 / got))
+                with common.quiet():
+                    fs.close()
+    print('%d MB per transfer' % megabytes)
+    for name, data in corpora(size):
+        ratios = ['%s %.3f' % (codec.tool, sum(map(len, codec.pack(data))) / float(size))
+                  for codec in adbfs._CODECS]
+        print('%s corpus compresses to: %s' % (name, ', '.join(ratios)))
+    common.report(rows, 'MB/s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
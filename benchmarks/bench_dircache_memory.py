@@ -0,0 +1,60 @@
+"""Memory held by the dircache for a synthetic listing: the old entries,
+the ``__dict__`` of an `ADBListData` with its raw line, against the
+``__slots__`` `_DirEntry`.
+
+    python benchmarks/bench_dircache_memory.py [entries]
+"""
+import gc
+import sys
+import tracemalloc
+
+import common
+import adbfs
+
+PER_DIR = 1000
+
+
+def block(d):
+    lines = []
+    for i in range(PER_DIR):
+        if i % 10 == 0:
+            lines.append('drwxrwx--x root sdcard_rw 2024-03-%02d 12:%02d dir_%d_%d' % (i % 28 + 1, i % 60, d, i))
+        else:
+            lines.append('-rw-rw---- root sdcard_rw %d 2024-03-%02d 12:%02d IMG_2024%04d_%06d.jpg'
+                         % (i * 7919 % 5000000, i % 28 + 1, i % 60, d, i))
+    return '\n'.join(lines) + '\n'
+
+
+def old_listing(text):
+    dirlist = {}
+    for line in text.splitlines():
+        info = adbfs._parser.parse_line(line).__dict__
+        dirlist[info['name']] = info
+    return dirlist
+
+
+def held(build, dirs):
+    gc.collect()
+    tracemalloc.start()
+    cache = {}
+    for d in range(dirs):
+        cache['/sdcard/d%d' % d] = build(block(d))
+    gc.collect()
+    nbytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del cache
+    return nbytes
+
+
+def main(entries=1000000):
+    dirs = max(1, entries // PER_DIR)
+    old = held(old_listing, dirs)
+    new = held(adbfs._parser.parse_block, dirs)
+    print('%d entries in %d directories' % (dirs * PER_DIR, dirs))
+    common.report([('ADBListData.__dict__ entries', old / 2**20),
+                   ('_DirEntry entries', new / 2**20)], 'MB')
+    print('%.1f bytes an entry against %.1f, %.1fx less' % (old / (dirs * PER_DIR), new / (dirs * PER_DIR), old / new))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
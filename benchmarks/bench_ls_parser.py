@@ -0,0 +1,94 @@
+"""Lines per second parsing an ``ls -l -R`` dump: the per-line parser
+ADBFS used to have (kept below) against the one-regex block parser.
+
+    python benchmarks/bench_ls_parser.py [lines]
+"""
+import sys
+import time
+
+import common
+import adbfs
+
+
+def legacy_parse_line(buf):
+    """The per-line ``_parse_unix_style`` replaced by the block parser."""
+    result = adbfs.ADBListData(buf)
+    c = buf[0]
+    tokens = buf.split()
+    if c == 'd':
+        result.try_cwd = True
+        size = 0
+        datestr = tokens[3] + ' ' + tokens[4]
+        result.name = buf.split(maxsplit=6)[-1]
+    elif c == '-':
+        result.try_retr = True
+        size = int(tokens[3])
+        datestr = tokens[4] + ' ' + tokens[5]
+        result.name = buf.split(maxsplit=7)[-1]
+    elif c == 'l':
+        result.try_retr = True
+        result.try_cwd = True
+        size = 0
+        datestr = tokens[3] + ' ' + tokens[4]
+        name = buf.split(maxsplit=5)[-1]
+        i = 0
+        while (i + 3) < len(name):
+            if name[i:i + 4] == ' -> ':
+                result.target = name[i + 4:]
+                result.name = name[:i]
+                break
+            i += 1
+    else:
+        return result
+    result.size = size
+    result.mtime = time.mktime(time.strptime(datestr, '%Y-%m-%d %H:%M'))
+    return result
+
+
+def legacy_parse_recursive(text):
+    listing = {}
+    dirlist = None
+    for line in text.splitlines():
+        if not line:
+            continue
+        if line[0] in './' and line.endswith(':'):
+            dirlist = listing[line[:-1]] = {}
+        elif dirlist is not None:
+            info = legacy_parse_line(line).__dict__
+            dirlist[info['name']] = info
+    return listing
+
+
+def dump(lines, per_dir=500):
+    out = []
+    for d in range(max(1, lines // per_dir)):
+        out.append('./DCIM/dir%d:' % d)
+        for i in range(per_dir):
+            day, minute = i % 28 + 1, (d + i) % 60
+            if i % 25 == 0:
+                out.append('drwxrwx--x root sdcard_rw 2024-03-%02d 12:%02d sub %d' % (day, minute, i))
+            elif i % 50 == 1:
+                out.append('lrwxrwxrwx root root 2024-03-%02d 12:%02d link%d -> /storage/emulated/0/x%d' % (day, minute, i, i))
+            else:
+                out.append('-rw-rw---- root sdcard_rw %d 2024-03-%02d 12:%02d IMG_%06d.jpg' % (i * 7919, day, minute, i))
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def main(lines=200000):
+    text = dump(lines)
+    count = text.count('\n')
+    rows = []
+    for name, parse in (('per-line parser (old)', legacy_parse_recursive),
+                        ('parse_recursive', lambda text: list(adbfs.ADBListDataParser().parse_recursive(text))),
+                        ('parse_recursive_stream, 64K chunks',
+                         lambda text: list(adbfs.ADBListDataParser().parse_recursive_stream(
+                             data[i:i + 65536] for data in [text.encode('utf-8')]
+                             for i in range(0, len(data), 65536))))):
+        rows.append((name, count / common.timed(parse, text)))
+    print('%d lines' % count)
+    common.report(rows, 'lines/s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,75 @@
+"""Reads of an open device file: from the memory-mapped copy in the file
+cache against the pulled temporary file that every open used to read.
+
+    python benchmarks/bench_mmap_reads.py [file MB] [random reads]
+"""
+import os
+import random
+import sys
+import time
+
+import common
+
+
+def sequential(f, readinto):
+    f.seek(0)
+    buf = bytearray(65536)
+    n = 0
+    while True:
+        k = f.readinto(buf) if readinto else len(f.read(65536))
+        if not k:
+            return n
+        n += k
+
+
+def scattered(f, offsets, readinto):
+    view = memoryview(bytearray(4096))
+    for offset in offsets:
+        f.seek(offset)
+        if readinto:
+            f.readinto(view)
+        else:
+            f.read(4096)
+
+
+def measure(fs, path, size, offsets, mapped):
+    rows = []
+    with fs.open(path, 'rb') as f:
+        assert (getattr(f, '_f', f)._map is not None) == mapped
+        for readinto in (False, True):
+            call = 'readinto' if readinto else 'read'
+            rows.append(('sequential 64 KB %s' % call, size / 1e6 / common.timed(sequential, f, readinto), 'MB/s'))
+            rows.append(('random 4 KB %s' % call, len(offsets) / common.timed(scattered, f, offsets, readinto),
+                         'reads/s'))
+    return rows
+
+
+def main(megabytes=64, reads=50000):
+    size = megabytes * 1024 * 1024
+    rng = random.Random(1)
+    offsets = [rng.randrange(0, size - 4096) for _ in range(reads)]
+    results = []
+    with common.scratch('mmap') as scratch:
+        path = os.path.join(scratch, 'big.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        # files changed in the current minute are never cached
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+        with common.quiet():
+            fs = common.make_fs(stream_reads=False)
+            results.append(('temp file', measure(fs, path, size, offsets, False)))
+            fs.close()
+            fs = common.make_fs(stream_reads=False, file_cache_bytes=2 * size, file_cache_dir=os.path.join(scratch, 'cache'),
+                                dircache_ttl=None)
+            fs.open(path, 'rb').close()
+            results.append(('mapped cache', measure(fs, path, size, offsets, True)))
+            fs.close()
+    print('%d MB file, %d random reads' % (megabytes, reads))
+    for source, rows in results:
+        for name, value, unit in rows:
+            print('%-14s %-22s %12.1f %s' % (source, name, value, unit))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,59 @@
+"""Random 4 KB reads of a large device file: the ranged block reads of a
+streamed ``_ADBFile`` against pulling the whole file first.
+
+    python benchmarks/bench_ranged_reads.py [file MB] [reads]
+"""
+import os
+import random
+import sys
+
+import common
+
+
+def random_reads(fs, path, offsets, stream_reads):
+    fs.stream_reads = stream_reads
+    with fs.open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            f.read(4096)
+
+
+def count_blocks(fs, moved):
+    """Add the bytes that ranged reads fetch from the device to ``moved``."""
+    read_blocks = fs._adb.read_blocks
+
+    def counted(*args):
+        data = read_blocks(*args)
+        moved[0] += len(data)
+        return data
+    fs._adb.read_blocks = counted
+
+
+def main(megabytes=64, reads=200):
+    size = megabytes * 1024 * 1024
+    rng = random.Random(1)
+    offsets = [rng.randrange(0, size - 4096) for _ in range(reads)]
+    rows = []
+    with common.scratch('ranged') as device:
+        path = os.path.join(device, 'big.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        for transport in ('subprocess', 'socket'):
+            moved = [0]
+            with common.quiet():
+                fs = common.make_fs(transport)
+                count_blocks(fs, moved)
+                ranged = common.timed(random_reads, fs, path, offsets, True)
+                pulled = common.timed(random_reads, fs, path, offsets, False)
+                fs.close()
+            rows.append(('%s ranged reads' % transport, reads / ranged, moved[0]))
+            rows.append(('%s full pull, then reads' % transport, reads / pulled, size))
+    print('%d random 4 KB reads of a %d MB file' % (reads, megabytes))
+    # the fake device is the local disk, where a whole pull is cheap; on a
+    # phone the bytes moved over USB decide
+    for name, rate, nbytes in rows:
+        print('%-30s %8.1f reads/s %8.1f MB moved' % (name, rate, nbytes / 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
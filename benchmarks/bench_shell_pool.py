@@ -0,0 +1,51 @@
+"""Shell calls per second: one ``adb shell`` spawned per command, as
+``ADBFS._adb_get`` used to do, against the pool of persistent sessions.
+
+    python benchmarks/bench_shell_pool.py [calls]
+"""
+import subprocess
+import sys
+import threading
+
+import common
+import adbfs
+
+
+def spawn_per_call(command):
+    back = subprocess.Popen('adb shell', shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    back.stdin.write(command.encode('utf-8') + b';exit\n')
+    back.communicate()
+
+
+def threaded(call, calls, threads=4):
+    def work():
+        for _ in range(calls // threads):
+            call()
+    ts = [threading.Thread(target=work) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+
+
+def main(calls=200):
+    command = 'ls -l -d /'
+    subprocess_pool = adbfs._SubprocessTransport(4)
+    socket_pool = adbfs._SocketTransport(4, port=common.server().port)
+    for pool in (subprocess_pool, socket_pool):
+        pool.shell(command)
+    spawn_calls = max(10, calls // 10)
+    rows = [
+        ('spawn per call', spawn_calls / common.timed(lambda: [spawn_per_call(command) for _ in range(spawn_calls)])),
+        ('subprocess session pool', calls / common.timed(lambda: [subprocess_pool.shell(command) for _ in range(calls)])),
+        ('socket session pool', calls / common.timed(lambda: [socket_pool.shell(command) for _ in range(calls)])),
+        ('subprocess pool, 4 threads', calls / common.timed(threaded, lambda: subprocess_pool.shell(command), calls)),
+        ('socket pool, 4 threads', calls / common.timed(threaded, lambda: socket_pool.shell(command), calls)),
+    ]
+    subprocess_pool.close()
+    socket_pool.close()
+    common.report(rows, 'calls/s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
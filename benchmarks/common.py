@@ -0,0 +1,64 @@
+"""Shared set-up of the benchmarks.
+
+They run against the fake device of the tests, so no phone is needed: the
+``adb`` of ``tests/fakeadb`` for the subprocess transport and a
+`FakeADBServer` for the socket transport, both serving the host filesystem.
+Absolute numbers say little about a real device; the ratios are the point.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+FAKE_ADB = os.path.join(ROOT, 'tests', 'fakeadb')
+os.environ['PATH'] = os.pathsep.join([os.path.join(FAKE_ADB, 'bin'), FAKE_ADB, os.environ['PATH']])
+
+from adbclient import FakeADBServer
+
+_server = None
+
+
+def server():
+    global _server
+    if _server is None:
+        _server = FakeADBServer().start()
+    return _server
+
+
+def quiet():
+    """Swallow the debug prints of adbfs."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def make_fs(transport='socket', **kwargs):
+    import adbfs
+    kwargs.setdefault('dircacheall', False)
+    kwargs.setdefault('file_cache_bytes', 0)
+    return adbfs.ADBFS(transport=transport, adb_port=server().port, **kwargs)
+
+
+@contextlib.contextmanager
+def scratch(name):
+    """A scratch directory, which is both the device and the host side."""
+    path = tempfile.mkdtemp(prefix='adbfs-bench-%s-' % name)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def report(rows, unit):
+    width = max(len(name) for name, value in rows)
+    for name, value in rows:
+        print('%-*s %12.1f %s' % (width, name, value, unit))
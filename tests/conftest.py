@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+try:
+    import fs
+except ImportError:
+    # adbfs is built on pyfilesystem 0.5
+    collect_ignore_glob = ['test_*.py']
+else:
+    from adbclient import FakeADBServer
+    import adbfs
+
+# the fake adb binary and the toolbox style ls of the fake device
+FAKE_ADB = os.path.join(HERE, 'fakeadb')
+os.environ['PATH'] = os.pathsep.join([os.path.join(FAKE_ADB, 'bin'), FAKE_ADB, os.environ['PATH']])
+
+
+@pytest.fixture(scope='session')
+def adb_server():
+    server = FakeADBServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def device(tmp_path):
+    """A directory of the fake device; device and host paths are the same."""
+    path = tmp_path / 'device'
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture(params=['subprocess', 'socket'])
+def transport(request):
+    return request.param
+
+
+@pytest.fixture
+def make_fs(adb_server, tmp_path):
+    made = []
+
+    def make(transport='socket', **kwargs):
+        kwargs.setdefault('dircacheall', False)
+        kwargs.setdefault('file_cache_bytes', 0)
+        kwargs.setdefault('journal_dir', str(tmp_path / 'journal'))
+        kwargs.setdefault('file_cache_dir', str(tmp_path / 'cache'))
+        fs = adbfs.ADBFS(transport=transport, adb_port=adb_server.port, **kwargs)
+        made.append(fs)
+        return fs
+    yield make
+    for fs in made:
+        fs.close()
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from adbclient import ADBClient, ADBError
+
+
+@pytest.fixture
+def client(adb_server):
+    client = ADBClient(port=adb_server.port)
+    yield client
+    client.close()
+
+
+def test_shell(client):
+    assert client.shell('echo hi') == b'hi\n'
+
+
+def test_push_pull_stat(client, tmp_path):
+    path = str(tmp_path / 'f.bin')
+    data = os.urandom(200000)
+    client.push(data, path)
+    assert bytes(client.pull(path)) == data
+    assert b''.join(client.iter_pull(path)) == data
+    assert client.stat(path)[1] == len(data)
+
+
+def test_sync_connection_dropped_after_fail(client, tmp_path):
+    path = str(tmp_path / 'f.bin')
+    client.push(b'data', path)
+    # RECV of a directory and SEND into a missing one get a FAIL, after
+    # which adbd ends the sync service
+    for fail in (lambda: list(client.iter_pull(str(tmp_path))),
+                 lambda: client.push(b'x', str(tmp_path / 'missing' / 'f'))):
+        with pytest.raises(ADBError):
+            fail()
+        assert bytes(client.pull(path)) == b'data'
+        assert client.stat(path)[1] == 4
+    assert len(client._sync) == 1
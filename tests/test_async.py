@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('fs')
+import adbfs
+
+
+class Writer(object):
+
+    def __init__(self, fail=False):
+        self.lines = []
+        self.fail = fail
+        self.closed = False
+
+    def write(self, data):
+        if self.fail:
+            raise IOError('broken pipe')
+        self.lines.append(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def session(writer=None):
+    reader = asyncio.StreamReader()
+    return reader, adbfs._AsyncShellSession(reader, writer or Writer())
+
+
+def answer(reader, s, out, code=0):
+    reader.feed_data(out + b'\n\n' + s.marker + b' %d\n' % code)
+
+
+def test_cancelled_caller_keeps_the_session_in_step():
+    async def main():
+        reader, s = session()
+        first = asyncio.ensure_future(s.run('sleep 1; echo a'))
+        second = asyncio.ensure_future(s.run('echo b'))
+        await asyncio.sleep(0)
+        first.cancel()
+        answer(reader, s, b'a')
+        answer(reader, s, b'b')
+        assert await second == (b'b\n', 0)
+        assert s.alive()
+        third = asyncio.ensure_future(s.run('echo c'))
+        await asyncio.sleep(0)
+        answer(reader, s, b'c')
+        assert await third == (b'c\n', 0)
+        await s.close()
+    asyncio.run(main())
+
+
+def test_marker_nobody_waits_for_fails_the_session():
+    async def main():
+        reader, s = session()
+        answer(reader, s, b'stray')
+        await asyncio.sleep(0.01)
+        assert not s.alive()
+        assert s._task.done() and s._task.exception() is None
+        assert s.writer.closed
+        with pytest.raises(EOFError):
+            await s.run('echo a')
+        await s.close()
+    asyncio.run(main())
+
+
+def test_failed_write_fails_the_waiting_commands():
+    async def main():
+        reader, s = session()
+        first = asyncio.ensure_future(s.run('echo a'))
+        await asyncio.sleep(0)
+        s.writer.fail = True
+        with pytest.raises(EOFError):
+            await asyncio.wait_for(s.run('echo b'), 5)
+        with pytest.raises(EOFError):
+            await asyncio.wait_for(first, 5)
+        await s.close()
+    asyncio.run(main())
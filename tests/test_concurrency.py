@@ -0,0 +1,115 @@
+import os
+import random
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('fs')
+from fs.errors import FSError
+
+
+def run_threads(targets, timeout=60):
+    errors = []
+
+    def call(target):
+        try:
+            target()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call, args=(target,)) for target in targets]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join(timeout)
+    assert not any(t.is_alive() for t in threads), 'deadlock'
+    return errors
+
+
+def test_recursive_removedir_races_force_removedir(make_fs, device):
+    fs = make_fs(shell_pool_size=4)
+    top = os.path.join(device, 'a')
+    os.makedirs(os.path.join(top, 'b'))
+    os.makedirs(os.path.join(top, 'd'))
+    # hold removedir('a/b') on its rmdir, with the lock of a/b taken, until
+    # removedir('a') runs
+    removing_b = threading.Event()
+    adb_get = fs._adb_get
+
+    def slow_adb_get(command):
+        if command.startswith('rmdir ') and command.endswith('/a/b'):
+            removing_b.set()
+            time.sleep(0.5)
+        return adb_get(command)
+    fs._adb_get = slow_adb_get
+
+    def remove_top():
+        removing_b.wait(10)
+        fs.removedir(top, force=True)
+    errors = run_threads([lambda: fs.removedir(top + '/b', recursive=True), remove_top])
+    assert all(isinstance(e, FSError) for e in errors)
+    assert not os.path.exists(top)
+
+
+def test_mixed_operations_from_many_threads(make_fs, transport, device):
+    fs = make_fs(transport, shell_pool_size=4, dircache_ttl=0.2)
+    for d in range(4):
+        os.makedirs(os.path.join(device, 'd%d' % d))
+        for i in range(10):
+            with open(os.path.join(device, 'd%d' % d, 'f%d' % i), 'wb') as f:
+                f.write(b'x' * (i * 100 + 1))
+
+    def worker(seed):
+        r = random.Random(seed)
+        for n in range(25):
+            d = os.path.join(device, 'd%d' % r.randrange(4))
+            name = 'f%d' % r.randrange(10)
+            op = r.random()
+            if op < 0.3:
+                assert fs.isfile(d + '/' + name)
+                assert not fs.exists(d + '/missing')
+            elif op < 0.5:
+                assert set('f%d' % i for i in range(10)) <= set(fs.listdir(d))
+            elif op < 0.7:
+                assert fs.getsize(d + '/' + name) == int(name[1:]) * 100 + 1
+            elif op < 0.8:
+                assert len(fs.getcontents(d + '/' + name)) == int(name[1:]) * 100 + 1
+            else:
+                path = d + '/w%d_%d' % (seed, n)
+                fs.setcontents(path, b'y' * r.randrange(1, 5000))
+                assert fs.getsize(path) > 0
+                fs.rename(path, path + 'r')
+                fs.remove(path + 'r')
+    errors = run_threads([lambda seed=seed: worker(seed) for seed in range(8)])
+    assert not errors
+
+
+def test_concurrent_misses_share_one_fetch_per_directory(make_fs, transport, device):
+    fs = make_fs(transport, shell_pool_size=4)
+    dirs = [os.path.join(device, 'd%d' % d) for d in range(4)]
+    for d in dirs:
+        os.makedirs(d)
+        for i in range(5):
+            with open(os.path.join(d, 'f%d' % i), 'wb') as f:
+                f.write(b'x' * i)
+    # a slow device, so that the misses of all threads overlap
+    fetch_dir = fs._fetch_dir
+
+    def slow_fetch_dir(path):
+        time.sleep(0.2)
+        return fetch_dir(path)
+    fs._fetch_dir = slow_fetch_dir
+    start = threading.Barrier(10)
+
+    def worker(k):
+        start.wait()
+        for d in dirs[k % 4:] + dirs[:k % 4]:
+            assert fs.isfile(d + '/f%d' % (k % 5))
+            assert fs.getsize(d + '/f3') == 3
+            assert len(fs.listdir(d)) == 5
+    assert not run_threads([lambda k=k: worker(k) for k in range(10)])
+    stats = fs.dircache_stats()
+    # one ls -l per directory, and one of their parent for listdir's isdir
+    assert stats['fetches'] == len(dirs) + 1
+    assert stats['fetches_suppressed'] > 0
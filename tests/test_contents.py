@@ -0,0 +1,122 @@
+import os
+import random
+
+import pytest
+
+pytest.importorskip('fs')
+
+# bytes a pty or a shell here-document would mangle: newlines, CR/LF,
+# ^D, NUL and the ^C / ^Z / ESC line discipline characters
+SPECIAL = [b'\n', b'\r\n', b'\r', b'\x04', b'\0', b'\x03', b'\x1a', b'\x1b', b'\xff']
+
+
+def payload(seed, size):
+    r = random.Random(seed)
+    parts = []
+    while size > 0:
+        part = r.choice(SPECIAL) if r.random() < 0.3 else os.urandom(min(size, r.randrange(1, 300)))
+        parts.append(part[:size])
+        size -= len(part)
+    return b''.join(parts)
+
+
+SIZES = [0, 1, 2, 4095, 4096, 65536, 65537, 1024 * 1024 + 3]
+
+
+@pytest.mark.parametrize('compress', [None, 'auto'])
+def test_setcontents_getcontents_round_trip(make_fs, transport, device, compress):
+    fs = make_fs(transport, compress=compress)
+    for seed, size in enumerate(SIZES):
+        data = payload(seed, size)
+        path = os.path.join(device, 'f%d.bin' % seed)
+        fs.setcontents(path, data)
+        with open(path, 'rb') as f:
+            assert f.read() == data, size
+        assert fs.getcontents(path) == data, size
+        assert fs.getsize(path) == size
+
+
+def test_only_special_bytes(make_fs, transport, device):
+    fs = make_fs(transport)
+    data = b''.join(SPECIAL) * 1000
+    path = os.path.join(device, 'special.bin')
+    fs.setcontents(path, data)
+    assert fs.getcontents(path) == data
+
+
+@pytest.mark.parametrize('stream_reads', [True, False])
+def test_open_read_write_round_trip(make_fs, transport, device, stream_reads):
+    fs = make_fs(transport, stream_reads=stream_reads)
+    data = payload(99, 300000)
+    path = os.path.join(device, 'opened.bin')
+    with fs.open(path, 'wb') as f:
+        f.write(data)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    with fs.open(path, 'rb') as f:
+        assert f.read() == data
+
+
+def log_lines(size):
+    line = b'2024-03-01 12:00:00.000  1234  5678 I ActivityManager: Start proc com.example.app\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def record(fs, monkeypatch):
+    """Log the tools that compressed transfers of ``fs`` run."""
+    commands = []
+    for name in ('exec_in', 'exec_out'):
+        def logged(command, *args, _call=getattr(fs._adb, name)):
+            if command.split()[0] in ('gzip', 'lz4'):
+                commands.append(command.split()[0])
+            return _call(command, *args)
+        monkeypatch.setattr(fs._adb, name, logged)
+    return commands
+
+
+def test_auto_prefers_lz4(make_fs, transport, device, monkeypatch):
+    import adbfs
+    if adbfs.lz4frame is None:
+        pytest.skip('no lz4 package on the host')
+    fs = make_fs(transport, compress='auto')
+    if 'lz4' not in fs._adb_text(adbfs._CODEC_PROBE).split():
+        pytest.skip('no lz4 on the device')
+    commands = record(fs, monkeypatch)
+    data = log_lines(100000)
+    path = os.path.join(device, 'app.log')
+    fs.setcontents(path, data)
+    assert fs.getcontents(path) == data
+    assert commands == ['lz4', 'lz4']
+
+
+def test_auto_falls_back_to_gzip(make_fs, transport, device, monkeypatch):
+    import adbfs
+    fs = make_fs(transport, compress='auto')
+    fs._device_codecs = adbfs._codecs_on_device('gzip\n')
+    commands = record(fs, monkeypatch)
+    data = log_lines(100000)
+    path = os.path.join(device, 'app.log')
+    fs.setcontents(path, data)
+    assert fs.getcontents(path) == data
+    assert commands == ['gzip', 'gzip']
+
+
+@pytest.mark.parametrize('name, data', [
+    # compressed formats go raw by their extension
+    ('photo.jpg', log_lines(100000)),
+    # and anything else whose sample does not compress
+    ('random.bin', os.urandom(100000)),
+    # small writes are not worth it
+    ('small.log', log_lines(100)),
+], ids=['extension', 'sample', 'size'])
+def test_raw_bypass(make_fs, transport, device, monkeypatch, name, data):
+    fs = make_fs(transport, compress='auto')
+    commands = record(fs, monkeypatch)
+    path = os.path.join(device, name)
+    fs.setcontents(path, data)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert commands == []
+    if name.endswith('.jpg'):
+        assert fs.getcontents(path) == data
+        assert commands == []
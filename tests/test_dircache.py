@@ -0,0 +1,168 @@
+import os
+
+import pytest
+
+pytest.importorskip('fs')
+import adbfs
+
+
+def test_token_refuses_listings_invalidated_after_it():
+    cache = adbfs._DirCache()
+    token = cache.token()
+    cache.pop('/a')
+    cache.pop_tree(['/t'])
+    assert not cache.put('/a', {}, token)
+    assert not cache.put('/t', {}, token)
+    assert not cache.put('/t/x/y', {}, token)
+    assert cache.put('/b', {}, token)
+    assert cache.put('/tx', {}, token)
+    assert cache.put('/a', {}, cache.token('/a'))
+
+
+def test_path_token():
+    cache = adbfs._DirCache()
+    token = cache.token('/a')
+    cache.pop('/b')
+    assert cache.put('/a', {}, token)
+    cache.pop('/a')
+    assert not cache.put('/a', {}, token)
+
+
+def test_old_tokens_refused_once_tree_history_is_gone():
+    cache = adbfs._DirCache()
+    token = cache.token()
+    for i in range(cache._trees.maxlen + 1):
+        cache.pop_tree(['/t%d' % i])
+    assert not cache.put('/b', {}, token)
+    assert cache.put('/b', {}, cache.token())
+
+
+def test_tree_walk_keeps_no_listing_invalidated_during_it(make_fs, transport, device):
+    for name in ('a', 'b', 'c'):
+        os.makedirs(os.path.join(device, name))
+    fs = make_fs(transport)
+    exec_out = fs._adb.exec_out
+
+    def exec_out_then_write(command, *args):
+        chunks = list(exec_out(command, *args))
+        # a local write lands after ls -R listed the tree
+        open(os.path.join(device, 'b', 'new'), 'w').close()
+        fs.refresh_dircache(os.path.join(device, 'b'))
+        return iter(chunks)
+    fs._adb.exec_out = exec_out_then_write
+    fs._cache_all(device)
+    assert os.path.join(device, 'a') in fs.dircache
+    assert os.path.join(device, 'b') not in fs.dircache
+    assert fs.listdir(os.path.join(device, 'b')) == ['new']
+
+
+def listing(n):
+    return dict(('f%d' % i, adbfs._DirEntry('f%d' % i)) for i in range(n))
+
+
+def test_least_recently_used_listing_is_evicted():
+    cache = adbfs._DirCache(max_entries=3)
+    for path in ('/a', '/b', '/c'):
+        cache.put(path, listing(1))
+    cache.get('/a')
+    cache.put('/d', listing(1))
+    assert sorted(cache.keys()) == ['/a', '/c', '/d']
+    assert cache.evictions == 1
+
+
+def test_byte_budget_evicts_oldest():
+    cache = adbfs._DirCache()
+    size = cache._dirlist_size(listing(100))
+    cache.max_bytes = 2 * size + size // 2
+    for path in ('/a', '/b', '/c'):
+        cache.put(path, listing(100))
+    assert sorted(cache.keys()) == ['/b', '/c']
+    assert cache.nbytes == 2 * size
+    # one listing bigger than the whole budget is not kept
+    cache.put('/big', listing(1000))
+    assert '/big' not in cache
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_expired_listing_is_a_miss(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(adbfs.time, 'time', lambda: now[0])
+    cache = adbfs._DirCache(ttl=60)
+    cache.put('/a', listing(1))
+    now[0] += 59
+    assert cache.get('/a') is not None
+    now[0] += 2
+    assert cache.get('/a') is None
+    assert '/a' not in cache
+    assert (cache.hits, cache.misses, cache.expirations) == (1, 1, 1)
+    assert cache.nbytes == 0
+
+
+def test_concurrent_lookups_count_every_hit():
+    import threading
+    cache = adbfs._DirCache(ttl=None)
+    paths = ['/d%d' % i for i in range(50)]
+    for path in paths:
+        cache.put(path, listing(1))
+    lookups = 2000
+
+    def look():
+        for i in range(lookups):
+            assert cache.get(paths[i % len(paths)]) is not None
+    threads = [threading.Thread(target=look) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.hits == 8 * lookups
+    assert len(cache._entries) == len(paths)
+
+
+def make_tree(root):
+    for d in ('a', 'a/b', 'c', 'ünï cødé'):
+        os.makedirs(os.path.join(root, d))
+        for i in range(40):
+            open(os.path.join(root, d, 'f %d é.txt' % i), 'w').close()
+    os.symlink('a', os.path.join(root, 'link'))
+
+
+def ls_recursive(fs, path):
+    return b''.join(fs._adb.exec_out('ls -l -R %s 2>/dev/null' % adbfs._quote(path)))
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 4096, 1 << 20])
+def test_streamed_parse_matches_whole_parse(make_fs, device, chunk):
+    make_tree(device)
+    out = ls_recursive(make_fs(), device)
+    parser = adbfs.ADBListDataParser()
+    chunks = (out[i:i + chunk] for i in range(0, len(out), chunk))
+    streamed = list(parser.parse_recursive_stream(chunks))
+    whole = list(parser.parse_recursive(out.decode('utf-8')))
+    assert [path for path, dirlist in streamed] == [path for path, dirlist in whole]
+    assert len(streamed) == 5
+    for (path, got), (_, want) in zip(streamed, whole):
+        assert dict((k, v.copy()) for k, v in got.items()) == dict((k, v.copy()) for k, v in want.items())
+
+
+def test_cache_all_publishes_directories_as_they_arrive(make_fs, transport, device):
+    make_tree(device)
+    fs = make_fs(transport)
+    out = ls_recursive(fs, device)
+    first = out.index(b'\n\n') + 2
+    seen = []
+
+    def exec_out(command, *args):
+        yield out[:first]
+        # the next chunk is only asked for once the first block is cached
+        seen.append(len(fs.dircache))
+        yield out[first:]
+    fs._adb.exec_out = exec_out
+    fs._cache_all(device)
+    assert seen == [1]
+    assert len(fs.dircache) == 5
+    for d in ('a', 'a/b', 'c', 'ünï cødé'):
+        assert len(fs.dircache.get(os.path.join(device, d))) == 40 + (d == 'a')
+    # served from the cache, without a listing
+    fetches = fs.dircache_stats()['fetches']
+    assert sorted(fs.listdir(os.path.join(device, 'c'))) == sorted('f %d é.txt' % i for i in range(40))
+    assert fs.dircache_stats()['fetches'] == fetches
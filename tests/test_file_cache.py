@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('fs')
+
+
+def write(path, data, mtime):
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def read(fs, path):
+    # a fresh listing, as after a dircache TTL or clear_dircache()
+    fs.clear_dircache()
+    with fs.open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('stream_reads', [True, False])
+def test_same_size_rewrite_in_same_minute_is_a_miss(make_fs, transport, device, stream_reads):
+    fs = make_fs(transport, file_cache_bytes=1 << 20, stream_reads=stream_reads)
+    path = os.path.join(device, 'photo.jpg')
+    minute = (int(time.time()) // 60 - 5) * 60
+    write(path, b'a' * 5000, minute + 10)
+    assert read(fs, path) == b'a' * 5000
+    assert len(fs._fcache._entries) == 1
+    # ls -l shows the same size and minute
+    write(path, b'b' * 5000, minute + 40)
+    assert read(fs, path) == b'b' * 5000
+
+
+def test_unchanged_file_is_served_from_cache(make_fs, transport, device):
+    fs = make_fs(transport, file_cache_bytes=1 << 20, stream_reads=False)
+    path = os.path.join(device, 'old.bin')
+    write(path, os.urandom(5000), time.time() - 3600)
+    data = read(fs, path)
+    cached = fs._fcache.get(path, 5000, int(os.path.getmtime(path)))
+    assert cached is not None
+    with open(cached, 'rb') as f:
+        assert f.read() == data
+    assert read(fs, path) == data
+    assert len(fs._fcache._entries) == 1
+
+
+def test_recently_changed_file_is_not_cached(make_fs, transport, device):
+    fs = make_fs(transport, file_cache_bytes=1 << 20)
+    path = os.path.join(device, 'new.bin')
+    write(path, b'x' * 5000, time.time())
+    assert read(fs, path) == b'x' * 5000
+    assert not fs._fcache or not fs._fcache._entries
+    with open(path, 'wb') as f:
+        f.write(b'y' * 5000)
+    assert read(fs, path) == b'y' * 5000
+
+
+def test_only_a_cached_path_is_stat_ed_at_open(make_fs, transport, device):
+    fs = make_fs(transport, file_cache_bytes=1 << 20)
+    path = os.path.join(device, 'old.bin')
+    data = os.urandom(5000)
+    write(path, data, time.time() - 3600)
+    commands = []
+    adb_text = fs._adb_text
+
+    def logged(command):
+        commands.append(command)
+        return adb_text(command)
+    fs._adb_text = logged
+
+    def stats():
+        return [c for c in commands if c.startswith('stat -c') and path in c]
+    with fs.open(path, 'rb') as f:
+        assert f.read(10) == data[:10]
+    assert stats() == []
+    # read to the end, the copy is stat'ed once as it goes in the cache
+    assert read(fs, path) == data
+    assert len(stats()) == 1
+    assert read(fs, path) == data
+    assert len(stats()) == 2
+    assert len(fs._fcache._entries) == 1
+
+
+def cache_file(cache, path, data):
+    part = cache.new_part()
+    with open(part, 'wb') as f:
+        f.write(data)
+    return cache.add(path, len(data), 1000, part)
+
+
+def test_processes_sharing_the_root_keep_each_others_files(tmp_path):
+    import adbfs
+    root = str(tmp_path / 'cache')
+    first = adbfs._FileCache(root, 1 << 20, 'serial')
+    second = adbfs._FileCache(root, 1 << 20, 'serial')
+    # a copy the first is still writing
+    writing = first.new_part()
+    old = first.new_part()
+    os.utime(old, (time.time() - 2 * first.part_grace,) * 2)
+    cache_file(first, '/sdcard/a', b'a' * 100)
+    cache_file(second, '/sdcard/b', b'b' * 100)
+    third = adbfs._FileCache(root, 1 << 20, 'serial')
+    assert third.get('/sdcard/a', 100, 1000) is not None
+    assert third.get('/sdcard/b', 100, 1000) is not None
+    assert os.path.exists(writing)
+    assert not os.path.exists(old)
+    # a file another process dropped is a miss, not an error
+    third.invalidate('/sdcard/a')
+    assert first.get('/sdcard/a', 100, 1000) is None
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+pytest.importorskip('fs')
+from fs.errors import FSError
+from adbclient import FakeADBServer
+import adbfs
+
+SERIALS = ['dev1', '192.168.1.5:5555']
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = FakeADBServer(serial=SERIALS).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def kwargs(server, tmp_path):
+    return dict(transport='socket', adb_port=server.port, dircacheall=False, file_cache_bytes=0,
+                journal_dir=str(tmp_path / 'journal'), file_cache_dir=str(tmp_path / 'cache'))
+
+
+def test_list_devices(server):
+    assert adbfs.list_devices('socket', adb_port=server.port) == SERIALS
+
+
+def test_subprocess_transport_passes_the_serial():
+    assert adbfs._adb_args('dev1') == ['adb', '-s', 'dev1']
+    assert adbfs._adb_args() == ['adb']
+
+
+def test_commands_go_to_the_given_serial(kwargs, device):
+    open(os.path.join(device, 'f'), 'w').close()
+    fs = adbfs.ADBFS(serial='dev1', **kwargs)
+    try:
+        assert fs.listdir(device) == ['f']
+        assert fs.journal_dir.endswith(os.sep + 'dev1')
+    finally:
+        fs.close()
+    fs = adbfs.ADBFS(serial='192.168.1.5:5555', **kwargs)
+    try:
+        assert fs.exists(os.path.join(device, 'f'))
+        # made safe as a directory name
+        assert fs.file_cache_dir.endswith(os.sep + '192.168.1.5_5555')
+    finally:
+        fs.close()
+
+
+@pytest.mark.parametrize('serial', [None, 'missing'])
+def test_no_or_unknown_serial_with_many_devices_fails(kwargs, device, serial):
+    fs = adbfs.ADBFS(serial=serial, **kwargs)
+    try:
+        with pytest.raises((FSError, adbfs.ADBError)):
+            fs.listdir(device)
+    finally:
+        fs.close()
+
+
+def test_every_device_is_a_directory(kwargs, device):
+    with open(os.path.join(device, 'f.txt'), 'wb') as f:
+        f.write(b'data')
+    multi = adbfs.MultiADBFS(**kwargs)
+    try:
+        assert list(multi.devices) == SERIALS
+        assert sorted(multi.listdir('/')) == sorted(['dev1', '192.168.1.5_5555'])
+        for name in ('dev1', '192.168.1.5_5555'):
+            assert multi.getcontents('/%s%s/f.txt' % (name, device)) == b'data'
+        multi.remove_device('dev1')
+        assert multi.listdir('/') == ['192.168.1.5_5555']
+    finally:
+        for fs in multi.devices.values():
+            fs.close()
+
+
+def test_fan_out_reports_per_device_and_isolates_failures(kwargs, device, tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    for i in range(5):
+        (src / ('f%d' % i)).write_bytes(b'x' * i)
+    multi = adbfs.MultiADBFS(**kwargs)
+    try:
+        def broken(*args, **kwargs):
+            raise RuntimeError('device unplugged')
+        multi.devices['dev1'].push_dir = broken
+        seen = set()
+        results = multi.push_dir(str(src), os.path.join(device, 'dst'),
+                                 progress=lambda serial, *args: seen.add(serial))
+        assert list(results) == SERIALS
+        assert isinstance(results['dev1'], RuntimeError)
+        assert results['192.168.1.5:5555']['files'] == 5
+        assert seen == {'192.168.1.5:5555'}
+        assert sorted(os.listdir(os.path.join(device, 'dst'))) == ['f%d' % i for i in range(5)]
+        results = multi.pull_dir(os.path.join(device, 'dst'), str(tmp_path / 'pulled'))
+        for serial in SERIALS:
+            assert results[serial]['files'] == 5
+            name = adbfs._serial_name(serial)
+            assert sorted(os.listdir(str(tmp_path / 'pulled' / name))) == ['f%d' % i for i in range(5)]
+    finally:
+        for fs in multi.devices.values():
+            fs.close()
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+pytest.importorskip('fs')
+import adbfs
+
+
+def remember_missing(fs, path):
+    assert not fs.exists(path)
+    # the listing goes, as on eviction or expiry; the miss stays
+    fs.dircache.clear()
+    fetches = fs.dircache_stats()['fetches']
+    assert not fs.exists(path)
+    assert fs.dircache_stats()['fetches'] == fetches
+    assert fs.dircache_stats()['negative_saved'] >= 1
+
+
+def test_miss_is_answered_without_a_listing(make_fs, transport, device):
+    fs = make_fs(transport)
+    remember_missing(fs, os.path.join(device, 'desktop.ini'))
+    assert not fs.isfile(os.path.join(device, 'desktop.ini'))
+    assert not fs.isdir(os.path.join(device, 'desktop.ini'))
+
+
+def write_file(fs, src, path):
+    fs.setcontents(path, b'data')
+
+
+def open_file(fs, src, path):
+    with fs.open(path, 'wb') as f:
+        f.write(b'data')
+
+
+def make_dir(fs, src, path):
+    fs.makedir(path)
+
+
+def rename(fs, src, path):
+    fs.rename(src, path)
+
+
+def copy(fs, src, path):
+    fs.copy(src, path)
+
+
+@pytest.mark.parametrize('create', [write_file, open_file, make_dir, rename, copy])
+def test_creating_the_path_forgets_the_miss(make_fs, transport, device, create):
+    fs = make_fs(transport)
+    src = os.path.join(device, 'src.txt')
+    with open(src, 'wb') as f:
+        f.write(b'data')
+    path = os.path.join(device, 'new')
+    remember_missing(fs, path)
+    create(fs, src, path)
+    fs.dircache.clear()
+    assert fs.exists(path)
+
+
+def test_clear_dircache_forgets_the_misses_below(make_fs, transport, device):
+    fs = make_fs(transport)
+    path = os.path.join(device, 'sub', 'later.txt')
+    os.makedirs(os.path.dirname(path))
+    remember_missing(fs, path)
+    # made by something else on the device
+    open(path, 'w').close()
+    fs.clear_dircache(device)
+    assert fs.exists(path)
+
+
+def test_entries_expire_and_are_bounded(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(adbfs.time, 'time', lambda: now[0])
+    cache = adbfs._NegativeCache(max_entries=2, ttl=30)
+    cache.add('/a')
+    cache.add('/b')
+    cache.add('/c')
+    assert '/a' not in cache and '/b' in cache and '/c' in cache
+    now[0] += 31
+    assert '/b' not in cache
+    assert len(cache) == 1
@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('fs')
+import adbfs
+
+
+class FakeFS(object):
+
+    """ What `_Prefetcher` uses of an `ADBFS`, over a dict tree. """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.dircache = adbfs._DirCache(ttl=None)
+        self.fetched = []
+
+    def _fetch_listing(self, path):
+        self.fetched.append(path)
+        dirlist = dict((name, adbfs._DirEntry(name, try_cwd=True)) for name in self.tree.get(path, ()))
+        self.dircache.put(path, dirlist)
+        return dirlist
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def start(prefetcher):
+    t = threading.Thread(target=prefetcher._work)
+    t.daemon = True
+    prefetcher._threads.append(t)
+    t.start()
+
+
+def test_fetches_by_priority():
+    fs = FakeFS({})
+    prefetcher = adbfs._Prefetcher(fs, workers=0)
+    prefetcher.add('/tree', prefetcher.TREE)
+    prefetcher.add('/child', prefetcher.CHILD)
+    prefetcher.add('/opened', prefetcher.OPENED)
+    # queued again with a better priority, fetched once
+    prefetcher.add('/moved', prefetcher.TREE)
+    prefetcher.add('/moved', prefetcher.OPENED)
+    start(prefetcher)
+    wait_for(lambda: len(fs.fetched) == 4)
+    prefetcher.close()
+    assert fs.fetched == ['/opened', '/moved', '/child', '/tree']
+
+
+def test_subdirectories_of_an_opened_directory_come_first():
+    fs = FakeFS({'/o': ['a'], '/o/a': ['b'], '/o/a/b': [], '/t': []})
+    prefetcher = adbfs._Prefetcher(fs, workers=0)
+    prefetcher.add('/t', prefetcher.TREE)
+    prefetcher.opened('/o', {'a': adbfs._DirEntry('a', try_cwd=True),
+                             'f': adbfs._DirEntry('f'),
+                             'l': adbfs._DirEntry('l', try_cwd=True, target='/x')})
+    start(prefetcher)
+    wait_for(lambda: len(fs.fetched) == 3)
+    prefetcher.close()
+    # files and links are not listed
+    assert fs.fetched == ['/o/a', '/o/a/b', '/t']
+
+
+def test_waits_while_the_filesystem_is_busy():
+    fs = FakeFS({})
+    prefetcher = adbfs._Prefetcher(fs, workers=1)
+    prefetcher.enter()
+    prefetcher.add('/a', prefetcher.OPENED)
+    time.sleep(0.3)
+    assert fs.fetched == []
+    prefetcher.leave()
+    wait_for(lambda: fs.fetched == ['/a'])
+    prefetcher.close()
+
+
+def test_listing_warms_the_subdirectories(make_fs, transport, device):
+    for d in ('a/x', 'b'):
+        os.makedirs(os.path.join(device, d))
+    fs = make_fs(transport, prefetch=1)
+    fs.listdir(device)
+    for d in ('a', 'b', 'a/x'):
+        wait_for(lambda: os.path.join(device, d) in fs.dircache)
+    fetches = fs.dircache_stats()['fetches']
+    assert fs.listdir(os.path.join(device, 'a')) == ['x']
+    assert fs.dircache_stats()['fetches'] == fetches
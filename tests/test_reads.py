@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+pytest.importorskip('fs')
+
+
+def test_ranged_reads_see_a_same_size_rewrite(make_fs, transport, device):
+    fs = make_fs(transport)
+    path = os.path.join(device, 'big.bin')
+    # far enough that the seek leaves the stream for ranged reads
+    size = 32 * 65536
+    with open(path, 'wb') as f:
+        f.write(b'a' * size)
+    with fs.open(path, 'rb') as f:
+        f.seek(size // 2 + 10)
+        assert f.read(100) == b'a' * 100
+    with open(path, 'wb') as f:
+        f.write(b'b' * size)
+    fs.clear_dircache()
+    with fs.open(path, 'rb') as f:
+        f.seek(size // 2 + 10)
+        assert f.read(100) == b'b' * 100
+
+
+def lines_file(device, count=20000):
+    path = os.path.join(device, 'lines.txt')
+    data = b''.join(b'line %d %s\n' % (i, b'x' * (i % 50)) for i in range(count))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path, data
+
+
+def no_pull(fs):
+    def pull(*args):
+        raise AssertionError('the streamed file was pulled')
+    fs._adb.pull = pull
+
+
+def test_streamed_reads(make_fs, transport, device):
+    fs = make_fs(transport)
+    no_pull(fs)
+    path, data = lines_file(device)
+    with fs.open(path, 'rb') as f:
+        parts = [f.read(1), f.read(7), f.read(100000), f.read()]
+        assert f.read() == b''
+    assert b''.join(parts) == data
+    with fs.open(path, 'rb') as f:
+        assert f.readline() == data.split(b'\n')[0] + b'\n'
+        assert list(f) == data.splitlines(True)[1:]
+
+
+def test_short_forward_seek_stays_on_the_stream(make_fs, transport, device):
+    fs = make_fs(transport)
+    no_pull(fs)
+    path, data = lines_file(device)
+
+    def read_blocks(*args):
+        raise AssertionError('left the stream')
+    fs._adb.read_blocks = read_blocks
+    with fs.open(path, 'rb') as f:
+        f.read(10)
+        f.seek(70000)
+        assert f.tell() == 70000
+        assert f.read(50) == data[70000:70050]
+
+
+def test_stream_reader_buffers_at_most_readahead():
+    import threading
+    import time
+    import adbfs
+    produced = []
+    done = threading.Event()
+
+    def chunks():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield b'x' * 1024
+        finally:
+            done.set()
+    reader = adbfs._StreamReader(chunks(), readahead=2)
+    time.sleep(0.3)
+    # two queued, one waiting to be queued
+    assert len(produced) <= 3
+    assert reader.read(1500) == b'x' * 1500
+    reader.close()
+    assert done.wait(5)
+    assert len(produced) < 10
+
+
+def test_stream_error_is_raised_on_read():
+    import adbfs
+
+    def chunks():
+        yield b'abc'
+        raise IOError('device gone')
+    reader = adbfs._StreamReader(chunks())
+    assert reader.read(3) == b'abc'
+    with pytest.raises(IOError):
+        reader.read(1)
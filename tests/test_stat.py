@@ -0,0 +1,90 @@
+import datetime
+import functools
+import os
+import shlex
+
+import pytest
+
+pytest.importorskip('fs')
+import adbfs
+
+
+def test_arg_batches_split_under_the_limit():
+    paths = ['/sdcard/dir %d/it\'s "%d".txt' % (i, i) for i in range(500)]
+    batches = list(adbfs._arg_batches(paths, limit=1000))
+    assert len(batches) > 1
+    assert all(len(batch) <= 1000 for batch in batches)
+    assert [arg for batch in batches for arg in shlex.split(batch)] == paths
+    # a path longer than the limit still goes, alone
+    assert list(adbfs._arg_batches(['/' + 'x' * 2000, '/y'], limit=1000)) == ['/' + 'x' * 2000, '/y']
+
+
+def make_files(device, count=300):
+    paths = []
+    for i in range(count):
+        folder = os.path.join(device, 'dir %d' % (i % 30))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, "it's %d.txt" % i)
+        with open(path, 'wb') as f:
+            f.write(b'x' * i)
+        paths.append(path)
+    return paths
+
+
+def log_stats(fs):
+    commands = []
+    adb_text = fs._adb_text
+
+    def logged(command):
+        if command.startswith('stat '):
+            commands.append(command)
+        return adb_text(command)
+    fs._adb_text = logged
+    return commands
+
+
+def check(infos, paths):
+    for path in paths:
+        assert infos[path]['size'] == os.path.getsize(path)
+        assert infos[path]['modified_time'] == fs_time(path)
+
+
+def fs_time(path):
+    return datetime.datetime.fromtimestamp(int(os.path.getmtime(path)))
+
+
+def test_statmany_is_one_stat_call(make_fs, transport, device):
+    paths = make_files(device)
+    missing = os.path.join(device, 'dir 1', 'missing')
+    fs = make_fs(transport)
+    commands = log_stats(fs)
+    folder = os.path.join(device, 'dir 2')
+    infos = fs.statmany(paths + [missing, folder])
+    assert len(commands) == 1
+    assert sorted(infos) == sorted(paths + [folder])
+    check(infos, paths)
+    assert infos[folder]['size'] == 0
+
+
+def test_statmany_splits_long_command_lines(make_fs, transport, device, monkeypatch):
+    monkeypatch.setattr(adbfs, '_arg_batches', functools.partial(adbfs._arg_batches, limit=2000))
+    paths = make_files(device)
+    fs = make_fs(transport)
+    commands = log_stats(fs)
+    infos = fs.statmany(paths)
+    assert len(commands) > 1
+    assert all(len(command) < 2100 for command in commands)
+    assert sorted(infos) == sorted(paths)
+    check(infos, paths)
+
+
+def test_listdirinfo_is_answered_by_the_listing(make_fs, transport, device):
+    paths = make_files(device, 40)
+    fs = make_fs(transport)
+    commands = log_stats(fs)
+    folder = os.path.join(device, 'dir 3')
+    infos = dict(fs.listdirinfo(folder))
+    assert commands == []
+    assert sorted(infos) == sorted(os.listdir(folder))
+    for name, info in infos.items():
+        assert info['size'] == os.path.getsize(os.path.join(folder, name))
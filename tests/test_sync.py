@@ -0,0 +1,81 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('fs')
+import adbfs
+
+# well in the past, at the start of a minute
+MINUTE = (int(time.time()) // 60 - 60) * 60
+
+
+def write(path, data, mtime=MINUTE + 5):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def make_tree(root):
+    for i in range(12):
+        write(os.path.join(root, ('', 'sub', 'sub/deeper')[i % 3], 'f%d.txt' % i), b'x' * i)
+
+
+def test_changed_compares_mtimes_to_the_minute():
+    src = {'same': (10, MINUTE + 5), 'seconds': (10, MINUTE + 50), 'minute': (10, MINUTE + 65),
+           'size': (11, MINUTE + 5), 'new': (1, MINUTE)}
+    dst = {'same': (10, MINUTE + 5), 'seconds': (10, MINUTE), 'minute': (10, MINUTE + 5),
+           'size': (10, MINUTE + 5), 'gone': (1, MINUTE)}
+    assert adbfs._TransferEngine.changed(src, dst) == ['minute', 'new', 'size']
+
+
+@pytest.mark.parametrize('to_device', [False, True])
+def test_sync_sends_only_what_changed(make_fs, transport, tmp_path, device, to_device):
+    host = str(tmp_path / 'host')
+    src, dst = (host, device) if to_device else (device, host)
+    make_tree(src)
+    fs = make_fs(transport)
+    stats = fs.sync_dir(src, dst, to_device=to_device)
+    assert stats['files'] == 12
+    assert stats['checked'] == 12
+    assert fs.sync_dir(src, dst, to_device=to_device)['files'] == 0
+    # a new size, a later minute and a new file go; seconds within the
+    # same minute are not told apart
+    write(os.path.join(src, 'f0.txt'), b'longer')
+    write(os.path.join(src, 'sub', 'f1.txt'), b'y', MINUTE + 65)
+    write(os.path.join(src, 'sub', 'deeper', 'f2.txt'), b'zz', MINUTE + 30)
+    write(os.path.join(src, 'new', 'n.txt'), b'new')
+    fs.clear_dircache()
+    stats = fs.sync_dir(src, dst, to_device=to_device)
+    assert stats['files'] == 3
+    with open(os.path.join(dst, 'sub', 'f1.txt'), 'rb') as f:
+        assert f.read() == b'y'
+    with open(os.path.join(dst, 'new', 'n.txt'), 'rb') as f:
+        assert f.read() == b'new'
+    with open(os.path.join(dst, 'sub', 'deeper', 'f2.txt'), 'rb') as f:
+        assert f.read() == b'x' * 2
+
+
+@pytest.mark.parametrize('to_device', [False, True])
+def test_sync_delete(make_fs, transport, tmp_path, device, to_device):
+    host = str(tmp_path / 'host')
+    src, dst = (host, device) if to_device else (device, host)
+    make_tree(src)
+    make_tree(dst)
+    write(os.path.join(dst, 'extra.txt'), b'e')
+    write(os.path.join(dst, 'sub', 'extra.txt'), b'e')
+    write(os.path.join(dst, 'gone', 'deeper', 'extra.txt'), b'e')
+    fs = make_fs(transport)
+    assert fs.sync_dir(src, dst, to_device=to_device)['deleted'] == 0
+    assert os.path.exists(os.path.join(dst, 'extra.txt'))
+    fs.clear_dircache()
+    stats = fs.sync_dir(src, dst, to_device=to_device, delete=True)
+    # the extra directory goes with everything in it, counted once
+    assert stats['deleted'] == 3
+    assert stats['files'] == 0
+    found = sorted(os.path.relpath(os.path.join(d, name), dst)
+                   for d, dirs, names in os.walk(dst) for name in dirs + names)
+    want = sorted(os.path.relpath(os.path.join(d, name), src)
+                  for d, dirs, names in os.walk(src) for name in dirs + names)
+    assert found == want
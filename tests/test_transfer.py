@@ -0,0 +1,108 @@
+import io
+import os
+import tarfile
+import threading
+
+import pytest
+
+pytest.importorskip('fs')
+from fs.errors import FSError, OperationFailedError
+
+
+def make_tree(root):
+    files = {}
+    for d in ('', 'sub', 'sub/deeper', 'empty'):
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    for i in range(30):
+        rel = os.path.join(('', 'sub', 'sub/deeper')[i % 3], 'f%d.bin' % i)
+        data = os.urandom(i * 997)
+        with open(os.path.join(root, rel), 'wb') as f:
+            f.write(data)
+        files[rel] = data
+    return files
+
+
+def read_tree(root):
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                found[os.path.relpath(path, root)] = f.read()
+    return found
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_pull_and_push_dir(make_fs, transport, device, tmp_path, bulk):
+    fs = make_fs(transport)
+    files = make_tree(os.path.join(device, 'src'))
+    stats = fs.pull_dir(os.path.join(device, 'src'), str(tmp_path / 'pulled'), bulk=bulk)
+    assert stats['files'] == len(files)
+    assert read_tree(str(tmp_path / 'pulled')) == files
+    assert os.path.isdir(str(tmp_path / 'pulled' / 'empty'))
+    fs.push_dir(str(tmp_path / 'pulled'), os.path.join(device, 'pushed'), bulk=bulk)
+    assert read_tree(os.path.join(device, 'pushed')) == files
+
+
+def tar_stream(*members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for info, data in members:
+            tar.addfile(info, io.BytesIO(data) if data is not None else None)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('kind', [tarfile.LNKTYPE, tarfile.SYMTYPE])
+def test_pull_tar_refuses_links_out_of_the_target(make_fs, device, tmp_path, kind):
+    outside = tmp_path / 'outside.txt'
+    outside.write_bytes(b'keep')
+    link = tarfile.TarInfo('evil')
+    link.type = kind
+    link.linkname = str(outside)
+    payload = tarfile.TarInfo('evil')
+    payload.size = 5
+    fs = make_fs()
+    # what a hostile device could send for tar -c
+    fs._adb.exec_out = lambda command: iter([tar_stream((link, None), (payload, b'pwned'))])
+    os.makedirs(os.path.join(device, 'src'))
+    with pytest.raises(OperationFailedError):
+        fs.pull_dir(os.path.join(device, 'src'), str(tmp_path / 'pulled'), bulk=True)
+    assert outside.read_bytes() == b'keep'
+
+
+@pytest.fixture
+def thread_errors():
+    """Exceptions left unhandled in threads."""
+    errors = []
+    hook = threading.excepthook
+    threading.excepthook = lambda args: errors.append(args.exc_value)
+    yield errors
+    threading.excepthook = hook
+
+
+def test_push_tar_into_an_unwritable_target(make_fs, transport, device, tmp_path, thread_errors):
+    local = tmp_path / 'local'
+    local.mkdir()
+    # more than the writer's backlog, so the packer is still writing
+    (local / 'big.bin').write_bytes(os.urandom(4 * 1024 * 1024))
+    blocker = os.path.join(device, 'file')
+    open(blocker, 'w').close()
+    fs = make_fs(transport)
+    with pytest.raises(FSError):
+        fs.push_dir(str(local), os.path.join(blocker, 'sub'), bulk=True)
+    assert thread_errors == []
+
+
+def test_push_tar_raises_the_packing_error(make_fs, transport, device, tmp_path, thread_errors, monkeypatch):
+    local = tmp_path / 'local'
+    local.mkdir()
+    (local / 'a.bin').write_bytes(b'a')
+
+    def add(self, *args, **kwargs):
+        raise RuntimeError('unreadable')
+    monkeypatch.setattr(tarfile.TarFile, 'add', add)
+    fs = make_fs(transport)
+    with pytest.raises(Exception) as e:
+        fs.push_dir(str(local), os.path.join(device, 'dst'), bulk=True)
+    assert 'unreadable' in str(e.value)
+    assert thread_errors == []
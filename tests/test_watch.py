@@ -0,0 +1,132 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('fs')
+import adbfs
+
+
+def wait_for(check, timeout=10):
+    deadline = time.time() + timeout
+    while not check():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+def make_tree(device):
+    for name in ('a', 'b'):
+        os.mkdir(os.path.join(device, name))
+        with open(os.path.join(device, name, 'old.txt'), 'wb') as f:
+            f.write(b'old')
+    return os.path.join(device, 'a'), os.path.join(device, 'b')
+
+
+@pytest.fixture
+def watcher(make_fs, device):
+    """A watcher whose polls are far apart, fed events by hand."""
+    fs = make_fs()
+    watcher = adbfs._ChangeWatcher(fs, [device], interval=3600, mode='poll')
+    yield fs, watcher
+    watcher.close()
+
+
+def test_poll_sees_a_file_made_on_the_device(make_fs, device):
+    a, b = make_tree(device)
+    # the fake device has no inotifyd
+    fs = make_fs(watch=[device], watch_interval=0.1)
+    wait_for(lambda: fs._watcher._stamp is not None)
+    assert fs._watcher.mode == 'poll'
+    assert fs.listdir(a) == ['old.txt']
+    assert fs.listdir(b) == ['old.txt']
+    fetches = fs.dircache_stats()['fetches']
+    with open(os.path.join(a, 'new.txt'), 'wb') as f:
+        f.write(b'new')
+    wait_for(lambda: sorted(fs.listdir(a)) == ['new.txt', 'old.txt'])
+    assert fs._watcher.events
+    assert fs.dircache_stats()['device_changes'] == fs._watcher.events
+    # the other directory was not listed again
+    calls = fs.dircache_stats()['fetches']
+    assert fs.listdir(b) == ['old.txt']
+    assert fs.dircache_stats()['fetches'] == calls
+    assert calls > fetches
+
+
+def test_poll_drops_a_removed_subdirectory(make_fs, device):
+    a, b = make_tree(device)
+    os.mkdir(os.path.join(a, 'sub'))
+    fs = make_fs(watch=[device], watch_interval=0.1)
+    wait_for(lambda: fs._watcher._stamp is not None)
+    assert fs.listdir(os.path.join(a, 'sub')) == []
+    os.rmdir(os.path.join(a, 'sub'))
+    wait_for(lambda: os.path.join(a, 'sub') not in fs.dircache)
+    assert not fs.exists(os.path.join(a, 'sub'))
+
+
+def test_write_event_drops_the_file_and_its_directory(watcher, device):
+    fs, watcher = watcher
+    a, b = make_tree(device)
+    fs.listdir(a)
+    fs.listdir(b)
+    forgotten = []
+    fs._forget = forgotten.append
+    watcher._rescan.clear()
+    watcher._event('w\t%s\told.txt' % a)
+    assert forgotten == [os.path.join(a, 'old.txt')]
+    assert a not in fs.dircache
+    assert b in fs.dircache
+    assert watcher.events == 1
+    assert not watcher._rescan.is_set()
+
+
+def test_created_subfile_asks_for_a_rescan(watcher, device):
+    fs, watcher = watcher
+    a, b = make_tree(device)
+    fs.listdir(a)
+    watcher._rescan.clear()
+    watcher._event('n\t%s\tsub' % a)
+    assert watcher._rescan.is_set()
+    assert a not in fs.dircache
+
+
+def test_deleted_subdirectory_drops_the_listings_below(watcher, device):
+    fs, watcher = watcher
+    a, b = make_tree(device)
+    sub = os.path.join(a, 'sub')
+    os.mkdir(sub)
+    fs.listdir(a)
+    fs.listdir(sub)
+    fs.listdir(b)
+    watcher._event('d\t%s\tsub' % a)
+    assert sub not in fs.dircache
+    assert a not in fs.dircache
+    assert b in fs.dircache
+
+
+def test_unwatched_directory_is_watched_again(watcher, device):
+    fs, watcher = watcher
+    a, b = make_tree(device)
+    watcher._watched.update([a, b])
+    watcher._rescan.clear()
+    watcher._event('x\t%s' % a)
+    assert watcher._watched == {b}
+    assert watcher._rescan.is_set()
+
+
+def test_overflow_drops_everything(watcher, device):
+    fs, watcher = watcher
+    a, b = make_tree(device)
+    fs.listdir(a)
+    fs.listdir(b)
+    watcher._event('o\t%s' % a)
+    assert a not in fs.dircache
+    assert b not in fs.dircache
+
+
+def test_malformed_event_is_ignored(watcher, device):
+    fs, watcher = watcher
+    a, b = make_tree(device)
+    fs.listdir(a)
+    watcher._event('garbage')
+    assert a in fs.dircache
+    assert watcher.events == 0
@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('fs')
+from fs.errors import FSError
+
+
+def make_file(device, size=64 * 1024):
+    path = os.path.join(device, 'edit', 'data.bin')
+    os.makedirs(os.path.dirname(path))
+    data = bytearray(os.urandom(size))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path, data
+
+
+def test_dirty_ranges_written_back(make_fs, transport, device):
+    path, data = make_file(device)
+    fs = make_fs(transport)
+    with fs.open(path, 'r+b') as f:
+        f.seek(10000)
+        f.write(b'patched')
+        f.seek(50000)
+        f.write(b'\0\n\r\n' * 100)
+    data[10000:10007] = b'patched'
+    data[50000:50400] = b'\0\n\r\n' * 100
+    with open(path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_truncate_written_back(make_fs, transport, device):
+    path, data = make_file(device)
+    fs = make_fs(transport)
+    with fs.open(path, 'r+b') as f:
+        f.seek(100)
+        f.write(b'x')
+        f.truncate(30000)
+    data[100:101] = b'x'
+    with open(path, 'rb') as f:
+        assert f.read() == data[:30000]
+
+
+def test_failed_write_back_raises(make_fs, transport, device):
+    path, data = make_file(device)
+    fs = make_fs(transport)
+    f = fs.open(path, 'r+b')
+    f.seek(10000)
+    f.write(b'lost?')
+    # the target can no longer be written
+    shutil.rmtree(os.path.dirname(path))
+    with pytest.raises(FSError):
+        f.close()
+
+
+def test_big_file_written_back_in_one_push(make_fs, transport, device, monkeypatch):
+    fs = make_fs(transport)
+    path = os.path.join(device, 'big.bin')
+    data = os.urandom(5 * 1024 * 1024)
+
+    def push_file(*args):
+        raise AssertionError('close() went through the resumable push')
+    monkeypatch.setattr(fs, 'push_file', push_file)
+    with fs.open(path, 'wb') as f:
+        f.write(data)
+    with open(path, 'rb') as f:
+        assert f.read() == data